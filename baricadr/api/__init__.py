@@ -7,7 +7,7 @@ from celery.result import AsyncResult
 
 from email_validator import EmailNotValidError, validate_email
 
-from flask import (Blueprint, current_app, jsonify, make_response, request)
+from flask import (Blueprint, current_app, jsonify, make_response, request, send_file, url_for)
 
 
 api = Blueprint('api', __name__, url_prefix='/')
@@ -70,7 +70,7 @@ def list():
 
     asked_path = os.path.abspath(request.json['path'])
     repo = current_app.repos.get_repo(asked_path)
-    files = repo.remote_list(asked_path, missing=missing, max_depth=max_depth, from_root=from_root, full=full)
+    files = repo.cached_remote_list(asked_path, missing=missing, max_depth=max_depth, from_root=from_root, full=full)
 
     return jsonify(files)
 
@@ -105,12 +105,17 @@ def __pull_or_freeze(action, request):
     else:
         locking_task_id = current_app.repos.is_locked_by_subdir(asked_path)
 
-        task = current_app.celery.send_task(action, (asked_path, email, locking_task_id))
+        countdown = None
+        if action == 'pull' and current_app.config['PULL_COALESCE_WINDOW']:
+            # Give some time to other pull requests in the same repo, to run them in the same transfer
+            countdown = current_app.config['PULL_COALESCE_WINDOW']
+
+        task = current_app.celery.send_task(action, (asked_path, email, locking_task_id), countdown=countdown)
         task_id = task.task_id
         current_app.logger.info("Created %s task %s" % (action, task_id))
 
         # Save a reference to this task in db
-        pt = BaricadrTask(path=asked_path, type=action, task_id=task_id)
+        pt = BaricadrTask(path=asked_path, type=action, task_id=task_id, email=email)
         db.session.add(pt)
         db.session.commit()
 
@@ -132,7 +137,8 @@ def task_list():
             'status': rt.status,
             'created': rt.created,
             'started': rt.started,
-            'finished': rt.finished
+            'finished': rt.finished,
+            'progress': rt.get_progress()
         })
 
     return jsonify(tasks_json)
@@ -156,7 +162,10 @@ def task_show(task_id):
             'created': db_task.created,
             'started': db_task.started,
             'finished': db_task.finished,
-            'error': db_task.error
+            'error': db_task.error,
+            'progress': db_task.get_progress(),
+            'coalesced_into': db_task.coalesced_into,
+            'report': url_for('api.task_report', task_id=db_task.task_id) if db_task.report else None
         }
         code = 200
     else:
@@ -167,6 +176,17 @@ def task_show(task_id):
     return make_response(jsonify(status), code)
 
 
+@api.route('/tasks/report/<task_id>', methods=['GET'])
+def task_report(task_id):
+    current_app.logger.info("API call: Getting report of task %s" % task_id)
+
+    db_task = BaricadrTask.query.filter_by(task_id=task_id).first()
+    if not db_task or not db_task.report or not os.path.exists(db_task.report):
+        return make_response(jsonify({'error': 'No report found for this task in Baricadr database.'}), 404)
+
+    return send_file(db_task.report, mimetype='application/gzip', as_attachment=True, download_name=os.path.basename(db_task.report))
+
+
 @api.route('/tasks/remove/<task_id>', methods=['GET'])
 def task_remove(task_id):
     current_app.logger.info("API call: Killing task %s" % task_id)
@@ -1,4 +1,5 @@
 import os
+from datetime import datetime
 
 from celery import Celery
 
@@ -7,10 +8,14 @@ from flask import Flask, g, render_template
 from flask_apscheduler import APScheduler
 
 from .api import api
+from .commands import simulate_freeze
 # Import model classes for flaks migrate
 from .db_models import BaricadrTask  # noqa: F401
 from .extensions import (celery, db, mail, migrate)
 from .model import backends
+from .model.bandwidth import BandwidthBudget, parse_limit
+from .model.freeze import disk_usage
+from .model.listing_cache import ListingCache
 from .model.repos import Repos
 
 
@@ -57,6 +62,36 @@ def create_app(config=None, app_name='baricadr', blueprints=None, run_mode=None,
             app.config['CLEANUP_ZOMBIES_INTERVAL'] = _get_int_value(app.config.get('CLEANUP_ZOMBIES_INTERVAL'), 3600)
         if 'CLEANUP_INTERVAL' in app.config:
             app.config['CLEANUP_INTERVAL'] = _get_int_value(app.config.get('CLEANUP_INTERVAL'), 21600)
+        app.config['WATERMARK_CHECK_INTERVAL'] = _get_int_value(app.config.get('WATERMARK_CHECK_INTERVAL'), 300)
+        app.config['WATERMARK_BACKOFF_MAX'] = _get_int_value(app.config.get('WATERMARK_BACKOFF_MAX'), 86400)
+
+        app.config['RCLONE_DAEMON_TIMEOUT'] = _get_int_value(app.config.get('RCLONE_DAEMON_TIMEOUT'), 300)
+
+        app.config['PULL_RETRIES'] = _get_int_value(app.config.get('PULL_RETRIES'), 3)
+        app.config['PULL_RETRY_DELAY'] = _get_int_value(app.config.get('PULL_RETRY_DELAY'), 10)
+        app.config['PULL_CHECKPOINT_AGE'] = _get_int_value(app.config.get('PULL_CHECKPOINT_AGE'), 86400)
+        app.config['PROGRESS_INTERVAL'] = _get_int_value(app.config.get('PROGRESS_INTERVAL'), 5)
+        app.config['CHECKSUM_WORKERS'] = _get_int_value(app.config.get('CHECKSUM_WORKERS'), 4)
+        app.config['WALK_WORKERS'] = _get_int_value(app.config.get('WALK_WORKERS'), 8)
+        app.config['FREEZE_WORKERS'] = _get_int_value(app.config.get('FREEZE_WORKERS'), 4)
+        app.config['PULL_COALESCE_WINDOW'] = _get_int_value(app.config.get('PULL_COALESCE_WINDOW'), 0)
+        app.config['MIRROR_PROBE_TTL'] = _get_int_value(app.config.get('MIRROR_PROBE_TTL'), 300)
+        app.config['PREFETCH_WINDOW'] = _get_int_value(app.config.get('PREFETCH_WINDOW'), 600)
+        app.config['PREFETCH_MIN_COUNT'] = _get_int_value(app.config.get('PREFETCH_MIN_COUNT'), 2)
+
+        app.config['LISTING_CACHE_TTL'] = _get_int_value(app.config.get('LISTING_CACHE_TTL'), 0)
+        app.config['LISTING_CACHE_STALE_TTL'] = _get_int_value(app.config.get('LISTING_CACHE_STALE_TTL'), 0)
+        app.listing_cache = None
+        if app.config['LISTING_CACHE_TTL']:
+            app.listing_cache = ListingCache(app.config.get('LISTING_CACHE_REDIS_URL', app.config['CELERY_BROKER_URL']), app.config['LISTING_CACHE_TTL'], app.config['LISTING_CACHE_STALE_TTL'])
+
+        app.bandwidth = None
+        if app.config.get('BANDWIDTH_LIMIT'):
+            try:
+                bandwidth_limit = parse_limit(app.config['BANDWIDTH_LIMIT'])
+            except ValueError:
+                raise ValueError("Malformed BANDWIDTH_LIMIT '%s', must be a number of bytes/s, or a size like '100M'" % app.config['BANDWIDTH_LIMIT'])
+            app.bandwidth = BandwidthBudget(app.config.get('BANDWIDTH_REDIS_URL', app.config['CELERY_BROKER_URL']), bandwidth_limit)
 
         # Load the list of baricadr repositories
         app.backends = backends.Backends()
@@ -71,6 +106,7 @@ def create_app(config=None, app_name='baricadr', blueprints=None, run_mode=None,
 
         blueprints_fabrics(app, blueprints)
         extensions_fabrics(app)
+        commands_fabrics(app)
         configure_logging(app)
 
         error_pages(app)
@@ -89,6 +125,8 @@ def create_app(config=None, app_name='baricadr', blueprints=None, run_mode=None,
                 scheduler.add_job(func=cleanup, args=[app], trigger='interval', seconds=app.config.get("CLEANUP_INTERVAL"), id="cleanup_job")
             # Setup freeze job for compatible repos
             setup_freeze_tasks(app, scheduler)
+            # Setup manifest refresh job for repos with a manifest
+            setup_manifest_tasks(app, scheduler)
 
     return app
 
@@ -124,6 +162,12 @@ def extensions_fabrics(app):
     celery.config_from_object(app.config)
 
 
+def commands_fabrics(app):
+    """Register the flask commands."""
+
+    app.cli.add_command(simulate_freeze)
+
+
 def error_pages(app):
     # HTTP error pages definitions
 
@@ -206,12 +250,21 @@ def setup_freeze_tasks(app, scheduler):
             app.logger.debug("Creating scheduler job for path : %s with auto_freeze_interval : %s" % (path, repo.auto_freeze_interval))
             scheduler.add_job(func=freeze_repo, args=[app, path], trigger='interval', days=repo.auto_freeze_interval, id="auto_freeze_%s" % (path), name="Auto freeze job for path %s" % (path))
 
+        if any(repo.freezable and repo.freeze_high_watermark is not None for repo in app.repos.repos.values()):
+            app.logger.debug("Creating scheduler job checking disk usage watermarks every %s seconds" % (app.config['WATERMARK_CHECK_INTERVAL']))
+            scheduler.add_job(func=check_watermarks, args=[app], trigger='interval', seconds=app.config['WATERMARK_CHECK_INTERVAL'], id="watermarks_job", name="Disk usage watermarks check job")
+
 
-def freeze_repo(app, repo_path):
+def freeze_repo(app, repo_path, evict=False):
     touching_task_id = app.repos.is_already_touching(repo_path)
     if not touching_task_id:
         locking_task_id = app.repos.is_locked_by_subdir(repo_path)
-        task = app.celery.send_task('freeze', (repo_path, None, locking_task_id))
+        if evict:
+            options = {'evict': True}
+        else:
+            # Only scan the directories which changed, or may contain files old enough, since the last auto freeze
+            options = {'incremental': True}
+        task = app.celery.send_task('freeze', (repo_path, None, locking_task_id), options)
         task_id = task.task_id
 
         pt = BaricadrTask(path=repo_path, type='freeze', task_id=task_id)
@@ -219,6 +272,36 @@ def freeze_repo(app, repo_path):
         db.session.commit()
 
 
+def check_watermarks(app):
+    # A statvfs call per repo, the files are only walked by the freeze task
+    for path, repo in app.repos.repos.items():
+        if not repo.freezable or repo.freeze_high_watermark is None:
+            continue
+        used, size = disk_usage(path)
+        if used * 100 < size * repo.freeze_high_watermark:
+            repo.clear_eviction_delay()
+        elif repo.eviction_delayed():
+            app.logger.debug("Disk usage of %s is above the high watermark (%s%%), but evictions are delayed" % (path, repo.freeze_high_watermark))
+        else:
+            app.logger.info("Disk usage of %s is above the high watermark (%s%%), evicting files" % (path, repo.freeze_high_watermark))
+            freeze_repo(app, path, evict=True)
+
+
+def setup_manifest_tasks(app, scheduler):
+    with app.app_context():
+
+        for path, repo in app.repos.repos.items():
+            if not repo.manifest:
+                continue
+            app.logger.debug("Creating scheduler job for path : %s with manifest_refresh_interval : %s" % (path, repo.manifest_refresh_interval))
+            # First refresh is run right away
+            scheduler.add_job(func=refresh_manifest, args=[app, path], trigger='interval', hours=repo.manifest_refresh_interval, next_run_time=datetime.now(), id="manifest_%s" % (path), name="Manifest refresh job for path %s" % (path))
+
+
+def refresh_manifest(app, repo_path):
+    app.celery.send_task('refresh_manifest', (repo_path,))
+
+
 def cleanup(app):
     app.celery.send_task('cleanup_tasks', (app.config['CLEANUP_AGE'],))
 
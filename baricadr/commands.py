@@ -0,0 +1,47 @@
+import json
+from datetime import datetime, timedelta
+
+from baricadr.model.backends import _parse_size
+from baricadr.model.simulator import POLICIES, load_events, sweep, sweep_configs
+
+import click
+
+from flask.cli import with_appcontext
+
+
+@click.command('simulate-freeze')
+@click.option('--repo', 'repo_path', help="Only replay the pulls in this repo (local path)")
+@click.option('--days', default=365, show_default=True, help="Replay the pulls of the last days")
+@click.option('--policy', 'policies', multiple=True, type=click.Choice(POLICIES), help="Policy to simulate (can be repeated, default: all)")
+@click.option('--capacity', 'capacities', multiple=True, help="Disk capacity for the lru, lfu and gdsf policies, like '500G' or '2T' (can be repeated)")
+@click.option('--freeze-age', 'freeze_ages', multiple=True, type=int, help="freeze_age (in days) for the age policy (can be repeated, default: 30, 90, 180 and 365)")
+@click.option('--freeze-interval', default=7, show_default=True, help="auto_freeze_interval (in days) for the age policy")
+@click.option('--workers', default=1, show_default=True, help="Number of simulations run in parallel")
+@click.option('--json', 'as_json', is_flag=True, help="Print the results as JSON")
+@with_appcontext
+def simulate_freeze(repo_path, days, policies, capacities, freeze_ages, freeze_interval, workers, as_json):
+    """
+    Replay the pulls from the task history against freeze policies, to choose freeze_age or watermarks
+    """
+
+    try:
+        capacities = [_parse_size(capacity) for capacity in capacities]
+    except ValueError:
+        raise click.BadParameter("capacities must be sizes like '500G'", param_hint='--capacity')
+
+    configs = sweep_configs(policies or POLICIES, capacities, freeze_ages or [30, 90, 180, 365], freeze_interval)
+    if not configs:
+        raise click.UsageError("Nothing to simulate: the lru, lfu and gdsf policies need a --capacity")
+
+    events, ignored = load_events(repo_path, datetime.utcnow() - timedelta(days=days))
+    click.echo("Replaying %s pulls of %s paths (%s pulls of paths with an unknown size ignored)" % (len(events), len(events.paths), ignored), err=True)
+
+    results = sweep(events, configs, workers)
+
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+        return
+
+    click.echo("%-6s %12s %10s %10s %16s %16s %16s" % ('policy', 'capacity', 'freeze_age', 'hit_ratio', 'bytes_pulled', 'bytes_repulled', 'peak_usage'))
+    for result in results:
+        click.echo("%-6s %12s %10s %10.4f %16s %16s %16s" % (result['policy'], result['capacity'] or '-', result['freeze_age'] or '-', result['hit_ratio'], result['bytes_pulled'], result['bytes_repulled'], result['peak_usage']))
@@ -15,6 +15,172 @@ class BaricadrTask(db.Model):
     started = db.Column(db.DateTime())
     finished = db.Column(db.DateTime())
     error = db.Column(db.Text())
+    transferred_files = db.Column(db.Integer())
+    transferred_bytes = db.Column(db.BigInteger())
+    transfer_time = db.Column(db.Float())
+    # Recipient of the completion email, for pulls run by another task
+    email = db.Column(db.Text())
+    # Id of the pull task which ran this pull in the same transfer
+    coalesced_into = db.Column(db.String(255), index=True)
+    # Path of the report of a freeze (gzipped JSON lines)
+    report = db.Column(db.Text())
+    # Progress of a running pull
+    progress_files = db.Column(db.Integer())
+    progress_total_files = db.Column(db.Integer())
+    progress_bytes = db.Column(db.BigInteger())
+    progress_total_bytes = db.Column(db.BigInteger())
+    progress_speed = db.Column(db.Float())
+    progress_eta = db.Column(db.Integer())
+    progress_updated = db.Column(db.DateTime())
+
+    def get_progress(self):
+        """
+        Get the progress of a pull, as exposed by the api
+
+        :rtype: dict
+        :return: progress stats, or None if not available
+        """
+
+        if self.progress_updated is None:
+            return None
+
+        return {
+            'files': self.progress_files,
+            'total_files': self.progress_total_files,
+            'bytes': self.progress_bytes,
+            'total_bytes': self.progress_total_bytes,
+            'speed': self.progress_speed,
+            'eta': self.progress_eta,
+            'updated': self.progress_updated
+        }
 
     def __repr__(self):
         return '<BaricadrTask {} {} {} {}>'.format(self.type, self.path, self.task_id, self.status)
+
+
+class RemoteFile(db.Model):
+    """
+    A file on the remote of a repo, as seen during the last refresh of the repo manifest
+    """
+
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    repo = db.Column(db.Text(), nullable=False)
+    path = db.Column(db.Text(), nullable=False)
+    size = db.Column(db.BigInteger())
+    mtime = db.Column(db.String(64))
+    hash = db.Column(db.String(255))
+    seen = db.Column(db.DateTime(), index=True, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('repo', 'path'),
+        # Allows prefix searches (path LIKE 'some/dir/%') to use the index
+        db.Index('ix_remote_file_repo_path_pattern', 'repo', 'path', postgresql_ops={'path': 'text_pattern_ops'}),
+    )
+
+    def __repr__(self):
+        return '<RemoteFile {} {}>'.format(self.repo, self.path)
+
+
+class RemoteManifest(db.Model):
+    """
+    State of the manifest of remote files for a repo
+    """
+
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    repo = db.Column(db.Text(), index=True, unique=True, nullable=False)
+    last_refresh = db.Column(db.DateTime())
+    last_full_refresh = db.Column(db.DateTime())
+    refresh_started = db.Column(db.DateTime())
+
+    def __repr__(self):
+        return '<RemoteManifest {} {} {}>'.format(self.repo, self.last_refresh, self.last_full_refresh)
+
+
+class PullCheckpoint(db.Model):
+    """
+    Plan of a running pull, used to resume it if it gets interrupted
+    """
+
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    path = db.Column(db.Text(), index=True, unique=True, nullable=False)
+    task_id = db.Column(db.String(255))
+    created = db.Column(db.DateTime(), nullable=False, default=datetime.utcnow)
+    plan = db.Column(db.Text(), nullable=False)
+
+    def __repr__(self):
+        return '<PullCheckpoint {} {}>'.format(self.path, self.task_id)
+
+
+class CoAccess(db.Model):
+    """
+    Number of times a file was pulled shortly after another one, used to choose which files to prefetch
+    """
+
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    repo = db.Column(db.Text(), nullable=False)
+    path = db.Column(db.Text(), index=True, nullable=False)
+    next_path = db.Column(db.Text(), nullable=False)
+    count = db.Column(db.Integer(), nullable=False, default=0)
+    last_seen = db.Column(db.DateTime(), nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('path', 'next_path'),
+    )
+
+    def __repr__(self):
+        return '<CoAccess {} {} {}>'.format(self.path, self.next_path, self.count)
+
+
+class FreezeScan(db.Model):
+    """
+    Last incremental freeze scan of a path, used to resume it if it was interrupted
+    """
+
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    path = db.Column(db.Text(), index=True, unique=True, nullable=False)
+    started = db.Column(db.DateTime(), nullable=False, default=datetime.utcnow)
+    finished = db.Column(db.DateTime())
+
+    def __repr__(self):
+        return '<FreezeScan {} {} {}>'.format(self.path, self.started, self.finished)
+
+
+class FreezeDirState(db.Model):
+    """
+    State of a local directory after the last incremental freeze scan, used to skip directories which cannot contain freezable files
+    """
+
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    repo = db.Column(db.Text(), index=True, nullable=False)
+    # Relative to the repo root
+    path = db.Column(db.Text(), nullable=False)
+    # Modification time of the directory (in ns): changes when files are added or removed
+    mtime = db.Column(db.BigInteger(), nullable=False)
+    # Earliest access time of the files left in the directory (None if there is no file)
+    min_atime = db.Column(db.Float())
+    file_count = db.Column(db.Integer(), nullable=False, default=0)
+    # Json list of subdirectory names
+    subdirs = db.Column(db.Text(), nullable=False, default='[]')
+    scanned = db.Column(db.DateTime(), nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('repo', 'path'),
+    )
+
+    def __repr__(self):
+        return '<FreezeDirState {} {} {}>'.format(self.repo, self.path, self.scanned)
+
+
+class EvictionState(db.Model):
+    """
+    Evictions of a repo which could not bring the disk usage down to the low watermark, used to wait before trying again
+    """
+
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    repo = db.Column(db.Text(), index=True, unique=True, nullable=False)
+    # Number of evictions in a row which could not reach the low watermark
+    failures = db.Column(db.Integer(), nullable=False, default=0)
+    next_try = db.Column(db.DateTime(), nullable=False)
+
+    def __repr__(self):
+        return '<EvictionState {} {} {}>'.format(self.repo, self.failures, self.next_try)
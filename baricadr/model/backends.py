@@ -1,65 +1,1023 @@
+import atexit
+import collections
+import concurrent.futures
+import datetime
+import fcntl
+import itertools
 import json
+import mimetypes
 import os
+import queue
+import re
+import secrets
+import shutil
+import socket
+import stat
 import tempfile
+import threading
 import time
-from subprocess import PIPE, Popen
+from subprocess import DEVNULL, PIPE, Popen
+
+from baricadr.model import checksums
+from baricadr.model.checkpoint import Checkpoint
+from baricadr.model.progress import TransferProgress
+from baricadr.model.walker import walk_files
+
+import boto3
+import boto3.s3.transfer
+
+import botocore.config
+import botocore.exceptions
+
+import dateutil.parser
 
 from flask import current_app
 
+import paramiko
+
+import requests
+
+
+# Partial files of interrupted downloads: '.<name>.<size>-<mtime>.baricadr-partial' ('.<name>.<size>-<mtime>.multi.baricadr-partial' for multi-stream downloads, '.<name>.baricadr-partial' for older versions)
+PARTIAL_NAME = re.compile(r'^\.(.+?)(\.-?[0-9]+-[0-9]+(\.multi)?)?\.baricadr-partial$')
+
+
+def with_app_context(func):
+    """
+    Wrap a function to run it in the current app context, from another thread
+    """
+
+    app = current_app._get_current_object()
+
+    def wrapper(*args, **kwargs):
+        with app.app_context():
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+class TransferError(RuntimeError):
+    """
+    A transfer failed for some files of a pull plan
+    """
+
+    def __init__(self, message, copied, failed):
+        """
+        :type copied: list
+        :param copied: paths (relative to the repo root) of the files written before the failure
+
+        :type failed: list
+        :param failed: paths (relative to the repo root) of the files which could not be transferred
+        """
+
+        RuntimeError.__init__(self, message)
+        self.copied = copied
+        self.failed = failed
+
+
+class RcloneDaemonTimeout(RuntimeError):
+    """
+    The rclone daemon did not answer in time
+    """
+
+    pass
+
 
 class Backends():
     def __init__(self):
         self.backends = {
             'sftp': SftpBackend,
             's3': S3Backend,
+            'sftp-native': SftpNativeBackend,
+            'local': LocalBackend,
         }
 
-    def get_by_name(self, name, conf):
+        # Backend objects are shared between repos having the same backend settings
+        self.instances = {}
+
+        self.rclone_config = RcloneConfig()
+        self.rclone_daemon = RcloneDaemon(self.rclone_config)
+
+    def get_by_name(self, name, conf):
+
+        if name not in self.backends:
+            raise RuntimeError('Could not find backend named "%s"' % name)
+
+        # Only build a backend object for new settings (some open connections, or register atexit handlers)
+        key = self.backends[name].conf_settings_key(conf)
+        if key not in self.instances:
+            backend = self.backends[name](conf)
+            backend.setup(self)
+            self.instances[key] = backend
+
+        return self.instances[key]
+
+
+class PullPlan():
+    """
+    The list of files to transfer for a pull
+    """
+
+    def __init__(self, repo, path, files):
+        """
+        :type repo: Repo object
+        :param repo: a Repo object
+
+        :type path: str
+        :param path: local path to pull
+
+        :type files: list
+        :param files: dicts with Path (relative to the repo root), Size and ModTime keys, for each file to transfer
+        """
+
+        self.repo = repo
+        self.path = path
+        self.files = files
+
+    def total_size(self):
+        # Size is -1 when unknown
+        return sum([max(remote_file['Size'], 0) for remote_file in self.files])
+
+
+class Backend():
+
+    # Keys from the repo config which define the backend (other keys are repo-specific)
+    settings_keys = ['url', 'user', 'password']
+
+    # Whether user and password are mandatory
+    needs_credentials = True
+
+    def __init__(self, conf):
+
+        self.name = None
+
+        if 'url' not in conf:
+            raise ValueError("Missing 'url' in backend config '%s'" % conf)
+
+        if self.needs_credentials:
+            if 'user' not in conf:
+                raise ValueError("Missing 'user' in backend config '%s'" % conf)
+
+            if 'password' not in conf:
+                raise ValueError("Missing 'password' in backend config '%s'" % conf)
+
+        self.url = conf['url']
+        self.user = conf.get('user')
+        self.password = conf.get('password')
+
+        self.conf = conf
+
+    @classmethod
+    def conf_settings_key(cls, conf):
+        """
+        Build a key identifying the backend settings of a repo config, used to share backend objects between repos
+        """
+
+        return (cls.__name__, tuple((key, str(conf.get(key))) for key in cls.settings_keys))
+
+    def settings_key(self):
+        """
+        Build a key identifying this backend settings
+        """
+
+        return self.conf_settings_key(self.conf)
+
+    def setup(self, backends):
+        """
+        Called once when the backend is registered in the Backends object
+
+        :type backends: Backends object
+        :param backends: the Backends object where this backend is registered
+        """
+
+        pass
+
+    def pull(self, repo, path, task_id=None, progress_callback=None, other_paths=None, priority=None):
+        """
+        Download a file from remote into local repository
+
+        Interrupted pulls are resumed from a checkpoint, and transfers are retried (with exponential backoff) for the failed files only.
+
+        :type repo: Repo object
+        :param repo: a Repo object
+
+        :type path: str
+        :param path: local path to pull
+
+        :type task_id: str
+        :param task_id: id of the task running the pull, if any
+
+        :type progress_callback: function
+        :param progress_callback: function(stats) called regularly during the transfer, with the output of TransferProgress.get_stats
+
+        :type other_paths: list
+        :param other_paths: other local paths of the same repo to pull in the same transfer (for coalesced pull tasks)
+
+        :type priority: str
+        :param priority: priority of the transfer in the bandwidth budget (low, normal or high), or None to choose from the size of the pull
+
+        :rtype: dict
+        :return: transfer stats: number of 'files' and 'bytes' transferred, and transfer 'duration' in seconds, and 'errors' (error message for each of other_paths which could not be pulled)
+        """
+
+        if other_paths is None:
+            other_paths = []
+
+        checkpoint = Checkpoint(repo, path, task_id, current_app.config['PULL_CHECKPOINT_AGE'])
+
+        errors = {}
+        plan = checkpoint.load()
+        if plan is None:
+            if other_paths:
+                plan, errors = self.plan_pull_many(repo, path, other_paths)
+            else:
+                plan = self.plan_pull(repo, path)
+            if plan.files:
+                checkpoint.save(plan)
+        elif other_paths:
+            # The checkpoint only has the files of the interrupted pull: the other paths may not be in it
+            files = collections.OrderedDict((remote_file['Path'], remote_file) for remote_file in plan.files)
+            errors = self._plan_other_paths(repo, other_paths, files)
+            plan = PullPlan(repo, path, list(files.values()))
+            if plan.files:
+                checkpoint.save(plan)
+
+        if not plan.files:
+            current_app.logger.info("Nothing to pull for path %s" % path)
+            checkpoint.remove()
+            return {'files': 0, 'bytes': 0, 'duration': 0, 'errors': errors}
+
+        current_app.logger.info("Pulling %s files (%s bytes) for path %s" % (len(plan.files), plan.total_size(), path))
+
+        throttle = None
+        if current_app.bandwidth:
+            if priority is None:
+                priority = 'high' if plan.total_size() < current_app.bandwidth.interactive_size else 'normal'
+            throttle = current_app.bandwidth.register(priority)
+
+        progress = TransferProgress(plan, progress_callback, current_app.config['PROGRESS_INTERVAL'], throttle)
+        progress.report(force=True)
+
+        start = time.time()
+        copied = []
+        retries = 0
+        try:
+            while True:
+                try:
+                    round_copied = self.transfer(repo, plan, progress)
+                    if repo.integrity:
+                        self.verify(repo, plan, round_copied)
+                    copied += round_copied
+                    break
+                except TransferError as e:
+                    copied += e.copied
+                    if retries >= current_app.config['PULL_RETRIES'] or not e.failed:
+                        # Not an interrupted pull: plan again next time
+                        checkpoint.remove()
+                        raise
+
+                    delay = current_app.config['PULL_RETRY_DELAY'] * 2 ** retries
+                    retries += 1
+                    current_app.logger.warning("Failed to transfer %s files for path %s, retrying in %s seconds (retry %s/%s): %s" % (len(e.failed), path, delay, retries, current_app.config['PULL_RETRIES'], e))
+                    time.sleep(delay)
+
+                    failed = set(e.failed)
+                    plan = PullPlan(repo, path, [remote_file for remote_file in plan.files if remote_file['Path'] in failed])
+                    progress.start_round()
+        finally:
+            if throttle:
+                throttle.close()
+        duration = time.time() - start
+
+        checkpoint.remove()
+
+        # Touch transferred files to set atime to now (but not mtime)
+        now = time.time()
+        transferred_bytes = 0
+        for rel_path in copied:
+            local_file = os.path.join(repo.local_path, rel_path)
+            local_stat = os.stat(local_file)
+            os.utime(local_file, (now, local_stat.st_mtime))
+            transferred_bytes += local_stat.st_size
+
+        progress.finish(len(copied), transferred_bytes, duration)
+        progress.report(force=True)
+
+        return {'files': len(copied), 'bytes': transferred_bytes, 'duration': duration, 'errors': errors}
+
+    def verify(self, repo, plan, copied):
+        """
+        Compare the hashes of transferred files with the remote hashes, removing corrupted files
+
+        :type repo: Repo object
+        :param repo: a Repo object
+
+        :type plan: PullPlan
+        :param plan: the files which were transferred, with Hashes
+
+        :type copied: list
+        :param copied: paths (relative to the repo root) of the files written by the transfer
+        """
+
+        hashes = {remote_file['Path']: remote_file.get('Hashes') for remote_file in plan.files}
+        to_verify = {os.path.join(repo.local_path, rel_path): hashes.get(rel_path) for rel_path in copied}
+        results = checksums.verify_files(to_verify, current_app.config['CHECKSUM_WORKERS'])
+
+        unverified = [local_path for local_path, result in results.items() if result is None]
+        if unverified:
+            current_app.logger.warning("No usable remote hash for %s transferred files (e.g. %s), they were not verified" % (len(unverified), unverified[0]))
+
+        corrupted = [repo.relative_path(local_path) for local_path, result in results.items() if result is False]
+        if corrupted:
+            for rel_path in corrupted:
+                current_app.logger.error("Checksum mismatch for transferred file %s, removing it" % rel_path)
+                os.unlink(os.path.join(repo.local_path, rel_path))
+
+            raise TransferError("Checksum mismatch for %s transferred files (%s)" % (len(corrupted), ', '.join(corrupted[:10])), [rel_path for rel_path in copied if rel_path not in corrupted], corrupted)
+
+    def plan_pull(self, repo, path):
+        """
+        List the remote once to find which files need to be transferred
+
+        :type repo: Repo object
+        :param repo: a Repo object
+
+        :type path: str
+        :param path: local path to pull
+
+        :rtype: PullPlan
+        :return: the files missing locally
+        """
+
+        # Always list the remote: the manifest misses recent files (or files copied with old mtimes) until the next full refresh, and keeps deleted ones
+        files = []
+        for entry in self.iter_remote_list(repo, path, missing=True, max_depth=0, from_root=True, full=True, hashes=repo.integrity):
+            files.append(self._planned_file(repo, entry))
+
+        return PullPlan(repo, path, files)
+
+    def plan_pull_many(self, repo, path, other_paths):
+        """
+        Plan a single pull for several paths of a repo
+
+        Sibling paths (e.g. many files from the same directory) are planned from a single listing of their parent directory.
+
+        :type repo: Repo object
+        :param repo: a Repo object
+
+        :type path: str
+        :param path: main local path to pull (an error raises an exception)
+
+        :type other_paths: list
+        :param other_paths: other local paths to pull (errors are returned)
+
+        :rtype: tuple
+        :return: the PullPlan of all the files missing locally, and a dict with an error message for each of other_paths which could not be planned
+        """
+
+        files = collections.OrderedDict()
+        for remote_file in self.plan_pull(repo, path).files:
+            files[remote_file['Path']] = remote_file
+
+        errors = self._plan_other_paths(repo, other_paths, files)
+
+        return PullPlan(repo, path, list(files.values())), errors
+
+    def _plan_other_paths(self, repo, other_paths, files):
+        """
+        Add the files missing locally for other paths to a plan
+
+        :type other_paths: list
+        :param other_paths: local paths to pull
+
+        :type files: collections.OrderedDict
+        :param files: the files already planned, by path relative to the repo root (updated in place)
+
+        :rtype: dict
+        :return: an error message for each of other_paths which could not be planned
+        """
+
+        by_parent = collections.OrderedDict()
+        for other_path in other_paths:
+            by_parent.setdefault(os.path.dirname(other_path), []).append(other_path)
+
+        to_plan = []
+        for parent, siblings in by_parent.items():
+            if len(siblings) < 2 or not repo.is_in_repo(parent):
+                to_plan += siblings
+                continue
+
+            found = self._plan_siblings(repo, parent, siblings)
+            for sibling in siblings:
+                rel_path = repo.relative_path(sibling)
+                if rel_path not in found:
+                    # Not a file: a directory, or a path which does not exist
+                    to_plan.append(sibling)
+                elif found[rel_path]:
+                    files.setdefault(rel_path, found[rel_path])
+
+        errors = {}
+        for other_path in to_plan:
+            try:
+                plan = self.plan_pull(repo, other_path)
+            except RuntimeError as e:
+                current_app.logger.warning("Could not plan pull for path %s: %s" % (other_path, e))
+                errors[other_path] = str(e)
+                continue
+
+            for remote_file in plan.files:
+                files.setdefault(remote_file['Path'], remote_file)
+
+        return errors
+
+    def _plan_siblings(self, repo, parent, siblings):
+        """
+        Find the files among siblings with a single listing of their parent directory
+
+        :rtype: dict
+        :return: the files found (by path relative to the repo root), with the file to transfer, or None if nothing needs to be transferred
+        """
+
+        wanted = set(repo.relative_path(sibling) for sibling in siblings)
+
+        # Excluded files are not listed, and never transferred
+        found = {}
+        for rel_path in wanted:
+            if repo.excludes.matches(rel_path):
+                found[rel_path] = None
+
+        try:
+            for entry in self.iter_remote_list(repo, parent, max_depth=1, from_root=True, full=True, hashes=repo.integrity):
+                if entry['Path'] not in wanted:
+                    continue
+
+                if os.path.exists(os.path.join(repo.local_path, entry['Path'])):
+                    found[entry['Path']] = None
+                else:
+                    found[entry['Path']] = self._planned_file(repo, entry)
+        except RuntimeError as e:
+            # Plan each path on its own
+            current_app.logger.warning("Could not list parent directory %s: %s" % (parent, e))
+            return {}
+
+        return found
+
+    def _planned_file(self, repo, entry):
+        """
+        Turn a listing entry into a file to transfer
+        """
+
+        remote_file = {'Path': entry['Path'], 'Size': entry['Size'], 'ModTime': entry['ModTime']}
+        if repo.integrity:
+            remote_file['Hashes'] = entry.get('Hashes')
+
+        return remote_file
+
+    def transfer(self, repo, plan, progress):
+        """
+        Download the files of a pull plan into the local repository, without overwriting existing files
+
+        :type repo: Repo object
+        :param repo: a Repo object
+
+        :type plan: PullPlan
+        :param plan: the files to transfer
+
+        :type progress: TransferProgress
+        :param progress: to update while transferring (report() must be called regularly, from the calling thread)
+
+        :rtype: list
+        :return: paths (relative to the repo root) of the files written
+
+        Raise a TransferError if some files could not be transferred
+        """
+
+        raise NotImplementedError()
+
+    def parallel_download(self, repo, plan, transfers, fetch, progress, errors=(OSError,)):
+        """
+        Download the files of a pull plan in parallel, for backends transferring files themselves (not with rclone)
+
+        Files are written to a partial file next to their destination, which is kept on failure to resume the download later.
+
+        :type repo: Repo object
+        :param repo: a Repo object
+
+        :type plan: PullPlan
+        :param plan: the files to transfer
+
+        :type transfers: int
+        :param transfers: number of files to download in parallel
+
+        :type fetch: function
+        :param fetch: function(remote_file, partial_path, offset) writing the content of a remote file (from plan.files) to partial_path, starting at offset
+
+        :type progress: TransferProgress
+        :param progress: fetch should call progress.add_bytes for each chunk written
+
+        :type errors: tuple
+        :param errors: exception classes raised by fetch on transfer failures
+
+        :rtype: list
+        :return: paths (relative to the repo root) of the files written
+        """
+
+        partials = self._find_partials(repo, plan)
+
+        copied = []
+        failed = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=transfers) as executor:
+            download_file = with_app_context(self._download_file)
+            futures = {executor.submit(download_file, repo, remote_file, fetch, partials.get(remote_file['Path'], [])): remote_file['Path'] for remote_file in plan.files}
+            pending = set(futures)
+            while pending:
+                done, pending = concurrent.futures.wait(pending, timeout=progress.interval, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        if future.result():
+                            copied.append(futures[future])
+                            progress.add_files()
+                    except errors as e:
+                        current_app.logger.error("Failed to download %s: %s" % (futures[future], e))
+                        failed.append(futures[future])
+                progress.report()
+
+        if failed:
+            raise TransferError("Can't copy %s: failed to download %s files (%s)" % (plan.path, len(failed), ', '.join(failed[:10])), copied, failed)
+
+        return copied
+
+    def _find_partials(self, repo, plan):
+        """
+        Find the partial files left by interrupted downloads of the files of a pull plan, with a single listing of each directory
+
+        :rtype: dict
+        :return: paths of the partial files, by path (relative to the repo root) of their destination
+        """
+
+        partials = {}
+        for rel_dir in set(os.path.dirname(remote_file['Path']) for remote_file in plan.files):
+            try:
+                entries = list(os.scandir(os.path.join(repo.local_path, rel_dir)))
+            except FileNotFoundError:
+                continue
+
+            for entry in entries:
+                match = PARTIAL_NAME.match(entry.name)
+                if match:
+                    partials.setdefault(os.path.join(rel_dir, match.group(1)), []).append(entry.path)
+
+        return partials
+
+    def _partial_path(self, dest, remote_file):
+        """
+        Get the path of the partial file used to download a remote file to dest
+
+        The size and mtime of the remote file are in the name: a partial file is only resumed for the same version of the remote file.
+        """
+
+        mtime = dateutil.parser.isoparse(remote_file['ModTime']).timestamp()
+
+        return os.path.join(os.path.dirname(dest), '.%s.%s-%s.baricadr-partial' % (os.path.basename(dest), remote_file['Size'], round(mtime * 1000000)))
+
+    def _download_file(self, repo, remote_file, fetch, partials):
+        """
+        Download a single file, without overwriting an existing local file
+
+        :type partials: list
+        :param partials: paths of the partial files left by previous downloads to the same destination (see _find_partials)
+
+        :rtype: bool
+        :return: True if the file was downloaded
+        """
+
+        dest = os.path.join(repo.local_path, remote_file['Path'])
+        if os.path.exists(dest):
+            return False
+
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+
+        # Download to a partial file in the same dir, to never leave a half-written file at dest
+        partial_path = self._partial_path(dest, remote_file)
+
+        offset = 0
+        for other_path in partials:
+            if other_path != partial_path:
+                # Download of another version of the remote file
+                current_app.logger.info("Removing stale partial file %s" % other_path)
+                os.unlink(other_path)
+            else:
+                partial_size = os.stat(partial_path).st_size
+                if partial_size <= max(remote_file['Size'], 0):
+                    offset = partial_size
+                    current_app.logger.info("Resuming download of %s from byte %s" % (remote_file['Path'], offset))
+
+        if not offset:
+            open(partial_path, 'wb').close()
+
+        # Kept on failure (or if the worker is killed), to resume later
+        fetch(remote_file, partial_path, offset)
+
+        # Keep remote modification time, like rclone does
+        mtime = dateutil.parser.isoparse(remote_file['ModTime']).timestamp()
+        os.utime(partial_path, (time.time(), mtime))
+
+        if os.path.exists(dest):
+            os.unlink(partial_path)
+            return False
+        os.rename(partial_path, dest)
+
+        return True
+
+    def remote_is_single(self, repo, path):
+        """
+        Check if distant path is a single file or not
+        """
+
+        # No need to list more than 2 files
+        remote_files = list(itertools.islice(repo.iter_remote_list(path, max_depth=0), 2))
+        return len(remote_files) == 1
+
+    def remote_list(self, repo, path, missing=False, max_depth=1, from_root=False, full=False):
+        """
+        List content in a distant path
+        """
+
+        remote_list = list(repo.iter_remote_list(path, missing, max_depth, from_root, full))
+
+        if missing and not full:
+            remote_list = sorted(remote_list, key=lambda entry: entry['Path'])
+
+        current_app.logger.info('Parsed remote listing: %s files' % len(remote_list))
+
+        return remote_list
+
+    def iter_remote_list(self, repo, path, missing=False, max_depth=1, from_root=False, full=False, hashes=False):
+        """
+        Iterate over the files in a distant path, parsing the listing as a stream
+
+        Use Repo.iter_remote_list to use the repo manifest when available.
+
+        Parameters are the same as remote_list, plus hashes (see list_entries)
+        """
+
+        try:
+            max_depth = int(max_depth)
+        except ValueError:
+            max_depth = 1
+
+        entries = self.list_entries(repo.relative_path(path), max_depth, hashes=hashes, excludes=repo.excludes.rclone_filters())
+
+        return self.process_listing(repo, path, entries, missing, max_depth, from_root, full)
+
+    def list_entries(self, rel_path, max_depth=0, max_age=None, hashes=False, excludes=[]):
+        """
+        Iterate over the raw content of a distant path, in the format of 'rclone lsjson'
+
+        :type rel_path: str
+        :param rel_path: distant path, relative to the remote prefix
+
+        :type max_depth: int
+        :param max_depth: Restrict to a max depth. Set to 0 for all files.
+
+        :type max_age: int
+        :param max_age: Only list files modified during the last max_age seconds
+
+        :type hashes: bool
+        :param hashes: Add a 'Hashes' key to files, when the remote supports it (like 'rclone lsjson --hash')
+
+        :type excludes: list
+        :param excludes: rclone exclude patterns (see ExcludeMatcher.rclone_filters), which the backend may use to skip entries early. Excludes are applied again by process_listing.
+
+        :rtype: generator
+        :return: generator of dicts with (at least) Path (relative to rel_path), Name, Size, ModTime and IsDir keys
+        """
+
+        raise NotImplementedError()
+
+    def process_listing(self, repo, path, entries, missing=False, max_depth=1, from_root=False, full=False):
+        """
+        Turn raw entries from list_entries into the output of iter_remote_list
+
+        :type entries: iterator
+        :param entries: entries returned by list_entries
+
+        Other parameters are the same as remote_list
+        """
+
+        rel_path = repo.relative_path(path)
+        entries = iter(entries)
+
+        # Only a single file is listed when listing a file path. Wait for a second entry before deciding.
+        first_entries = list(itertools.islice(entries, 2))
+        path_rel_prefix = rel_path
+        if len(first_entries) == 1 and not first_entries[0]['IsDir'] and first_entries[0]['Path'] == os.path.basename(rel_path):
+            path_rel_prefix = os.path.dirname(rel_path)
+
+        if missing:
+            local_files = self._local_files(repo, path, max_depth)
+
+        for entry in itertools.chain(first_entries, entries):
+            if entry['IsDir']:
+                continue
+
+            if repo.excludes and repo.excludes.matches(os.path.join(path_rel_prefix, entry['Path'])):
+                continue
+
+            if missing and entry['Path'] in local_files:
+                continue
+
+            if from_root:
+                entry['Path'] = os.path.join(path_rel_prefix, entry['Path'])
+
+            if full:
+                yield entry
+            else:
+                yield {'Path': entry['Path']}
+
+    def _local_files(self, repo, path, max_depth):
+        """
+        Get the set of local files in a path, relative to this path
+        """
+
+        if os.path.isfile(path):
+            return set([os.path.basename(path)])
+
+        file_set = set()
+        if not os.path.isdir(path):
+            return file_set
+
+        for file_path, _ in walk_files(path, max_depth, current_app.config['WALK_WORKERS'], follow_links=True, skip=repo.is_excluded):
+            file_set.add(os.path.relpath(file_path, path))
+
+        return file_set
+
+
+class RcloneConfig():
+    """
+    A persistent rclone config file, with one section for each rclone remote
+    """
+
+    def __init__(self):
+
+        self.remotes = []
+        self.config_path = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+        atexit.register(self._remove)
+
+    def add_remote(self, backend):
+        """
+        Register a backend as a new remote in the config file
+
+        :type backend: RcloneBackend object
+        :param backend: the backend to add
+
+        :rtype: str
+        :return: the remote name to use in rclone commands
+        """
+
+        with self.lock:
+            remote_name = "%s%s" % (backend.name, len(self.remotes))
+            self.remotes.append((remote_name, backend))
+            # Config file will be written again on next use
+            self._remove()
+
+        return remote_name
+
+    def get_path(self):
+        """
+        Get the path to the config file, writing it if needed
+
+        :rtype: str
+        :return: path to the rclone config file
+        """
+
+        with self.lock:
+            # Celery workers are forked: each process writes its own file
+            if self.config_path is None or self.pid != os.getpid():
+                self._write()
+
+            return self.config_path
+
+    def _write(self):
+        fd, config_path = tempfile.mkstemp(prefix='baricadr_rclone_', suffix='.conf')
+        with os.fdopen(fd, 'w') as config_file:
+            for remote_name, backend in self.remotes:
+                config_file.write('[%s]\n' % remote_name)
+                for key, value in backend.rclone_config().items():
+                    config_file.write('%s = %s\n' % (key, value))
+                config_file.write('\n')
+
+        self.config_path = config_path
+        self.pid = os.getpid()
+
+    def _remove(self):
+        # Only remove files written by this process
+        if self.config_path is not None and self.pid == os.getpid() and os.path.exists(self.config_path):
+            os.unlink(self.config_path)
+
+        self.config_path = None
+
+
+class RcloneDaemon():
+    """
+    A supervised 'rclone rcd' process, driven with its HTTP API
+
+    The process is started on first use, and restarted if it died, or if the rclone config changed.
+    """
+
+    # Max time (in seconds) to wait for the daemon to answer after starting it
+    startup_timeout = 10
+
+    # Interval (in seconds) between two checks of an async job status
+    poll_interval = 0.5
+
+    def __init__(self, rclone_config):
+
+        self.rclone_config = rclone_config
+        self.process = None
+        self.pid = None
+        self.config_path = None
+        self.url = None
+        self.auth = None
+        self.session = None
+        self.lock = threading.Lock()
+
+        atexit.register(self.stop)
+
+    def call(self, command, params={}):
+        """
+        Run an rc command on the daemon
+
+        :type command: str
+        :param command: rc command to run (e.g. 'operations/list')
+
+        :type params: dict
+        :param params: parameters of the command
+
+        :rtype: dict
+        :return: the json output of the command
+        """
+
+        self._ensure_running()
+
+        current_app.logger.debug("Running rc command %s with params %s" % (command, params))
+        timeout = current_app.config['RCLONE_DAEMON_TIMEOUT']
+        try:
+            r = self.session.post(self.url + command, json=params, auth=self.auth, timeout=timeout)
+        except requests.exceptions.Timeout:
+            # A hung daemon would block the worker forever: started again on next use
+            current_app.logger.error("rclone rcd daemon did not answer to %s after %s seconds, stopping it" % (command, timeout))
+            self.stop(kill=True)
+            raise RcloneDaemonTimeout("rclone rc command %s timed out after %s seconds" % (command, timeout))
+
+        try:
+            output = r.json()
+        except ValueError:
+            output = {'error': r.text}
+
+        if r.status_code != 200:
+            raise RuntimeError("rclone rc command %s failed: %s" % (command, output.get('error', output)))
+
+        return output
+
+    def run_job(self, command, params={}, on_stats=None):
+        """
+        Run an rc command as an async job and wait for it to finish
+
+        :type command: str
+        :param command: rc command to run (e.g. 'sync/copy')
+
+        :type params: dict
+        :param params: parameters of the command
+
+        :type on_stats: function
+        :param on_stats: function(stats) called with the transfer stats of the job while it runs
+
+        :rtype: dict
+        :return: the transfer stats of the job
+        """
+
+        params = dict(params, _async=True)
+        job_id = self.call(command, params)['jobid']
+
+        while True:
+            status = self.call('job/status', {'jobid': job_id})
+            if status['finished']:
+                break
+            if on_stats:
+                on_stats(self.call('core/stats', {'group': 'job/%s' % job_id}))
+            time.sleep(self.poll_interval)
+
+        stats = self.call('core/stats', {'group': 'job/%s' % job_id})
+        current_app.logger.debug("Stats for rc job %s (%s): %s" % (job_id, command, stats))
+
+        if not status['success']:
+            raise RuntimeError("rclone rc job %s (%s) failed: %s" % (job_id, command, status['error']))
+
+        return stats
+
+    def stop(self, kill=False):
+        # Only stop a daemon started by this process
+        if self.process is not None and self.pid == os.getpid() and self.process.poll() is None:
+            if kill:
+                self.process.kill()
+            else:
+                self.process.terminate()
+            self.process.wait()
+
+        self.process = None
+
+    def _ensure_running(self):
+        with self.lock:
+            if self.process is not None and self.pid == os.getpid():
+                if self.process.poll() is not None:
+                    current_app.logger.warning("rclone rcd daemon (pid %s) died with code %s, restarting it" % (self.process.pid, self.process.returncode))
+                elif self.config_path != self.rclone_config.get_path():
+                    current_app.logger.info("rclone config changed, restarting rclone rcd daemon")
+                    self.stop()
+                else:
+                    return
+
+            self._start()
+
+    def _start(self):
+        # Let the OS choose a free port
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+
+        self.url = 'http://127.0.0.1:%s/' % port
+        self.auth = ('baricadr', secrets.token_hex(16))
+        self.config_path = self.rclone_config.get_path()
+
+        cmd = ['rclone', 'rcd', '--rc-addr', '127.0.0.1:%s' % port, '--rc-user', self.auth[0], '--rc-pass', self.auth[1], '--config', self.config_path]
+        current_app.logger.info("Starting rclone rcd daemon on port %s" % port)
+        self.process = Popen(cmd, stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL)
+        self.pid = os.getpid()
+        self.session = requests.Session()
+
+        waited = 0
+        while waited < self.startup_timeout:
+            if self.process.poll() is not None:
+                raise RuntimeError("rclone rcd daemon terminated with code %s while starting" % self.process.returncode)
+            try:
+                self.session.post(self.url + 'rc/noop', json={}, auth=self.auth, timeout=self.startup_timeout)
+                return
+            except requests.exceptions.ConnectionError:
+                time.sleep(0.1)
+                waited += 0.1
+            except requests.exceptions.Timeout:
+                break
 
-        if name in self.backends:
-            return self.backends[name](conf)
+        self.stop()
+        raise RuntimeError("rclone rcd daemon did not answer after %s seconds" % self.startup_timeout)
 
-        raise RuntimeError('Could not find backend named "%s"' % name)
 
+# TODO [HI] check that we support symlinks now (https://github.com/ncw/rclone/issues/1152)
+class RcloneBackend(Backend):
 
-class Backend():
-    def __init__(self, conf):
+    settings_keys = Backend.settings_keys + ['rclone_daemon']
 
-        self.name = None
+    def __init__(self, conf):
+        Backend.__init__(self, conf)
 
-        if 'url' not in conf:
-            raise ValueError("Missing 'url' in backend config '%s'" % conf)
+        self.remote_name = None
+        self.rclone_config_file = None
+        self.obscure_password = None
 
-        if 'user' not in conf:
-            raise ValueError("Missing 'user' in backend config '%s'" % conf)
+        # Use a long-lived 'rclone rcd' process instead of running rclone for each operation
+        self.rclone_daemon = None
+        self.use_daemon = 'rclone_daemon' in conf and conf['rclone_daemon'] is True
 
-        if 'password' not in conf:
-            raise ValueError("Missing 'password' in backend config '%s'" % conf)
+    def setup(self, backends):
+        self.rclone_config_file = backends.rclone_config
+        self.remote_name = self.rclone_config_file.add_remote(self)
 
-        self.url = conf['url']
-        self.user = conf['user']
-        self.password = conf['password']
+        if self.use_daemon:
+            self.rclone_daemon = backends.rclone_daemon
 
-    def pull(self, repo, path):
+    def rclone_config(self):
         """
-        Download a file from remote into local repository
+        Get the options to write in the rclone config file for this backend
 
-        :type repo: Repo object
-        :param repo: a Repo object
+        :rtype: dict
+        :return: rclone options
+        """
 
-        :type path: str
-        :param path: path to pull, without local or remote prefix
+        raise NotImplementedError()
 
-        :rtype: ?
-        :return: ?
+    def get_obscure_password(self):
+        """
+        Get the obscure password, generating it only once
         """
-        raise NotImplementedError()
 
+        if self.obscure_password is None:
+            self.obscure_password = self.obscurify_password(self.password)
 
-# TODO [HI] check that we support symlinks now (https://github.com/ncw/rclone/issues/1152)
-class RcloneBackend(Backend):
-    def __init__(self, conf):
-        Backend.__init__(self, conf)
+        return self.obscure_password
 
     def obscurify_password(self, clear_pass):
         """
@@ -78,119 +1036,269 @@ class RcloneBackend(Backend):
 
         return obscure_password
 
-    def remote_is_single(self, repo, path):
-        """
-        Check if distant path is a single file or not
-        """
+    def list_entries(self, rel_path, max_depth=0, max_age=None, hashes=False, excludes=[]):
+        if self.use_daemon:
+            try:
+                return iter(self._rc_list(rel_path, max_depth, max_age, hashes, excludes))
+            except RcloneDaemonTimeout as e:
+                current_app.logger.warning("Listing %s with rclone lsjson instead of the rclone daemon: %s" % (rel_path, e))
 
-        remote_list = self.remote_list(repo, path, max_depth=0)
-        return len(remote_list) == 1
+        return self._lsjson(rel_path, max_depth, max_age, hashes, excludes)
 
-    # TODO [LOW] we could use the --hash option of lsjson (may be slow, but may be useful)
-    def remote_list(self, repo, path, missing=False, max_depth=1, from_root=False, full=False):
+    def _lsjson(self, rel_path, max_depth, max_age=None, hashes=False, excludes=[]):
         """
-        List content in a distant path
+        List a distant path with 'rclone lsjson', yielding entries while rclone prints them
         """
-        obscure_password = self.obscurify_password(self.password)
-        tempRcloneConfig = self.temp_rclone_config()
-
-        rel_path = repo.relative_path(path)
 
-        src = "%s:%s%s" % (self.name, self.remote_prefix, rel_path)
+        src = "%s:%s%s" % (self.remote_name, self.remote_prefix, rel_path)
 
         max_depth_command = ""
-
-        try:
-            max_depth = int(max_depth)
-        except ValueError:
-            max_depth = 1
         # If not 0 (0 is for listing all)
         if max_depth:
             max_depth_command = "--max-depth " + str(max_depth)
 
-        cmd = "rclone lsjson -R --config '%s' '%s' --sftp-user '%s' --sftp-pass '%s' %s" % (tempRcloneConfig.name, src, self.user, obscure_password, max_depth_command)
+        if max_age:
+            max_depth_command += " --max-age %ss" % int(max_age)
+
+        # Hashes may be slow to get (e.g. computed on the remote with sftp)
+        if hashes:
+            max_depth_command += " --hash"
+
+        for exclude in excludes:
+            max_depth_command += " --exclude '%s'" % exclude
+
+        cmd = "rclone lsjson -R --config '%s' '%s' %s" % (self.rclone_config_file.get_path(), src, max_depth_command)
         current_app.logger.info(cmd)
-        p = Popen(cmd, shell=True, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        output, err = p.communicate()
-        retcode = p.returncode
+
+        # stderr goes to a file: reading only stdout from a pipe cannot block rclone
+        with tempfile.TemporaryFile() as err_file:
+            p = Popen(cmd, shell=True, stdin=DEVNULL, stdout=PIPE, stderr=err_file)
+            try:
+                # lsjson prints one entry per line, between '[' and ']' lines
+                for line in p.stdout:
+                    line = line.decode('utf-8').strip().rstrip(',')
+                    if line in ('[', ']', ''):
+                        continue
+
+                    try:
+                        yield json.loads(line)
+                    except json.decoder.JSONDecodeError:
+                        current_app.logger.error('Failed to parse json output from rclone lsjson: %s' % line)
+                        raise
+
+                p.stdout.close()
+                retcode = p.wait()
+            finally:
+                # The listing was interrupted
+                if p.poll() is None:
+                    p.kill()
+                    p.wait()
+
+            if retcode != 0:
+                err_file.seek(0)
+                err = err_file.read()
+                current_app.logger.error(err)
+                raise RuntimeError("Child was terminated by signal " + str(retcode) + ": can't run rclone lsjon (stderr: " + str(err) + ")")
+
+    def _rc_list(self, rel_path, max_depth, max_age=None, hashes=False, excludes=[]):
+        """
+        List a distant path with the 'operations/list' command of the rclone daemon
+        """
+
+        params = {
+            'fs': '%s:' % self.remote_name,
+            'remote': "%s%s" % (self.remote_prefix, rel_path),
+            'opt': {'recurse': True, 'showHash': hashes},
+        }
+        # If not 0 (0 is for listing all)
+        if max_depth:
+            params['_config'] = {'MaxDepth': max_depth}
+
+        if max_age or excludes:
+            params['_filter'] = {}
+            if max_age:
+                params['_filter']['MaxAge'] = '%ss' % int(max_age)
+            if excludes:
+                params['_filter']['ExcludeRule'] = excludes
+
         try:
-            json_output = json.loads(output.decode('ascii'))
-        except json.decoder.JSONDecodeError:
-            current_app.logger.error('Failed to parse json output from rclone lsjson: %s' % output.decode('ascii'))
+            return self.rclone_daemon.call('operations/list', params)['list']
+        except RcloneDaemonTimeout:
+            raise
+        except RuntimeError:
+            # operations/list only lists directories, look for a single file in the parent dir
+            parent, name = os.path.split(params['remote'].rstrip('/'))
+            params = {
+                'fs': params['fs'],
+                'remote': parent,
+            }
+            single = [entry for entry in self.rclone_daemon.call('operations/list', params)['list'] if entry['Name'] == name and not entry['IsDir']]
+            if not single:
+                raise RuntimeError("Could not list remote path '%s' with rclone daemon" % rel_path)
+
+            # Same output as lsjson for a single file
+            single[0]['Path'] = name
+            return single
+
+    def transfer(self, repo, plan, progress):
+        files_from = tempfile.NamedTemporaryFile('w', prefix='baricadr_files_', suffix='.txt')
+        with files_from:
+            for remote_file in plan.files:
+                files_from.write(remote_file['Path'] + '\n')
+            files_from.flush()
+
+            if self.use_daemon:
+                return self._rc_transfer(repo, plan, files_from.name, progress)
+
+            return self._cli_transfer(repo, plan, files_from.name, progress)
+
+    def _cli_transfer(self, repo, plan, files_from, progress):
+        """
+        Run the transfer with 'rclone copy', reading its json log to know which files were copied
+        """
+
+        src = "%s:%s" % (self.remote_name, self.remote_prefix)
+
+        # We use --ignore-existing to avoid deleting locally modified files (for example if a file was modified locally but the backup is not yet up-to-date)
+        # --no-traverse: no need to list the destination, we already know which files to copy
+        # --retries 1: failed files are retried by Backend.pull
+        # --stats 1s: stats are printed in the json log every second
+        cmd = ['rclone', 'copy', '--files-from-raw', files_from, '--no-traverse', '--ignore-existing', '--retries', '1', '--use-json-log', '--verbose', '--stats', '1s', '--config', self.rclone_config_file.get_path(), src, repo.local_path]
+        for option, value in repo.get_transfer_options(plan).items():
+            cmd += ['--%s' % option.replace('_', '-'), str(value)]
+
+        rate = None
+        if progress.throttle:
+            # Enable the rc API of this rclone process, to change its bandwidth limit while it runs
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+                sock.bind(('127.0.0.1', 0))
+                port = sock.getsockname()[1]
+            rc_url = 'http://127.0.0.1:%s/' % port
+            rc_auth = ('baricadr', secrets.token_hex(16))
+            rate = progress.throttle.rclone_rate()
+            cmd += ['--bwlimit', rate, '--rc', '--rc-addr', '127.0.0.1:%s' % port, '--rc-user', rc_auth[0], '--rc-pass', rc_auth[1]]
+
+            def set_rate(new_rate):
+                r = requests.post(rc_url + 'core/bwlimit', json={'rate': new_rate}, auth=rc_auth, timeout=5)
+                r.raise_for_status()
+
+        current_app.logger.debug("Running command: %s" % cmd)
+
+        copied = []
+        failed = []
+        errors = []
+        p = Popen(cmd, stdin=DEVNULL, stdout=DEVNULL, stderr=PIPE)
+        for line in p.stderr:
+            try:
+                log = json.loads(line.decode('utf-8'))
+            except ValueError:
+                current_app.logger.debug("rclone: %s" % line)
+                continue
+
+            if 'stats' in log:
+                self._update_progress(progress, log['stats'])
+                if rate:
+                    rate = self._follow_bwlimit(progress, rate, set_rate)
+            elif log.get('msg', '').startswith('Copied') and 'object' in log:
+                copied.append(log['object'])
+            elif log.get('level') == 'error':
+                current_app.logger.error("rclone: %s: %s" % (log.get('object', ''), log.get('msg')))
+                errors.append(log.get('msg'))
+                if log.get('object'):
+                    failed.append(log['object'])
+        retcode = p.wait()
 
         if retcode != 0:
-            current_app.logger.error(output)
-            current_app.logger.error(err)
-            raise RuntimeError("Child was terminated by signal " + str(retcode) + ": can't run rclone lsjon (stderr: " + str(err) + ")")
+            planned = set(remote_file['Path'] for remote_file in plan.files)
+            failed = [rel_path for rel_path in failed if rel_path in planned]
+            if not failed:
+                # Errors not related to a file (e.g. connection failures)
+                failed = self._not_copied(repo, plan)
+            raise TransferError("Child was terminated by signal %s: can't copy %s (errors: %s)" % (retcode, plan.path, errors), copied, failed)
 
-        current_app.logger.info('Raw output from rclone lsjson: %s' % json_output)
+        return copied
 
-        path_rel_prefix = rel_path
-        if len(json_output) == 1 and not json_output[0]['IsDir']:
-            path_rel_prefix = os.path.dirname(rel_path)
+    def _rc_transfer(self, repo, plan, files_from, progress):
+        """
+        Run the transfer with the rclone daemon
+        """
 
-        remote_list = []
-        for entry in json_output:
-            if not entry['IsDir']:
-                if from_root:
-                    file_path = os.path.join(path_rel_prefix, entry['Path'])
-                else:
-                    file_path = entry['Path']
+        # We use IgnoreExisting to avoid deleting locally modified files (see _cli_transfer)
+        params = {
+            'srcFs': "%s:%s" % (self.remote_name, self.remote_prefix),
+            'dstFs': repo.local_path,
+            '_config': {'IgnoreExisting': True, 'NoTraverse': True},
+            '_filter': {'FilesFromRaw': [files_from]},
+        }
+        for option, value in repo.get_transfer_options(plan).items():
+            # e.g. multi_thread_streams => MultiThreadStreams
+            params['_config'][option.title().replace('_', '')] = value
 
-                if full:
-                    entry['Path'] = file_path
-                    remote_list.append(entry)
-                else:
-                    remote_list.append({'Path': file_path})
+        # The bandwidth limit applies to the whole daemon, used by one pull at a time in each worker process
+        def set_rate(new_rate):
+            self.rclone_daemon.call('core/bwlimit', {'rate': new_rate})
 
-        tempRcloneConfig.close()
-        if missing:
-            remote_list = self.missing_list(path, remote_list, max_depth, repo, full)
+        rate = None
+        if progress.throttle:
+            rate = self._follow_bwlimit(progress, None, set_rate)
 
-        current_app.logger.info('Parsed remote listing from rclone: %s' % remote_list)
+        def on_stats(stats):
+            nonlocal rate
+            self._update_progress(progress, stats)
+            if rate:
+                rate = self._follow_bwlimit(progress, rate, set_rate)
 
-        return remote_list
+        try:
+            self.rclone_daemon.run_job('sync/copy', params, on_stats)
+        except RuntimeError as e:
+            failed = self._not_copied(repo, plan)
+            raise TransferError(str(e), [remote_file['Path'] for remote_file in plan.files if remote_file['Path'] not in failed], failed)
+        finally:
+            if rate:
+                self._follow_bwlimit(progress, rate, set_rate, 'off')
 
-    def missing_list(self, path, remote_list, max_depth, repo, full=False):
+        # Files were missing when planning: if they exist now, they were written by this transfer
+        return [remote_file['Path'] for remote_file in plan.files if os.path.exists(os.path.join(repo.local_path, remote_file['Path']))]
 
-        remote_set = set([value['Path'] for value in remote_list])
+    def _follow_bwlimit(self, progress, rate, set_rate, new_rate=None):
+        """
+        Change the bandwidth limit of rclone when the share of the transfer in the bandwidth budget changes
 
-        if os.path.isfile(path):
-            file_set = set([repo.relative_path(path)])
-            return list(remote_list - file_set)
+        :type rate: str
+        :param rate: the limit currently applied
 
-        file_set = set()
-        for dir_, _, files in self.restricted_walk(path, max_depth):
-            for file_name in files:
-                rel_dir = os.path.relpath(dir_, path)
-                rel_file = os.path.join(rel_dir, file_name)
-                file_set.add(rel_file.lstrip("./"))
+        :type set_rate: function
+        :param set_rate: function(rate) applying a new limit with the rc 'core/bwlimit' command
 
-        sorted_list = sorted(list(remote_set - file_set))
+        :type new_rate: str
+        :param new_rate: the limit to apply (by default, the current share of the transfer)
 
-        if full:
-            return [file_dict for file_dict in remote_list if file_dict['Path'] in sorted_list]
-        else:
-            return [{'Path': file_path} for file_path in sorted_list]
+        :rtype: str
+        :return: the limit now applied
+        """
 
-    def restricted_walk(self, path, max_depth):
-        dirs, nondirs = [], []
-        for entry in os.scandir(path):
-            (dirs if entry.is_dir() else nondirs).append(entry.name)
-        yield path, dirs, nondirs
-        if not max_depth or max_depth > 1:
-            for name in dirs:
-                for x in self.restricted_walk(os.path.join(path, name), 0 if not max_depth else max_depth - 1):
-                    yield x
+        if new_rate is None:
+            new_rate = progress.throttle.rclone_rate()
 
-    def temp_rclone_config(self):
-        tempRcloneConfig = tempfile.NamedTemporaryFile('w+t')
-        tempRcloneConfig.write('[' + self.name + ']\n')
-        tempRcloneConfig.write('type = ' + self.name + '\n')
-        tempRcloneConfig.write('host = ' + self.remote_host + '\n')
-        tempRcloneConfig.seek(0)
+        if new_rate == rate:
+            return rate
 
-        return tempRcloneConfig
+        try:
+            set_rate(new_rate)
+        except (RuntimeError, requests.exceptions.RequestException) as e:
+            current_app.logger.warning("Could not change rclone bandwidth limit to %s: %s" % (new_rate, e))
+            return rate
+
+        current_app.logger.debug("Changed rclone bandwidth limit from %s to %s" % (rate, new_rate))
+
+        return new_rate
+
+    def _update_progress(self, progress, stats):
+        progress.set_round_stats(stats.get('bytes', 0), stats.get('transfers', 0), stats.get('speed'))
+        progress.report()
+
+    def _not_copied(self, repo, plan):
+        return [remote_file['Path'] for remote_file in plan.files if not os.path.exists(os.path.join(repo.local_path, remote_file['Path']))]
 
 
 class SftpBackend(RcloneBackend):
@@ -202,52 +1310,608 @@ class SftpBackend(RcloneBackend):
         self.remote_host = url_split[0]
         self.remote_prefix = os.path.join(url_split[1], '')
 
-    def pull(self, repo, path):
-        obscure_password = self.obscurify_password(self.password)
-        tempRcloneConfig = self.temp_rclone_config()
+    def rclone_config(self):
+        return {
+            'type': 'sftp',
+            'host': self.remote_host,
+            'user': self.user,
+            'pass': self.get_obscure_password()
+        }
 
-        rclone_cmd = 'copy'
-        if self.remote_is_single(repo, path):
-            rclone_cmd = 'copyto'
 
-        rel_path = repo.relative_path(path)
+class SftpSessionPool():
+    """
+    A pool of authenticated SFTP sessions to a remote host, reused between transfers
 
-        src = "%s:%s%s" % (self.name, self.remote_prefix, rel_path)
-        dest = "%s" % (path)
+    Sessions are opened on demand, and kept open (up to max_idle sessions) when released.
+    """
 
-        ex_options = ''
-        if repo.exclude:
-            excludes = repo.exclude.split(',')
-            for ex in excludes:
-                ex_options += " --exclude '%s'" % ex.strip()
+    def __init__(self, host, port, user, password, max_idle=8, timeout=30):
 
-        # We use --ignore-existing to avoid deleting locally modified files (for example if a file was modified locally but the backup is not yet up-to-date)
-        cmd = "rclone %s --ignore-existing --config '%s' '%s' '%s' --sftp-user '%s' --sftp-pass '%s' %s" % (rclone_cmd, tempRcloneConfig.name, src, dest, self.user, obscure_password, ex_options)
-        current_app.logger.debug("Running command: %s" % cmd)
-        p = Popen(cmd, shell=True, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        output, err = p.communicate()
-        retcode = p.returncode
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.max_idle = max_idle
+        self.timeout = timeout
 
-        if retcode != 0:
-            current_app.logger.error(output)
-            current_app.logger.error(err)
-            raise RuntimeError("Child was terminated by signal %s: can't copy %s (stderr: %s)" % (retcode, path, str(err)))
-        tempRcloneConfig.close()
+        self.idle = queue.LifoQueue()
+        self.pid = None
+        self.lock = threading.Lock()
+
+        atexit.register(self.close)
+
+    def acquire(self):
+        """
+        Get an open session, reusing an idle one if possible
+
+        :rtype: paramiko.SFTPClient
+        :return: an SFTP session
+        """
+
+        self._check_pid()
+
+        while True:
+            try:
+                sftp = self.idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+
+            if sftp.get_channel().get_transport().is_active():
+                return sftp
+
+            self._close_session(sftp)
+
+    def release(self, sftp, broken=False):
+        """
+        Give back a session to the pool
+
+        :type sftp: paramiko.SFTPClient
+        :param sftp: a session returned by acquire
+
+        :type broken: bool
+        :param broken: True if the session should not be reused (e.g. after a network error)
+        """
+
+        if broken or self.pid != os.getpid() or self.idle.qsize() >= self.max_idle:
+            self._close_session(sftp)
+        else:
+            self.idle.put(sftp)
+
+    def close(self):
+        """
+        Close all idle sessions
+        """
+
+        while True:
+            try:
+                self._close_session(self.idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def _check_pid(self):
+        # Celery workers are forked: sessions opened by the parent process must not be shared
+        with self.lock:
+            if self.pid != os.getpid():
+                self.idle = queue.LifoQueue()
+                self.pid = os.getpid()
+
+    def _connect(self):
+        current_app.logger.debug("Opening new SFTP session to %s@%s:%s" % (self.user, self.host, self.port))
+
+        transport = paramiko.Transport(socket.create_connection((self.host, self.port), timeout=self.timeout))
+        try:
+            transport.connect(username=self.user, password=self.password)
+            sftp = paramiko.SFTPClient.from_transport(transport)
+        except (paramiko.SSHException, OSError):
+            transport.close()
+            raise
+
+        sftp.get_channel().settimeout(self.timeout)
 
-        # Touch all files to set atime to now (but not mtime)
-        if self.remote_is_single(repo, path):
-            os.utime(path, (time.time(), os.stat(path).st_mtime))
+        return sftp
+
+    def _close_session(self, sftp):
+        try:
+            sftp.get_channel().get_transport().close()
+        except (paramiko.SSHException, OSError):
+            pass
+
+
+class SftpNativeBackend(Backend):
+    """
+    SFTP backend running in the worker process (using paramiko), without spawning rclone
+
+    Authenticated sessions are kept in a pool and reused between pulls, which makes small pulls much faster.
+    url is in the same format as the 'sftp' backend ('host:prefix'), with an optional port setting.
+    """
+
+    settings_keys = Backend.settings_keys + ['port']
+
+    # Default number of files downloaded in parallel
+    default_transfers = 4
+
+    # Default number of parallel streams for a single large file
+    default_multi_thread_streams = 4
+
+    # Files larger than this are downloaded with multiple streams
+    multi_thread_cutoff = 64 * 1024 * 1024
+
+    # Size of each read request (paramiko limits reads to 32KB)
+    read_size = 32768
+
+    # Size of the blocks requested in a row (pipelined) by each stream
+    block_size = 8 * 1024 * 1024
+
+    def __init__(self, conf):
+        Backend.__init__(self, conf)
+        self.name = 'sftp-native'
+
+        url_split = self.url.split(":")
+        self.remote_host = url_split[0]
+        self.remote_prefix = os.path.join(url_split[1], '')
+
+        try:
+            self.port = int(conf.get('port', 22))
+        except ValueError:
+            raise ValueError("Malformed port in backend config '%s'" % conf)
+
+        self.pool = SftpSessionPool(self.remote_host, self.port, self.user, self.password)
+
+    def list_entries(self, rel_path, max_depth=0, max_age=None, hashes=False, excludes=[]):
+        # Hashes are not available without a shell on the remote
+        remote_path = self.remote_prefix + rel_path.strip('/')
+
+        min_mtime = None
+        if max_age:
+            min_mtime = time.time() - max_age
+
+        sftp = self.pool.acquire()
+        broken = False
+        try:
+            try:
+                attr = sftp.stat(remote_path)
+            except IOError as e:
+                raise RuntimeError("Can't stat sftp path %s: %s" % (remote_path, e))
+
+            if not stat.S_ISDIR(attr.st_mode):
+                if min_mtime is None or attr.st_mtime >= min_mtime:
+                    yield self._entry(os.path.basename(remote_path), attr)
+                return
+
+            for entry in self._walk(sftp, remote_path, '', max_depth, min_mtime):
+                yield entry
+        except (paramiko.SSHException, socket.error):
+            broken = True
+            raise
+        finally:
+            self.pool.release(sftp, broken)
+
+    def transfer(self, repo, plan, progress):
+        options = repo.get_transfer_options(plan)
+        streams = options.get('multi_thread_streams', self.default_multi_thread_streams)
+
+        def fetch(remote_file, partial_path, offset):
+            remote_path = self.remote_prefix + remote_file['Path']
+            if not offset and streams > 1 and remote_file['Size'] >= self.multi_thread_cutoff:
+                # Parts are written out of order: written to another file, renamed once complete (an interrupted download cannot be resumed)
+                multi_path = re.sub(r'\.baricadr-partial$', '.multi.baricadr-partial', partial_path)
+                self._fetch_multi(remote_path, remote_file['Size'], multi_path, streams, progress)
+                os.rename(multi_path, partial_path)
+            else:
+                self._fetch_range(remote_path, partial_path, offset, remote_file['Size'] - offset, progress)
+
+        errors = (paramiko.SSHException, IOError)
+
+        return self.parallel_download(repo, plan, options.get('transfers') or self.default_transfers, fetch, progress, errors)
+
+    def _walk(self, sftp, remote_dir, sub_dir, max_depth, min_mtime):
+        # Depth-first, like rclone lsjson
+        try:
+            attrs = sftp.listdir_attr(os.path.join(remote_dir, sub_dir))
+        except IOError as e:
+            raise RuntimeError("Can't list sftp path %s: %s" % (os.path.join(remote_dir, sub_dir), e))
+
+        for attr in sorted(attrs, key=lambda attr: attr.filename):
+            sub_path = os.path.join(sub_dir, attr.filename)
+
+            if stat.S_ISLNK(attr.st_mode):
+                # Follow symlinks
+                try:
+                    attr = sftp.stat(os.path.join(remote_dir, sub_path))
+                except IOError:
+                    current_app.logger.warning("Skipping broken symlink %s" % os.path.join(remote_dir, sub_path))
+                    continue
+
+            if stat.S_ISDIR(attr.st_mode):
+                yield {'Path': sub_path, 'Name': os.path.basename(sub_path), 'Size': -1, 'ModTime': self._mod_time(attr), 'IsDir': True}
+                # If not 0 (0 is for listing all)
+                if not max_depth or sub_path.count('/') + 1 < max_depth:
+                    for entry in self._walk(sftp, remote_dir, sub_path, max_depth, min_mtime):
+                        yield entry
+            elif min_mtime is None or attr.st_mtime >= min_mtime:
+                yield self._entry(sub_path, attr)
+
+    def _fetch_multi(self, remote_path, size, temp_path, streams, progress):
+        """
+        Download a large file with multiple sessions, each one reading a part of the file
+        """
+
+        part_size = -(-size // streams)
+        with open(temp_path, 'wb') as temp_file:
+            temp_file.truncate(size)
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=streams) as executor:
+                fetch_range = with_app_context(self._fetch_range)
+                futures = [executor.submit(fetch_range, remote_path, temp_path, offset, min(part_size, size - offset), progress) for offset in range(0, size, part_size)]
+                for future in futures:
+                    future.result()
+        except Exception:
+            # Parts are written out of order: the file cannot be resumed
+            os.unlink(temp_path)
+            raise
+
+    def _fetch_range(self, remote_path, temp_path, offset, length, progress):
+        """
+        Download a part of a file, with pipelined read requests, to the same offset in temp_path
+        """
+
+        sftp = self.pool.acquire()
+        broken = False
+        try:
+            fd = os.open(temp_path, os.O_WRONLY)
+            try:
+                with sftp.open(remote_path, 'rb') as remote_file:
+                    end = offset + length
+                    while offset < end:
+                        # Send all read requests of a block at once, instead of waiting for each answer
+                        block_end = min(offset + self.block_size, end)
+                        chunks = [(chunk, min(self.read_size, block_end - chunk)) for chunk in range(offset, block_end, self.read_size)]
+                        for data in remote_file.readv(chunks):
+                            os.pwrite(fd, data, offset)
+                            offset += len(data)
+                            progress.add_bytes(len(data))
+            finally:
+                os.close(fd)
+        except (paramiko.SSHException, socket.error):
+            broken = True
+            raise
+        finally:
+            self.pool.release(sftp, broken)
+
+    def _entry(self, path, attr):
+        return {
+            'Path': path,
+            'Name': os.path.basename(path),
+            'Size': attr.st_size,
+            'ModTime': self._mod_time(attr),
+            'IsDir': False,
+            'MimeType': mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        }
+
+    def _mod_time(self, attr):
+        return datetime.datetime.fromtimestamp(attr.st_mtime, datetime.timezone.utc).isoformat()
+
+
+class LocalBackend(Backend):
+    """
+    Backend for a remote mounted on the workers (NFS, Lustre, ...), copying files with the kernel
+
+    url is the path to the mount point. user and password are not needed.
+    """
+
+    needs_credentials = False
+
+    # Default number of files copied in parallel
+    default_transfers = 8
+
+    # ioctl number of FICLONE (from linux/fs.h), to create reflinks on btrfs/xfs/...
+    ficlone = 0x40049409
+
+    # Max size copied with a single copy_file_range/sendfile call
+    copy_chunk_size = 64 * 1024 * 1024
+
+    def __init__(self, conf):
+        Backend.__init__(self, conf)
+        self.name = 'local'
+
+        self.remote_prefix = os.path.join(self.url, '')
+
+    def list_entries(self, rel_path, max_depth=0, max_age=None, hashes=False, excludes=[]):
+        remote_path = os.path.normpath(self.remote_prefix + rel_path.strip('/'))
+
+        min_mtime = None
+        if max_age:
+            min_mtime = time.time() - max_age
+
+        if os.path.isfile(remote_path):
+            entries = []
+            file_stat = os.stat(remote_path)
+            if min_mtime is None or file_stat.st_mtime >= min_mtime:
+                entries = [self._entry(os.path.basename(remote_path), file_stat)]
+            remote_path = os.path.dirname(remote_path)
+        elif os.path.isdir(remote_path):
+            entries = self._walk(remote_path, '', max_depth, min_mtime)
         else:
-            for root, subdirs, files in os.walk(path):
-                for name in files:
-                    candidate = os.path.join(root, name)
-                    os.utime(candidate, (time.time(), os.stat(candidate).st_mtime))
+            raise RuntimeError("Could not find path %s" % remote_path)
+
+        for entry in entries:
+            if hashes and not entry['IsDir']:
+                # Like rclone local backend: hashes are computed (and cached in xattrs when possible)
+                entry['Hashes'] = {'md5': checksums.local_hash(os.path.join(remote_path, entry['Path']), 'md5')}
+            yield entry
+
+    def transfer(self, repo, plan, progress):
+        options = repo.get_transfer_options(plan)
+
+        def fetch(remote_file, partial_path, offset):
+            self._copy(self.remote_prefix + remote_file['Path'], partial_path, offset, progress)
+
+        return self.parallel_download(repo, plan, options.get('transfers') or self.default_transfers, fetch, progress)
+
+    def _walk(self, remote_dir, sub_dir, max_depth, min_mtime):
+        try:
+            entries = sorted(os.scandir(os.path.join(remote_dir, sub_dir)), key=lambda entry: entry.name)
+        except OSError as e:
+            raise RuntimeError("Can't list path %s: %s" % (os.path.join(remote_dir, sub_dir), e))
+
+        for entry in entries:
+            sub_path = os.path.join(sub_dir, entry.name)
+
+            # Symlinks are followed
+            try:
+                is_dir = entry.is_dir()
+                entry_stat = entry.stat()
+            except OSError:
+                current_app.logger.warning("Skipping broken symlink %s" % entry.path)
+                continue
+
+            if is_dir:
+                yield {'Path': sub_path, 'Name': entry.name, 'Size': -1, 'ModTime': self._mod_time(entry_stat), 'IsDir': True}
+                # If not 0 (0 is for listing all)
+                if not max_depth or sub_path.count('/') + 1 < max_depth:
+                    for sub_entry in self._walk(remote_dir, sub_path, max_depth, min_mtime):
+                        yield sub_entry
+            elif min_mtime is None or entry_stat.st_mtime >= min_mtime:
+                yield self._entry(sub_path, entry_stat)
+
+    def _copy(self, src, dest, offset=0, progress=None):
+        """
+        Copy a file without going through userspace: reflink if the filesystem supports it, else copy_file_range or sendfile
+
+        Bytes before offset are expected to be already copied to dest.
+        """
+
+        with open(src, 'rb') as src_file, open(dest, 'r+b') as dest_file:
+            src_fd = src_file.fileno()
+            dest_fd = dest_file.fileno()
+
+            if not offset:
+                try:
+                    fcntl.ioctl(dest_fd, self.ficlone, src_fd)
+                    if progress:
+                        progress.add_bytes(os.fstat(src_fd).st_size)
+                    return
+                except OSError:
+                    # Not supported (different filesystems, or no reflink support)
+                    pass
 
+            size = os.fstat(src_fd).st_size
+            for copy_func in (getattr(os, 'copy_file_range', None), self._sendfile):
+                if copy_func is None:
+                    continue
+                try:
+                    os.lseek(src_fd, offset, os.SEEK_SET)
+                    os.lseek(dest_fd, offset, os.SEEK_SET)
+                    self._copy_range(copy_func, src_fd, dest_fd, offset, size, progress)
+                    return
+                except OSError:
+                    # e.g. copy_file_range between different filesystems on old kernels
+                    os.ftruncate(dest_fd, offset)
+
+            src_file.seek(offset)
+            dest_file.seek(offset)
+            shutil.copyfileobj(src_file, dest_file)
+            if progress:
+                progress.add_bytes(size - offset)
+
+    def _copy_range(self, copy_func, src_fd, dest_fd, copied, size, progress=None):
+        start = copied
+        try:
+            while copied < size:
+                written = copy_func(src_fd, dest_fd, min(self.copy_chunk_size, size - copied))
+                if written == 0:
+                    # File was truncated while copying
+                    break
+                copied += written
+                if progress:
+                    progress.add_bytes(written)
+        except OSError:
+            # Copied again by the next method: do not count these bytes twice
+            if progress and copied > start:
+                progress.add_bytes(start - copied, wait=False)
+            raise
+
+    def _sendfile(self, src_fd, dest_fd, count):
+        return os.sendfile(dest_fd, src_fd, None, count)
+
+    def _entry(self, path, file_stat):
+        return {
+            'Path': path,
+            'Name': os.path.basename(path),
+            'Size': file_stat.st_size,
+            'ModTime': self._mod_time(file_stat),
+            'IsDir': False,
+            'MimeType': mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        }
+
+    def _mod_time(self, file_stat):
+        return datetime.datetime.fromtimestamp(file_stat.st_mtime, datetime.timezone.utc).isoformat()
+
+
+class S3Backend(Backend):
+    """
+    Native S3 backend, using boto3
+
+    url is the bucket name, optionally followed by a prefix (e.g. 'bucket/some/prefix').
+    user and password are the access key id and secret access key.
+    """
+
+    settings_keys = Backend.settings_keys + ['endpoint_url', 'region']
+
+    # Default number of files downloaded in parallel
+    default_transfers = 4
+
+    # Default number of parallel ranged requests for a single large object
+    default_multi_thread_streams = 8
+
+    # Objects larger than this are downloaded with multiple ranged requests
+    multipart_threshold = 64 * 1024 * 1024
 
-class S3Backend(RcloneBackend):
     def __init__(self, conf):
-        RcloneBackend.__init__(self, conf)
+        Backend.__init__(self, conf)
         self.name = 's3'
 
-    def pull(self, repo, path):
-        raise NotImplementedError()
+        url_split = self.url.strip('/').split('/', 1)
+        self.bucket = url_split[0]
+        self.remote_prefix = ''
+        if len(url_split) > 1:
+            self.remote_prefix = os.path.join(url_split[1], '')
+
+        self.endpoint_url = conf.get('endpoint_url')
+        self.region = conf.get('region')
+
+        self.client = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def get_client(self):
+        """
+        Get a boto3 client, created once per process (clients are thread safe and keep a pool of connections)
+        """
+
+        with self.lock:
+            if self.client is None or self.pid != os.getpid():
+                session = boto3.session.Session()
+                self.client = session.client(
+                    's3',
+                    endpoint_url=self.endpoint_url,
+                    region_name=self.region,
+                    aws_access_key_id=self.user,
+                    aws_secret_access_key=self.password,
+                    config=botocore.config.Config(max_pool_connections=self.default_transfers * self.default_multi_thread_streams)
+                )
+                self.pid = os.getpid()
+
+            return self.client
+
+    def list_entries(self, rel_path, max_depth=0, max_age=None, hashes=False, excludes=[]):
+        client = self.get_client()
+        key = self.remote_prefix + rel_path.strip('/')
+
+        min_mtime = None
+        if max_age:
+            min_mtime = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=max_age)
+
+        # Single file
+        if rel_path.strip('/') and not rel_path.endswith('/'):
+            try:
+                head = client.head_object(Bucket=self.bucket, Key=key)
+                if min_mtime is None or head['LastModified'] >= min_mtime:
+                    yield self._entry(os.path.basename(key), key, head['ContentLength'], head['LastModified'], head.get('ETag') if hashes else None)
+                return
+            except botocore.exceptions.ClientError as e:
+                if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                    raise RuntimeError("Can't get S3 object %s: %s" % (key, e))
+
+        list_prefix = os.path.join(key, '') if key else ''
+        params = {'Bucket': self.bucket, 'Prefix': list_prefix}
+        # Let S3 skip subdirectories
+        if max_depth == 1:
+            params['Delimiter'] = '/'
+
+        found = False
+        try:
+            for page in client.get_paginator('list_objects_v2').paginate(**params):
+                for obj in page.get('Contents', []):
+                    found = True
+                    sub_path = obj['Key'][len(list_prefix):]
+                    # Directory markers
+                    if not sub_path or sub_path.endswith('/'):
+                        continue
+                    # If not 0 (0 is for listing all)
+                    if max_depth and sub_path.count('/') >= max_depth:
+                        continue
+                    if min_mtime is not None and obj['LastModified'] < min_mtime:
+                        continue
+
+                    yield self._entry(sub_path, obj['Key'], obj['Size'], obj['LastModified'], obj.get('ETag') if hashes else None)
+
+                if page.get('CommonPrefixes'):
+                    found = True
+        except botocore.exceptions.ClientError as e:
+            raise RuntimeError("Can't list S3 path %s: %s" % (list_prefix, e))
+
+        if not found:
+            raise RuntimeError("Could not find S3 path '%s' in bucket %s" % (list_prefix, self.bucket))
+
+    def transfer(self, repo, plan, progress):
+        options = repo.get_transfer_options(plan)
+
+        chunk_size = 8 * 1024 * 1024
+        if 'buffer_size' in options:
+            chunk_size = _parse_size(options['buffer_size'])
+
+        transfer_config = boto3.s3.transfer.TransferConfig(
+            multipart_threshold=self.multipart_threshold,
+            multipart_chunksize=chunk_size,
+            max_concurrency=options.get('multi_thread_streams') or self.default_multi_thread_streams
+        )
+
+        def fetch(remote_file, partial_path, offset):
+            key = self.remote_prefix + remote_file['Path']
+            if not offset:
+                # Large objects are downloaded with parallel ranged requests (only complete downloads are written to partial_path)
+                self.get_client().download_file(self.bucket, key, partial_path, Config=transfer_config, Callback=progress.add_bytes)
+                return
+
+            # Resume a download
+            response = self.get_client().get_object(Bucket=self.bucket, Key=key, Range='bytes=%s-' % offset)
+            with open(partial_path, 'ab') as partial_file:
+                for chunk in response['Body'].iter_chunks(chunk_size):
+                    partial_file.write(chunk)
+                    progress.add_bytes(len(chunk))
+
+        errors = (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError, OSError)
+
+        return self.parallel_download(repo, plan, options.get('transfers') or self.default_transfers, fetch, progress, errors)
+
+    def _entry(self, path, key, size, mtime, etag=None):
+        entry = {
+            'Path': path,
+            'Name': os.path.basename(key),
+            'Size': size,
+            'ModTime': mtime.isoformat(),
+            'IsDir': False,
+            'MimeType': mimetypes.guess_type(key)[0] or 'application/octet-stream'
+        }
+
+        if etag is not None:
+            etag = etag.strip('"')
+            # The ETag of multipart uploads is not the md5 of the object
+            entry['Hashes'] = {'md5': etag} if '-' not in etag else {}
+
+        return entry
+
+
+def _parse_size(size):
+    """
+    Convert a size like '16M' to bytes (same units as rclone, default is KiB)
+    """
+
+    units = {'b': 1, 'k': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    if size[-1] in units:
+        return int(size[:-1]) * units[size[-1]]
+
+    return int(size) * 1024
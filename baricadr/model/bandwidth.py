@@ -0,0 +1,280 @@
+import secrets
+import threading
+import time
+
+from flask import current_app
+
+import redis
+
+
+def parse_limit(limit):
+    """
+    Convert a bandwidth limit to bytes/s: a number of bytes/s, or a size like '100M' (per second)
+
+    :type limit: str
+    :param limit: the limit, as in the BANDWIDTH_LIMIT config option
+
+    :rtype: int
+    :return: the limit in bytes/s
+    """
+
+    # Same units as rclone, but a bare number is in bytes (not KiB)
+    units = {'b': 1, 'k': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    limit = str(limit).strip()
+    if limit and limit[-1] in units:
+        return int(limit[:-1]) * units[limit[-1]]
+
+    return int(limit)
+
+
+class BandwidthBudget():
+    """
+    A bandwidth budget shared by the transfers of all workers, stored in redis
+
+    Running transfers are registered with a priority, and get a share of the budget proportional to the weight of their priority.
+    All transferred bytes are counted in a token bucket: transfers which are not limited by rclone wait for it to refill.
+    """
+
+    # Pulls smaller than this (in bytes) get a high priority by default: someone is probably waiting for them
+    interactive_size = 100 * 1024 * 1024
+
+    # Weight of each priority in the budget split
+    weights = {'low': 1, 'normal': 4, 'high': 16}
+
+    # Transfers which did not refresh their registration during this time (in seconds) are considered dead
+    stale_after = 30
+
+    def __init__(self, redis_url, limit, burst=1):
+        """
+        :type redis_url: str
+        :param redis_url: url of the redis server
+
+        :type limit: int
+        :param limit: bandwidth budget (in bytes/s) for all transfers
+
+        :type burst: int
+        :param burst: time (in seconds) of transfer at full budget which can be done without waiting, after an idle period
+        """
+
+        self.redis = redis.Redis.from_url(redis_url)
+        self.limit = limit
+        self.burst = burst
+
+        self.registry_key = 'baricadr:bandwidth:transfers'
+        self.bucket_key = 'baricadr:bandwidth:bucket'
+
+    def register(self, priority='normal'):
+        """
+        Register a new transfer
+
+        :type priority: str
+        :param priority: one of the keys of weights
+
+        :rtype: Throttle
+        :return: a Throttle object for the transfer, to close when it is finished
+        """
+
+        if priority not in self.weights:
+            raise ValueError("Unknown transfer priority '%s'" % priority)
+
+        throttle = Throttle(self, secrets.token_hex(8), self.weights[priority])
+        self.heartbeat(throttle.transfer_id, throttle.weight)
+        current_app.logger.debug("Registered transfer %s with %s priority" % (throttle.transfer_id, priority))
+
+        return throttle
+
+    def unregister(self, transfer_id):
+        self.redis.hdel(self.registry_key, transfer_id)
+
+    def heartbeat(self, transfer_id, weight):
+        self.redis.hset(self.registry_key, transfer_id, '%s:%s' % (weight, time.time()))
+
+    def share(self, transfer_id, weight):
+        """
+        Refresh the registration of a transfer, and compute its share of the budget
+
+        :rtype: int
+        :return: bandwidth (in bytes/s) the transfer can use
+        """
+
+        now = time.time()
+        self.heartbeat(transfer_id, weight)
+
+        total_weight = 0
+        stale = []
+        for other_id, value in self.redis.hgetall(self.registry_key).items():
+            other_weight, last_seen = value.decode('utf-8').split(':')
+            if now - float(last_seen) > self.stale_after:
+                stale.append(other_id)
+            else:
+                total_weight += int(other_weight)
+
+        if stale:
+            # Left by workers which were killed
+            self.redis.hdel(self.registry_key, *stale)
+
+        return int(self.limit * weight / max(total_weight, weight))
+
+    def consume(self, num_bytes):
+        """
+        Take bytes from the token bucket, as a generic cell rate algorithm
+
+        The bucket is stored as the time at which it will be full again.
+
+        :type num_bytes: int
+        :param num_bytes: number of bytes transferred
+
+        :rtype: float
+        :return: time (in seconds) to wait before transferring more bytes, to stay within the budget
+        """
+
+        def update(pipe):
+            now = time.time()
+            full_at = pipe.get(self.bucket_key)
+            full_at = max(float(full_at), now) if full_at else now
+            full_at += num_bytes / self.limit
+
+            pipe.multi()
+            pipe.set(self.bucket_key, full_at, ex=int(full_at - now + self.burst) + 1)
+
+            return max(full_at - now - self.burst, 0)
+
+        return self.redis.transaction(update, self.bucket_key, value_from_callable=True)
+
+
+class Throttle():
+    """
+    Bandwidth limit of a running transfer, following its share of a BandwidthBudget
+    """
+
+    # Interval (in seconds) between two refreshes of the share of the budget
+    refresh_interval = 2
+
+    # Bytes are counted in the token bucket by blocks of this size
+    block_size = 1024 * 1024
+
+    def __init__(self, budget, transfer_id, weight):
+        """
+        :type budget: BandwidthBudget
+        :param budget: the budget shared by all transfers
+
+        :type transfer_id: str
+        :param transfer_id: id of the transfer in the budget registry
+
+        :type weight: int
+        :param weight: weight of the transfer priority
+        """
+
+        self.budget = budget
+        self.transfer_id = transfer_id
+        self.weight = weight
+
+        self.current_limit = None
+        self.refreshed = None
+
+        # Bytes not counted in the token bucket yet
+        self.pending = 0
+        # Local pacing at the transfer share
+        self.allowance = 0
+        self.allowance_time = time.time()
+
+        self.lock = threading.Lock()
+
+    def limit(self):
+        """
+        Get the bandwidth (in bytes/s) this transfer can use, refreshed every refresh_interval seconds
+        """
+
+        with self.lock:
+            now = time.time()
+            if self.refreshed is None or now - self.refreshed > self.refresh_interval:
+                self.current_limit = max(self.budget.share(self.transfer_id, self.weight), 1)
+                self.refreshed = now
+
+            return self.current_limit
+
+    def wait(self, num_bytes):
+        """
+        Count bytes transferred by a backend, and wait as long as needed to stay within the budget
+
+        Called from the threads transferring files.
+        """
+
+        limit = self.limit()
+
+        with self.lock:
+            now = time.time()
+            self.allowance = min(self.allowance + (now - self.allowance_time) * limit, limit) - num_bytes
+            self.allowance_time = now
+            delay = -self.allowance / limit if self.allowance < 0 else 0
+
+            self.pending += num_bytes
+            to_consume = 0
+            if self.pending >= self.block_size:
+                to_consume = self.pending
+                self.pending = 0
+
+        if to_consume:
+            delay = max(delay, self.budget.consume(to_consume))
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def count(self, num_bytes):
+        """
+        Count bytes transferred by rclone (already limited by --bwlimit), without waiting
+
+        Negative counts cancel bytes already counted, taken off the next bytes to consume from the bucket.
+        """
+
+        with self.lock:
+            self.pending += num_bytes
+            to_consume = 0
+            if self.pending >= self.block_size:
+                to_consume = self.pending
+                self.pending = 0
+
+        if to_consume:
+            self.budget.consume(to_consume)
+
+    def close(self):
+        self.budget.unregister(self.transfer_id)
+
+    def rclone_rate(self):
+        """
+        Get the current limit in the format of rclone --bwlimit
+        """
+
+        return '%sK' % max(self.limit() // 1024, 1)
+
+
+class PartThrottle():
+    """
+    Bandwidth limit of a part of a transfer, running in parallel with other parts (e.g. from several mirrors)
+
+    Each part gets an equal split of the transfer share. Bytes are still counted (and paced) by the throttle of the whole transfer.
+    """
+
+    def __init__(self, throttle, parts):
+        """
+        :type throttle: Throttle
+        :param throttle: bandwidth limit of the whole transfer
+
+        :type parts: int
+        :param parts: number of parts running in parallel
+        """
+
+        self.throttle = throttle
+        self.parts = max(parts, 1)
+
+    def limit(self):
+        return max(self.throttle.limit() // self.parts, 1)
+
+    def wait(self, num_bytes):
+        self.throttle.wait(num_bytes)
+
+    def count(self, num_bytes):
+        self.throttle.count(num_bytes)
+
+    def rclone_rate(self):
+        return '%sK' % max(self.limit() // 1024, 1)
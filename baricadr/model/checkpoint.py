@@ -0,0 +1,114 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+from baricadr.db_models import PullCheckpoint
+from baricadr.extensions import db
+
+from flask import current_app
+
+
+class Checkpoint():
+    """
+    The plan of a running pull, stored in the database to resume the pull if it gets interrupted
+
+    Files are written to their final path once complete, but a killed rclone may leave a truncated file there: files of the plan existing locally with the expected size are the completed ones.
+    """
+
+    def __init__(self, repo, path, task_id=None, max_age=86400):
+        """
+        :type repo: Repo object
+        :param repo: the repo to pull from
+
+        :type path: str
+        :param path: local path to pull
+
+        :type task_id: str
+        :param task_id: id of the task running the pull, if any
+
+        :type max_age: int
+        :param max_age: Time (in seconds) after which a checkpoint is not used anymore (the remote may have changed)
+        """
+
+        self.repo = repo
+        self.path = path
+        self.task_id = task_id
+        self.max_age = max_age
+
+    def load(self):
+        """
+        Get the files left to transfer from an interrupted pull of the same path
+
+        :rtype: PullPlan
+        :return: the remaining files, or None if there is no usable checkpoint
+        """
+
+        # Avoid circular import
+        from baricadr.model.backends import PullPlan
+
+        state = self._get_state()
+        if state is None:
+            return None
+
+        if state.created < datetime.utcnow() - timedelta(seconds=self.max_age):
+            current_app.logger.info("Ignoring expired pull checkpoint for path %s" % self.path)
+            self.remove()
+            return None
+
+        files = [remote_file for remote_file in json.loads(state.plan) if not self._is_complete(remote_file)]
+
+        current_app.logger.info("Resuming pull of %s from checkpoint of task %s (%s files left)" % (self.path, state.task_id, len(files)))
+
+        state.task_id = self.task_id
+        db.session.commit()
+
+        return PullPlan(self.repo, self.path, files)
+
+    def save(self, plan):
+        """
+        Store the plan of a pull
+
+        :type plan: PullPlan
+        :param plan: the files to transfer
+        """
+
+        state = self._get_state()
+        if state is None:
+            state = PullCheckpoint(path=self.path)
+            db.session.add(state)
+
+        state.task_id = self.task_id
+        state.created = datetime.utcnow()
+        state.plan = json.dumps(plan.files)
+        db.session.commit()
+
+    def remove(self):
+        """
+        Forget about the checkpoint (the pull is finished, or failed without being interrupted)
+        """
+
+        PullCheckpoint.query.filter_by(path=self.path).delete()
+        db.session.commit()
+
+    def _is_complete(self, remote_file):
+        """
+        Check if a file of the plan was completely transferred, removing it if it was only partially written
+        """
+
+        local_path = os.path.join(self.repo.local_path, remote_file['Path'])
+        try:
+            local_size = os.stat(local_path).st_size
+        except FileNotFoundError:
+            return False
+
+        # Size is -1 when unknown
+        if remote_file['Size'] >= 0 and local_size != remote_file['Size']:
+            # e.g. rclone killed while writing it: it would never be overwritten
+            current_app.logger.warning("Removing truncated file %s (%s bytes instead of %s)" % (local_path, local_size, remote_file['Size']))
+            os.unlink(local_path)
+            return False
+
+        return True
+
+    def _get_state(self):
+        return PullCheckpoint.query.filter_by(path=self.path).one_or_none()
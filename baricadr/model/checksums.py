@@ -0,0 +1,140 @@
+import concurrent.futures
+import errno
+import hashlib
+import os
+
+
+# Hash types we can compute locally, by order of preference (same names as rclone)
+HASH_TYPES = ['md5', 'sha1', 'sha256']
+
+# Size of each read when computing a hash (hashlib releases the GIL for large buffers, so hashing threads run in parallel)
+READ_SIZE = 4 * 1024 * 1024
+
+
+def pick_hash(hashes):
+    """
+    Choose a remote hash we can compare with a local hash
+
+    :type hashes: dict
+    :param hashes: remote hashes, as in the 'Hashes' field of 'rclone lsjson --hash' (e.g. {'md5': '...'})
+
+    :rtype: tuple
+    :return: (hash type, hash value), or None if no supported hash is available
+    """
+
+    if not hashes:
+        return None
+
+    for hash_type in HASH_TYPES:
+        if hashes.get(hash_type):
+            return hash_type, hashes[hash_type].lower()
+
+    return None
+
+
+def local_hash(path, hash_type):
+    """
+    Compute the hash of a local file, using the value cached in extended attributes if the file did not change
+
+    The access time of the file is left untouched (it is used to decide which files to freeze).
+
+    :type path: str
+    :param path: path of a local file
+
+    :type hash_type: str
+    :param hash_type: one of HASH_TYPES
+
+    :rtype: str
+    :return: hex digest of the file
+    """
+
+    file_stat = os.stat(path)
+    # The cached hash is valid as long as size and mtime do not change (and as long as it is the same file: xattrs can be copied with files)
+    cache_key = '%s:%s:%s:' % (file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino)
+
+    cached = _get_xattr(path, hash_type)
+    if cached and cached.startswith(cache_key):
+        return cached[len(cache_key):]
+
+    digest = hashlib.new(hash_type)
+
+    restore_atime = False
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_NOATIME', 0))
+    except PermissionError:
+        # O_NOATIME is only allowed for the owner of the file
+        fd = os.open(path, os.O_RDONLY)
+        restore_atime = True
+
+    with os.fdopen(fd, 'rb', buffering=0) as local_file:
+        while True:
+            data = local_file.read(READ_SIZE)
+            if not data:
+                break
+            digest.update(data)
+
+    if restore_atime:
+        os.utime(path, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns))
+
+    hex_digest = digest.hexdigest()
+    _set_xattr(path, hash_type, cache_key + hex_digest)
+
+    return hex_digest
+
+
+def verify_files(files, workers=4):
+    """
+    Compare local files with their remote hashes, hashing files in parallel
+
+    :type files: dict
+    :param files: remote hashes (as in the 'Hashes' field of 'rclone lsjson --hash') for each local path to check
+
+    :type workers: int
+    :param workers: number of files hashed in parallel
+
+    :rtype: dict
+    :return: for each local path, True if the hash matches, False if it doesn't, None if no remote hash can be used
+    """
+
+    results = {}
+    to_hash = {}
+    for path, hashes in files.items():
+        remote_hash = pick_hash(hashes)
+        if remote_hash is None:
+            results[path] = None
+        else:
+            to_hash[path] = remote_hash
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = {executor.submit(local_hash, path, hash_type): (path, value) for path, (hash_type, value) in to_hash.items()}
+        for future in concurrent.futures.as_completed(futures):
+            path, value = futures[future]
+            results[path] = future.result() == value
+
+    return results
+
+
+def _xattr_name(hash_type):
+    return 'user.baricadr.%s' % hash_type
+
+
+def _get_xattr(path, hash_type):
+    if not hasattr(os, 'getxattr'):
+        return None
+
+    try:
+        return os.getxattr(path, _xattr_name(hash_type)).decode('utf-8')
+    except OSError:
+        return None
+
+
+def _set_xattr(path, hash_type, value):
+    if not hasattr(os, 'setxattr'):
+        return
+
+    try:
+        os.setxattr(path, _xattr_name(hash_type), value.encode('utf-8'))
+    except OSError as e:
+        # Not supported by the filesystem, or read-only file: the hash will be computed again next time
+        if e.errno not in (errno.ENOTSUP, errno.EACCES, errno.EPERM, errno.EROFS):
+            raise
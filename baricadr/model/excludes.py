@@ -0,0 +1,84 @@
+import fnmatch
+import os
+import re
+
+
+class ExcludeMatcher():
+    """
+    Exclude patterns of a repo, compiled once
+
+    Patterns are shell-style wildcards (like fnmatch), matched against paths relative to the repo root, or against file names.
+    """
+
+    def __init__(self, exclude=None):
+        """
+        :type exclude: str
+        :param exclude: comma-separated patterns (from the 'exclude' repo option)
+        """
+
+        self.patterns = []
+        if exclude:
+            self.patterns = [pattern.strip() for pattern in str(exclude).split(',') if pattern.strip()]
+
+        self.regex = None
+        self.dir_regex = None
+        if self.patterns:
+            self.regex = re.compile('|'.join('(?:%s)' % fnmatch.translate(pattern) for pattern in self.patterns))
+
+            # A pattern ending with '*' matching 'some/dir/' matches everything inside it
+            dir_patterns = [pattern for pattern in self.patterns if pattern.endswith('*')]
+            if dir_patterns:
+                self.dir_regex = re.compile('|'.join('(?:%s)' % fnmatch.translate(pattern) for pattern in dir_patterns))
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    def matches(self, rel_path):
+        """
+        Check if a file is excluded
+
+        :type rel_path: str
+        :param rel_path: path of the file, relative to the repo root
+
+        :rtype: bool
+        :return: True if the file is excluded
+        """
+
+        if self.regex is None:
+            return False
+
+        return self.regex.match(rel_path) is not None or self.regex.match(os.path.basename(rel_path)) is not None
+
+    def prunes(self, rel_dir):
+        """
+        Check if all the files in a directory are excluded, so that it does not need to be walked
+
+        :type rel_dir: str
+        :param rel_dir: path of the directory, relative to the repo root
+
+        :rtype: bool
+        :return: True if the whole directory is excluded
+        """
+
+        if self.dir_regex is None:
+            return False
+
+        return self.dir_regex.match(os.path.join(rel_dir, '')) is not None
+
+    def rclone_filters(self):
+        """
+        Get the patterns which rclone can apply itself when listing, as rclone filter rules
+
+        rclone patterns match the end of paths relative to the listed directory, and '*' does not match '/'.
+        Only patterns starting with '*' and not containing '/' exclude the same files (or less) when turned into '**' patterns: others are only applied by baricadr.
+
+        :rtype: list
+        :return: rclone patterns, to use with --exclude
+        """
+
+        filters = []
+        for pattern in self.patterns:
+            if pattern.startswith('*') and not any(char in pattern for char in '/[]{}\\\''):
+                filters.append(re.sub(r'\*+', '**', pattern))
+
+        return filters
@@ -0,0 +1,344 @@
+import concurrent.futures
+import gzip
+import heapq
+import json
+import os
+import time
+
+from flask import current_app
+
+import numpy
+
+
+# Number of local files checked and removed at once when freezing
+BATCH_SIZE = 10000
+
+# Local files modified more than this (in seconds) after the remote file were changed locally, and cannot be freezed
+# Assuming 10s delay? Maybe more? -> Might need to be fine-tuned. Tests shows 0.22s
+MODIFIED_DELAY = 10
+
+
+def parse_mod_times(mod_times):
+    """
+    Parse ISO 8601 modification times (as listed by backends) in a single pass
+
+    Times must end with an UTC offset ('Z', '+01:00', ...), or are considered in UTC.
+
+    :type mod_times: list
+    :param mod_times: ISO 8601 strings
+
+    :rtype: numpy.ndarray
+    :return: timestamps (in seconds since epoch, as float64)
+    """
+
+    if not len(mod_times):
+        return numpy.empty(0)
+
+    times = numpy.char.replace(numpy.asarray(mod_times, dtype=str), 'Z', '+00:00')
+
+    width = times.dtype.itemsize // 4
+    chars = times.view('U1').reshape(len(times), width)
+    lengths = numpy.char.str_len(times)
+
+    # Last 6 chars of each time: [+-]HH:MM
+    offset_pos = numpy.maximum(lengths[:, None] + numpy.arange(-6, 0), 0)
+    offset_chars = chars[numpy.arange(len(times))[:, None], offset_pos]
+    has_offset = numpy.isin(offset_chars[:, 0], ['+', '-']) & (offset_chars[:, 3] == ':')
+
+    digits = offset_chars.view(numpy.uint32).astype(numpy.int64) - ord('0')
+    offsets = (digits[:, 1] * 10 + digits[:, 2]) * 3600 + (digits[:, 4] * 10 + digits[:, 5]) * 60
+    offsets = numpy.where(offset_chars[:, 0] == '-', -offsets, offsets)
+    offsets = numpy.where(has_offset, offsets, 0)
+
+    # Drop the offsets, and parse the remaining naive times
+    chars[(numpy.arange(width) >= lengths[:, None] - 6) & has_offset[:, None]] = ''
+    naive = chars.view('U%s' % width).ravel().astype('datetime64[ns]')
+
+    return naive.astype(numpy.int64) / 1e9 - offsets
+
+
+def freezable_mask(local_mtimes, local_atimes, remote_mtimes, freeze_age, force=False):
+    """
+    Check which files can be freezed, as array operations
+
+    :type local_mtimes: numpy.ndarray
+    :param local_mtimes: modification timestamps of the local files
+
+    :type local_atimes: numpy.ndarray
+    :param local_atimes: access timestamps of the local files
+
+    :type remote_mtimes: numpy.ndarray
+    :param remote_mtimes: modification timestamps of the remote files
+
+    :type freeze_age: int
+    :param freeze_age: minimum number of days since the last access
+
+    :type force: bool
+    :param force: Whether to ignore atime
+
+    :rtype: numpy.ndarray
+    :return: boolean mask of the files which can be freezed
+    """
+
+    # Not modified since pulled
+    mask = (local_mtimes - remote_mtimes) <= MODIFIED_DELAY
+
+    if not force:
+        mask &= days_since_access(local_atimes) > freeze_age
+
+    return mask
+
+
+def days_since_access(atimes):
+    """
+    Count the days between access times and today, comparing local dates
+
+    :type atimes: numpy.ndarray
+    :param atimes: access timestamps (a single float works too)
+
+    :rtype: numpy.ndarray
+    :return: number of days
+    """
+
+    # Days since epoch, shifted to the local timezone
+    now = time.time()
+    utc_offset = time.localtime(now).tm_gmtoff
+    last_access = numpy.floor((atimes + utc_offset) / 86400)
+    today = numpy.floor((now + utc_offset) / 86400)
+
+    return today - last_access
+
+
+def disk_usage(path):
+    """
+    Get the usage of the filesystem of a path, as shown by df (a single statvfs call)
+
+    :type path: str
+    :param path: Any path on the filesystem
+
+    :rtype: tuple
+    :return: used bytes, and size in bytes (used and available to users)
+    """
+
+    stat = os.statvfs(path)
+    used = (stat.f_blocks - stat.f_bfree) * stat.f_frsize
+    available = stat.f_bavail * stat.f_frsize
+
+    return used, used + available
+
+
+class EvictionHeap():
+    """
+    Select the files to evict to free some space, among files pushed one at a time
+
+    Files are scored by the time since their last access multiplied by their size: old and big files are evicted first.
+    Only the best scored files needed to free the space are kept (in a min-heap), so that memory does not grow with the number of files pushed.
+    """
+
+    def __init__(self, bytes_to_free, now=None):
+        """
+        :type bytes_to_free: int
+        :param bytes_to_free: Number of bytes to free
+
+        :type now: float
+        :param now: Timestamp to compute the time since last access from (default: now)
+        """
+
+        self.bytes_to_free = bytes_to_free
+        self.now = now if now is not None else time.time()
+
+        self.heap = []
+        self.size = 0
+
+    def push(self, path, size, atime):
+        """
+        Add a file which can be evicted
+
+        :type path: str
+        :param path: Path of the file
+
+        :type size: int
+        :param size: Size of the file (in bytes)
+
+        :type atime: float
+        :param atime: Last access timestamp of the file
+        """
+
+        score = max(self.now - atime, 1) * max(size, 1)
+        if self.heap and self.size >= self.bytes_to_free and score <= self.heap[0][0]:
+            # Enough better scored files already
+            return
+
+        heapq.heappush(self.heap, (score, path, size))
+        self.size += size
+
+        # Drop the worst scored files while the others are enough
+        while self.heap and self.size - self.heap[0][2] >= self.bytes_to_free:
+            score, path, size = heapq.heappop(self.heap)
+            self.size -= size
+
+    def files(self):
+        """
+        Get the files to evict
+
+        :rtype: list
+        :return: (path, size) tuples, best scored first
+        """
+
+        return [(path, size) for score, path, size in sorted(self.heap, reverse=True)]
+
+
+class FreezeReport():
+    """
+    Report of a freeze, written as a stream of gzipped JSON lines (one per file)
+    """
+
+    def __init__(self, path):
+        """
+        :type path: str
+        :param path: Path of the report file
+        """
+
+        self.path = path
+        self.report_file = gzip.open(path, 'wt')
+
+    def write(self, record):
+        self.report_file.write(json.dumps(record) + '\n')
+
+    def close(self):
+        self.report_file.close()
+
+
+class FreezeExecutor():
+    """
+    Remove freezable files, grouped by directory, with several directories processed in parallel
+
+    Files are unlinked relative to a file descriptor of their directory, which avoids resolving the full path for each file.
+    """
+
+    def __init__(self, root, workers=4, dry_run=False, prune_empty=False, report=None):
+        """
+        :type root: str
+        :param root: Root of the repo (never removed when pruning empty directories)
+
+        :type workers: int
+        :param workers: Number of directories processed in parallel
+
+        :type dry_run: bool
+        :param dry_run: Do not remove anything, only report what would be done
+
+        :type prune_empty: bool
+        :param prune_empty: Remove the directories left empty after removing files
+
+        :type report: FreezeReport
+        :param report: Report to write each file in (optional)
+        """
+
+        self.root = root
+        self.workers = workers
+        self.dry_run = dry_run
+        self.prune_empty = prune_empty
+        self.report = report
+
+        self.touched_dirs = set()
+        self.stats = {'files': 0, 'bytes': 0, 'errors': 0, 'dirs': 0}
+
+    def freeze(self, files):
+        """
+        Remove a batch of files
+
+        :type files: list
+        :param files: (path, size) tuples
+
+        :rtype: list
+        :return: Paths of the freezed files (or which would be freezed in dry-run mode)
+        """
+
+        by_dir = {}
+        for file_path, size in files:
+            dir_path, name = os.path.split(file_path)
+            by_dir.setdefault(dir_path, []).append((name, size))
+
+        freezed = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._freeze_dir, dir_path, dir_files) for dir_path, dir_files in by_dir.items()]
+            for future in concurrent.futures.as_completed(futures):
+                dir_path, results = future.result()
+                self.touched_dirs.add(dir_path)
+                for name, size, error in results:
+                    file_path = os.path.join(dir_path, name)
+                    if error:
+                        current_app.logger.warning("Could not freeze '%s': %s" % (file_path, error))
+                        self.stats['errors'] += 1
+                        self._write(file_path, 'failed', size, error)
+                        continue
+
+                    freezed.append(file_path)
+                    self.stats['files'] += 1
+                    self.stats['bytes'] += size
+                    self._write(file_path, 'would_freeze' if self.dry_run else 'freezed', size)
+
+        return freezed
+
+    def finish(self):
+        """
+        Remove the directories left empty, once all files were removed
+
+        :rtype: dict
+        :return: number of freezed files, bytes, errors and removed directories
+        """
+
+        if self.prune_empty and not self.dry_run:
+            removed = set()
+            # Deepest first, so that parents can be emptied by their children
+            for dir_path in sorted(self.touched_dirs, key=lambda path: path.count(os.sep), reverse=True):
+                while dir_path not in removed and dir_path.startswith(os.path.join(self.root, '')):
+                    try:
+                        os.rmdir(dir_path)
+                    except OSError:
+                        # Not empty (or already removed)
+                        break
+                    removed.add(dir_path)
+                    self.stats['dirs'] += 1
+                    self._write(dir_path, 'removed_dir')
+                    dir_path = os.path.dirname(dir_path)
+
+        return self.stats
+
+    def _freeze_dir(self, dir_path, files):
+        if self.dry_run:
+            return dir_path, [(name, size, None) for name, size in files]
+
+        results = []
+        try:
+            dir_fd = os.open(dir_path, os.O_RDONLY | os.O_DIRECTORY)
+        except OSError as e:
+            return dir_path, [(name, size, str(e)) for name, size in files]
+
+        try:
+            for name, size in files:
+                try:
+                    os.unlink(name, dir_fd=dir_fd)
+                    results.append((name, size, None))
+                except FileNotFoundError:
+                    # Removed in the meantime, nothing to freeze anymore
+                    continue
+                except OSError as e:
+                    results.append((name, size, str(e)))
+        finally:
+            os.close(dir_fd)
+
+        return dir_path, results
+
+    def _write(self, path, action, size=None, error=None):
+        current_app.logger.debug("%s '%s'" % (action.capitalize().replace('_', ' '), path))
+
+        if self.report is None:
+            return
+
+        record = {'path': os.path.relpath(path, self.root), 'action': action}
+        if size is not None:
+            record['size'] = size
+        if error:
+            record['error'] = error
+        self.report.write(record)
@@ -0,0 +1,217 @@
+import concurrent.futures
+import json
+import os
+from datetime import datetime
+
+from baricadr.db_models import FreezeDirState, FreezeScan
+from baricadr.extensions import db
+from baricadr.model.freeze import BATCH_SIZE, days_since_access
+
+from flask import current_app
+
+
+class FreezeScanner():
+    """
+    Incremental walk of a local path to freeze, skipping the directories which cannot contain freezable files
+
+    The state of each directory is kept in the database after each scan: its modification time, and the earliest access time of its files.
+    A directory with the same modification time has the same files. If they were all accessed less than freeze_age days ago, it is not scanned again.
+    Access times only move forward when files are read: files with an access time set back explicitly (e.g. with touch) are only found by a full freeze.
+    """
+
+    def __init__(self, repo, path, workers=8):
+        """
+        :type repo: Repo object
+        :param repo: the repo to freeze files in
+
+        :type path: str
+        :param path: local path of a directory to freeze
+
+        :type workers: int
+        :param workers: Number of directories scanned in parallel
+        """
+
+        self.repo = repo
+        self.path = path
+        self.workers = workers
+
+        self.root = repo.relative_path(path)
+        self.states = {state.path: state for state in FreezeDirState.query.filter(FreezeDirState.repo == repo.local_path)}
+        # Read by the scanning threads, which cannot use the db session
+        self.known = {rel_dir: (state.mtime, state.min_atime, state.subdirs, state.scanned) for rel_dir, state in self.states.items()}
+
+        self.resume_since = None
+        self.scan = FreezeScan.query.filter_by(path=path).first()
+        if self.scan is None:
+            self.scan = FreezeScan(path=path)
+            db.session.add(self.scan)
+        elif self.scan.finished is None:
+            # Directories scanned before the interruption are not scanned again
+            current_app.logger.info("Resuming interrupted freeze scan of %s, started on %s" % (path, self.scan.started))
+            self.resume_since = self.scan.started
+        else:
+            self.scan.started = datetime.utcnow()
+            self.scan.finished = None
+        db.session.commit()
+
+        self.visited = set()
+        self.touched = set()
+        self.stats = {'scanned': 0, 'skipped': 0}
+
+    def iter_batches(self):
+        """
+        Walk the path, scanning the directories which may contain freezable files
+
+        :rtype: generator
+        :return: generator of (files, dirs) tuples, with files a list of (path, os.stat_result) tuples (about BATCH_SIZE), and dirs the scanned directories to give to record
+        """
+
+        files = []
+        dirs = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = set([executor.submit(self._visit, self.root)])
+            try:
+                while pending:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        rel_dir, dir_mtime, dir_files, subdirs = future.result()
+                        if dir_mtime is None:
+                            continue
+
+                        self.visited.add(rel_dir)
+                        for subdir in subdirs:
+                            pending.add(executor.submit(self._visit, os.path.join(rel_dir, subdir)))
+
+                        if dir_files is None:
+                            self.stats['skipped'] += 1
+                            continue
+
+                        self.stats['scanned'] += 1
+                        files += dir_files
+                        dirs.append((rel_dir, dir_mtime, dir_files, subdirs))
+                        if len(files) >= BATCH_SIZE:
+                            yield files, dirs
+                            files = []
+                            dirs = []
+            finally:
+                for future in pending:
+                    future.cancel()
+
+        if dirs:
+            yield files, dirs
+
+    def record(self, dirs, freezed):
+        """
+        Save the state of scanned directories, once their freezable files were removed
+
+        :type dirs: list
+        :param dirs: directories from iter_batches
+
+        :type freezed: list
+        :param freezed: Paths of the freezed files
+        """
+
+        freezed = set(freezed)
+        now = datetime.utcnow()
+        for rel_dir, dir_mtime, dir_files, subdirs in dirs:
+            left_atimes = [file_stat.st_atime for file_path, file_stat in dir_files if file_path not in freezed]
+            if len(left_atimes) < len(dir_files):
+                # Removing files changed the directory
+                self.touched.add(rel_dir)
+                try:
+                    dir_mtime = os.stat(self._local_dir(rel_dir)).st_mtime_ns
+                except OSError:
+                    continue
+
+            state = self.states.get(rel_dir)
+            if state is None:
+                state = FreezeDirState(repo=self.repo.local_path, path=rel_dir)
+                db.session.add(state)
+                self.states[rel_dir] = state
+
+            state.mtime = dir_mtime
+            state.min_atime = min(left_atimes) if left_atimes else None
+            state.file_count = len(left_atimes)
+            state.subdirs = json.dumps(sorted(subdirs))
+            state.scanned = now
+
+        db.session.commit()
+
+    def finish(self):
+        """
+        Mark the scan as complete, and forget the directories which do not exist anymore
+
+        :rtype: dict
+        :return: number of scanned and skipped directories
+        """
+
+        for rel_dir, state in list(self.states.items()):
+            if not self._in_root(rel_dir):
+                continue
+
+            gone = rel_dir not in self.visited or (rel_dir in self.touched and not os.path.isdir(self._local_dir(rel_dir)))
+            if gone:
+                db.session.delete(state)
+                del self.states[rel_dir]
+
+        self.scan.finished = datetime.utcnow()
+        db.session.commit()
+
+        current_app.logger.info("Freeze scan of %s: %s directories scanned, %s skipped" % (self.path, self.stats['scanned'], self.stats['skipped']))
+
+        return self.stats
+
+    def _visit(self, rel_dir):
+        """
+        Scan a directory, unless it cannot contain freezable files
+
+        :rtype: tuple
+        :return: the directory, its mtime (None if it does not exist), its files as (path, os.stat_result) tuples (None if skipped), and its subdirectories names
+        """
+
+        dir_path = self._local_dir(rel_dir)
+        try:
+            dir_mtime = os.stat(dir_path).st_mtime_ns
+        except OSError:
+            return rel_dir, None, None, []
+
+        known = self.known.get(rel_dir)
+        if self._can_skip(known, dir_mtime):
+            return rel_dir, dir_mtime, None, json.loads(known[2])
+
+        files = []
+        subdirs = []
+        try:
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir():
+                            if not entry.is_symlink() and not self.repo.is_excluded(entry.path, True):
+                                subdirs.append(entry.name)
+                        elif not self.repo.is_excluded(entry.path):
+                            files.append((entry.path, entry.stat()))
+                    except OSError:
+                        continue
+        except OSError:
+            return rel_dir, None, None, []
+
+        return rel_dir, dir_mtime, files, subdirs
+
+    def _can_skip(self, known, dir_mtime):
+        if known is None:
+            return False
+
+        mtime, min_atime, subdirs, scanned = known
+        if mtime != dir_mtime:
+            return False
+
+        if self.resume_since is not None and scanned >= self.resume_since:
+            return True
+
+        return min_atime is None or days_since_access(min_atime) <= self.repo.freeze_age
+
+    def _local_dir(self, rel_dir):
+        return os.path.join(self.repo.local_path, rel_dir) if rel_dir else self.repo.local_path
+
+    def _in_root(self, rel_dir):
+        return not self.root or rel_dir == self.root or rel_dir.startswith(os.path.join(self.root, ''))
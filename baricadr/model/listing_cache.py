@@ -0,0 +1,115 @@
+import json
+import time
+import zlib
+
+from flask import current_app
+
+import redis
+
+
+class ListingCache():
+    """
+    A cache of remote listings, stored in redis to be shared by all web and worker processes
+    """
+
+    def __init__(self, redis_url, ttl, stale_ttl=0):
+        """
+        :type redis_url: str
+        :param redis_url: url of the redis server
+
+        :type ttl: int
+        :param ttl: time (in seconds) during which a cached listing is used as is
+
+        :type stale_ttl: int
+        :param stale_ttl: time (in seconds) after ttl during which a cached listing is still used, while it is refreshed in background
+        """
+
+        self.redis = redis.Redis.from_url(redis_url)
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+
+    def get(self, repo, path, missing=False, max_depth=1, from_root=False, full=False):
+        """
+        Get a listing from the cache
+
+        :rtype: tuple
+        :return: (list of files, True if the listing is stale), or None if not in cache
+        """
+
+        value = self.redis.get(self._key(repo, path, missing, max_depth, from_root, full))
+        if value is None:
+            return None
+
+        cached = json.loads(zlib.decompress(value).decode('utf-8'))
+        stale = time.time() - cached['time'] > self.ttl
+
+        return cached['files'], stale
+
+    def set(self, repo, path, files, missing=False, max_depth=1, from_root=False, full=False):
+        """
+        Store a listing in the cache
+        """
+
+        key = self._key(repo, path, missing, max_depth, from_root, full)
+        value = zlib.compress(json.dumps({'time': time.time(), 'files': files}).encode('utf-8'))
+
+        expire = self.ttl + self.stale_ttl
+        pipe = self.redis.pipeline()
+        pipe.set(key, value, ex=expire)
+        # Keep track of cached keys for each repo, for invalidation
+        pipe.sadd(self._index_key(repo), key)
+        pipe.expire(self._index_key(repo), expire)
+        pipe.execute()
+
+    def lock_refresh(self, repo, path, missing=False, max_depth=1, from_root=False, full=False):
+        """
+        Make sure only one process refreshes a stale listing
+
+        :rtype: bool
+        :return: True if the caller should refresh the listing
+        """
+
+        key = 'baricadr:listing_refresh:%s' % self._key(repo, path, missing, max_depth, from_root, full)
+
+        return bool(self.redis.set(key, 1, nx=True, ex=max(self.ttl, 1)))
+
+    def invalidate(self, repo, path):
+        """
+        Remove cached listings of a path, of its subdirectories and of its parent directories
+
+        :type repo: Repo object
+        :param repo: a Repo object
+
+        :type path: str
+        :param path: local path which was modified (pulled or freezed)
+        """
+
+        touched = self._normalize(repo.relative_path(path))
+
+        index_key = self._index_key(repo)
+        to_delete = []
+        for key in self.redis.sscan_iter(index_key):
+            cached_path = self._normalize(json.loads(key.decode('utf-8')[len(index_key) + 1:])[0])
+            if self._is_parent_or_same(cached_path, touched) or self._is_parent_or_same(touched, cached_path):
+                to_delete.append(key)
+
+        if to_delete:
+            current_app.logger.debug("Invalidating %s cached listings for path %s" % (len(to_delete), path))
+            pipe = self.redis.pipeline()
+            pipe.delete(*to_delete)
+            pipe.srem(index_key, *to_delete)
+            pipe.execute()
+
+    def _index_key(self, repo):
+        return 'baricadr:listing:%s' % repo.local_path
+
+    def _key(self, repo, path, missing, max_depth, from_root, full):
+        params = [repo.relative_path(path), str(max_depth), bool(missing), bool(from_root), bool(full)]
+
+        return '%s:%s' % (self._index_key(repo), json.dumps(params))
+
+    def _normalize(self, rel_path):
+        return rel_path.strip('/')
+
+    def _is_parent_or_same(self, parent, child):
+        return parent == '' or child == parent or child.startswith(parent + '/')
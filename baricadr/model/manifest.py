@@ -0,0 +1,189 @@
+import mimetypes
+import os
+from datetime import datetime, timedelta
+
+from baricadr.db_models import RemoteFile, RemoteManifest
+from baricadr.extensions import db
+from baricadr.model import checksums
+
+from flask import current_app
+
+
+class Manifest():
+    """
+    A persistent index of the files on the remote of a repo, stored in the database
+
+    Incremental refreshes only list files modified since the previous refresh (using --max-age).
+    Full refreshes list everything and forget about files deleted from the remote.
+    """
+
+    # Number of files stored/loaded at once in the database
+    batch_size = 1000
+
+    # Margin (in seconds) added to incremental refreshes, to catch files written during the previous refresh
+    refresh_margin = 600
+
+    def __init__(self, repo, full_refresh_interval=7):
+        """
+        :type repo: Repo object
+        :param repo: the repo to index
+
+        :type full_refresh_interval: int
+        :param full_refresh_interval: Interval (in days) between two full refreshes
+        """
+
+        self.repo = repo
+        self.full_refresh_interval = full_refresh_interval
+
+    def is_ready(self):
+        """
+        Check if the manifest can be used (a full refresh was run at least once)
+        """
+
+        state = self._get_state()
+
+        return state is not None and state.last_full_refresh is not None
+
+    def list_entries(self, rel_path, max_depth=0):
+        """
+        Same as Backend.list_entries, using the manifest instead of listing the remote
+
+        :rtype: generator
+        :return: generator of dicts in the format of 'rclone lsjson'
+        """
+
+        rel_path = rel_path.strip('/')
+
+        query = RemoteFile.query.filter(RemoteFile.repo == self.repo.local_path)
+
+        if rel_path:
+            single = query.filter(RemoteFile.path == rel_path).one_or_none()
+            if single:
+                yield self._entry(single, os.path.basename(rel_path))
+                return
+
+            prefix = rel_path + '/'
+            escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            query = query.filter(RemoteFile.path.like(escaped + '%', escape='\\'))
+        else:
+            prefix = ''
+
+        for remote_file in query.order_by(RemoteFile.path).yield_per(self.batch_size):
+            sub_path = remote_file.path[len(prefix):]
+            # If not 0 (0 is for listing all)
+            if max_depth and sub_path.count('/') >= max_depth:
+                continue
+
+            yield self._entry(remote_file, sub_path)
+
+    def refresh(self, full=False):
+        """
+        Update the manifest from the remote
+
+        :type full: bool
+        :param full: Force a full refresh (otherwise, only run a full refresh when full_refresh_interval is reached)
+
+        :rtype: int
+        :return: number of files added or updated
+        """
+
+        state = self._get_state()
+        if state is None:
+            state = RemoteManifest(repo=self.repo.local_path)
+            db.session.add(state)
+
+        started = datetime.utcnow()
+        state.refresh_started = started
+        db.session.commit()
+
+        if not state.last_full_refresh or state.last_full_refresh < started - timedelta(days=self.full_refresh_interval):
+            full = True
+
+        max_age = None
+        if not full:
+            max_age = (started - state.last_refresh).total_seconds() + self.refresh_margin
+
+        current_app.logger.info("Refreshing manifest for repo %s (full: %s, max_age: %s)" % (self.repo.local_path, full, max_age))
+
+        num = 0
+        batch = []
+        for entry in self.repo.backend.list_entries('', max_depth=0, max_age=max_age, hashes=self.repo.integrity):
+            if entry['IsDir']:
+                continue
+
+            batch.append(entry)
+            if len(batch) >= self.batch_size:
+                num += self._store(batch, started)
+                batch = []
+        num += self._store(batch, started)
+
+        if full:
+            # Files not seen during a full refresh were deleted from the remote
+            deleted = RemoteFile.query.filter(RemoteFile.repo == self.repo.local_path, RemoteFile.seen < started).delete(synchronize_session=False)
+            current_app.logger.info("Removed %s deleted files from manifest for repo %s" % (deleted, self.repo.local_path))
+            state.last_full_refresh = started
+
+        state.last_refresh = started
+        state.refresh_started = None
+        db.session.commit()
+
+        current_app.logger.info("Refreshed manifest for repo %s: %s files added or updated" % (self.repo.local_path, num))
+
+        return num
+
+    def is_refreshing(self, max_duration):
+        """
+        Check if a refresh is already running
+
+        :type max_duration: int
+        :param max_duration: Time (in seconds) after which a refresh is considered interrupted
+        """
+
+        state = self._get_state()
+
+        return state is not None and state.refresh_started is not None and state.refresh_started > datetime.utcnow() - timedelta(seconds=max_duration)
+
+    def _store(self, entries, seen):
+        if not entries:
+            return 0
+
+        known = RemoteFile.query.filter(RemoteFile.repo == self.repo.local_path, RemoteFile.path.in_([entry['Path'] for entry in entries]))
+        known = {remote_file.path: remote_file for remote_file in known}
+
+        for entry in entries:
+            remote_file = known.get(entry['Path'])
+            if remote_file is None:
+                remote_file = RemoteFile(repo=self.repo.local_path, path=entry['Path'])
+                db.session.add(remote_file)
+
+            remote_file.size = entry['Size']
+            remote_file.mtime = entry['ModTime']
+            remote_file.seen = seen
+            remote_hash = checksums.pick_hash(entry.get('Hashes'))
+            if remote_hash:
+                remote_file.hash = '%s:%s' % remote_hash
+
+        db.session.commit()
+
+        return len(entries)
+
+    def _entry(self, remote_file, path):
+        mime_type = mimetypes.guess_type(remote_file.path)[0] or 'application/octet-stream'
+
+        entry = {
+            'Path': path,
+            'Name': os.path.basename(remote_file.path),
+            'Size': remote_file.size,
+            'ModTime': remote_file.mtime,
+            'IsDir': False,
+            'MimeType': mime_type
+        }
+
+        if remote_file.hash:
+            hash_type, hash_value = remote_file.hash.split(':', 1)
+            entry['Hashes'] = {hash_type: hash_value}
+
+        return entry
+
+    def _get_state(self):
+        return RemoteManifest.query.filter_by(repo=self.repo.local_path).one_or_none()
@@ -0,0 +1,271 @@
+import concurrent.futures
+import itertools
+import os
+import threading
+import time
+
+from baricadr.model.backends import Backend, PullPlan, TransferError, with_app_context
+from baricadr.model.progress import PartProgress
+
+from flask import current_app
+
+
+class Mirror():
+    """
+    A backend of a multi-mirror repo, with what is known about its speed and health
+    """
+
+    def __init__(self, backend):
+        """
+        :type backend: Backend object
+        :param backend: the backend giving access to this mirror
+        """
+
+        self.backend = backend
+
+        # Time (in seconds) to list the root of the mirror, None if unknown
+        self.latency = None
+        # Estimated throughput (in bytes/s) of transfers from this mirror, None if unknown
+        self.throughput = None
+        self.healthy = True
+        self.probed = None
+
+    def needs_probe(self, ttl):
+        return self.probed is None or time.time() - self.probed > ttl
+
+    def __repr__(self):
+        return '<Mirror {} {} (latency: {}, throughput: {}, healthy: {})>'.format(self.backend.name, self.backend.url, self.latency, self.throughput, self.healthy)
+
+
+class MirrorBackend(Backend):
+    """
+    Several backends with the same content, used as a single one
+
+    Mirrors are probed regularly: listings use the fastest healthy mirror, and transfers are spread across the healthy mirrors.
+    Files which could not be transferred from a mirror are transferred from the others.
+    """
+
+    # Only spread transfers of at least this size across mirrors
+    split_min_size = 256 * 1024 * 1024
+
+    # Weight of the last transfer in the throughput estimate of a mirror
+    throughput_weight = 0.5
+
+    def __init__(self, backends, probe_ttl=300):
+        """
+        :type backends: list
+        :param backends: Backend objects of each mirror, the first one being the main backend of the repo
+
+        :type probe_ttl: int
+        :param probe_ttl: time (in seconds) during which probe results are used, before probing the mirrors again
+        """
+
+        self.name = 'mirrors'
+        self.url = backends[0].url
+        self.user = backends[0].user
+        self.password = backends[0].password
+        self.conf = backends[0].conf
+
+        self.mirrors = [Mirror(backend) for backend in backends]
+        self.probe_ttl = probe_ttl
+
+        self.lock = threading.Lock()
+
+    def settings_key(self):
+        return (self.__class__.__name__, tuple(mirror.backend.settings_key() for mirror in self.mirrors))
+
+    def probe(self):
+        """
+        Measure the latency of the mirrors which were not probed recently, to know which ones are healthy
+        """
+
+        to_probe = [mirror for mirror in self.mirrors if mirror.needs_probe(self.probe_ttl)]
+        if not to_probe:
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(to_probe)) as executor:
+            list(executor.map(with_app_context(self._probe), to_probe))
+
+    def _probe(self, mirror):
+        start = time.time()
+        try:
+            list(itertools.islice(mirror.backend.list_entries('', max_depth=1), 1))
+        except Exception as e:
+            # Whatever the reason, this mirror can't be used right now
+            current_app.logger.warning("Mirror %s is unhealthy: %s" % (mirror.backend.url, e))
+            healthy = False
+        else:
+            healthy = True
+
+        with self.lock:
+            mirror.healthy = healthy
+            mirror.latency = time.time() - start if healthy else None
+            mirror.probed = time.time()
+
+        current_app.logger.debug("Probed %s" % mirror)
+
+    def ranked_mirrors(self, size=0):
+        """
+        Get the healthy mirrors, fastest first
+
+        :type size: int
+        :param size: number of bytes to transfer, to balance latency and throughput
+
+        :rtype: list
+        :return: Mirror objects (all of them if none is healthy, to give them another chance)
+        """
+
+        self.probe()
+
+        mirrors = [mirror for mirror in self.mirrors if mirror.healthy]
+        if not mirrors:
+            current_app.logger.warning("No healthy mirror, trying all of them")
+            mirrors = list(self.mirrors)
+
+        throughputs = self._throughputs(mirrors)
+
+        return sorted(mirrors, key=lambda mirror: (mirror.latency or 0) + size / throughputs[mirror])
+
+    def mark_failed(self, mirror, error):
+        """
+        Stop using a mirror until it is probed again
+        """
+
+        current_app.logger.warning("Transfer from mirror %s failed, using other mirrors: %s" % (mirror.backend.url, error))
+        with self.lock:
+            mirror.healthy = False
+            mirror.probed = time.time()
+
+    def record_transfer(self, mirror, num_bytes, duration):
+        """
+        Update the throughput estimate of a mirror after a successful transfer
+        """
+
+        if num_bytes <= 0 or duration <= 0:
+            return
+
+        throughput = num_bytes / duration
+        with self.lock:
+            if mirror.throughput is None:
+                mirror.throughput = throughput
+            else:
+                mirror.throughput = self.throughput_weight * throughput + (1 - self.throughput_weight) * mirror.throughput
+
+    def list_entries(self, rel_path, max_depth=0, max_age=None, hashes=False, excludes=[]):
+        mirrors = self.ranked_mirrors()
+        for mirror in mirrors:
+            try:
+                entries = iter(mirror.backend.list_entries(rel_path, max_depth, max_age, hashes, excludes))
+                first_entries = list(itertools.islice(entries, 1))
+            except RuntimeError as e:
+                # Not necessarily a problem with the mirror (e.g. missing path): only try the next one
+                if mirror is mirrors[-1]:
+                    raise
+                current_app.logger.warning("Could not list %s from mirror %s, trying next mirror: %s" % (rel_path, mirror.backend.url, e))
+                continue
+
+            for entry in itertools.chain(first_entries, entries):
+                yield entry
+            return
+
+    def transfer(self, repo, plan, progress):
+        copied = []
+        files = plan.files
+        failed_mirrors = []
+        while True:
+            size = sum([max(remote_file['Size'], 0) for remote_file in files])
+            mirrors = [mirror for mirror in self.ranked_mirrors(size) if mirror not in failed_mirrors]
+            if not mirrors:
+                raise TransferError("Can't copy %s: failed to download %s files from all mirrors" % (plan.path, len(files)), copied, [remote_file['Path'] for remote_file in files])
+
+            parts = self.split(files, mirrors)
+            current_app.logger.info("Transferring %s files (%s bytes) from %s mirrors: %s" % (len(files), size, len(parts), ', '.join(['%s (%s files)' % (mirror.backend.url, len(part_files)) for mirror, part_files in parts])))
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(parts)) as executor:
+                transfer_part = with_app_context(self._transfer_part)
+                futures = {executor.submit(transfer_part, repo, plan, mirror, part_files, PartProgress(progress, len(parts))): mirror for mirror, part_files in parts}
+                pending = set(futures)
+                while pending:
+                    done, pending = concurrent.futures.wait(pending, timeout=progress.interval, return_when=concurrent.futures.FIRST_COMPLETED)
+                    progress.report()
+
+            failed = []
+            for future, mirror in futures.items():
+                part_copied, part_failed = future.result()
+                copied += part_copied
+                if part_failed:
+                    failed += part_failed
+                    failed_mirrors.append(mirror)
+
+            if not failed:
+                return copied
+
+            failed = set(failed)
+            files = [remote_file for remote_file in files if remote_file['Path'] in failed]
+
+    def split(self, files, mirrors):
+        """
+        Spread files across mirrors, so that they all finish at about the same time
+
+        Files are assigned from the biggest to the smallest, each to the mirror which would finish it first.
+
+        :type files: list
+        :param files: files to transfer (from PullPlan.files)
+
+        :type mirrors: list
+        :param mirrors: Mirror objects to use, fastest first
+
+        :rtype: list
+        :return: (Mirror, list of files) tuples, only for mirrors with files to transfer
+        """
+
+        total_size = sum([max(remote_file['Size'], 0) for remote_file in files])
+        if len(mirrors) == 1 or len(files) < 2 or total_size < self.split_min_size:
+            return [(mirrors[0], files)]
+
+        throughputs = self._throughputs(mirrors)
+        loads = {mirror: 0 for mirror in mirrors}
+        parts = {mirror: [] for mirror in mirrors}
+        for remote_file in sorted(files, key=lambda remote_file: remote_file['Size'], reverse=True):
+            size = max(remote_file['Size'], 0)
+            mirror = min(mirrors, key=lambda mirror: (mirror.latency or 0) + (loads[mirror] + size) / throughputs[mirror])
+            parts[mirror].append(remote_file)
+            loads[mirror] += size
+
+        return [(mirror, parts[mirror]) for mirror in mirrors if parts[mirror]]
+
+    def _transfer_part(self, repo, plan, mirror, files, progress):
+        """
+        Transfer some files of a plan from a mirror
+
+        :rtype: tuple
+        :return: (paths of the files written, paths of the files which could not be transferred)
+        """
+
+        part_plan = PullPlan(repo, plan.path, files)
+        start = time.time()
+        try:
+            copied = mirror.backend.transfer(repo, part_plan, progress)
+        except TransferError as e:
+            self.mark_failed(mirror, e)
+            return e.copied, e.failed or self._not_copied(repo, files)
+        except RuntimeError as e:
+            self.mark_failed(mirror, e)
+            return [], self._not_copied(repo, files)
+
+        self.record_transfer(mirror, part_plan.total_size(), time.time() - start)
+
+        return copied, []
+
+    def _throughputs(self, mirrors):
+        """
+        Get the throughput of each mirror, the slowest known throughput for the others (all the same if none is known)
+        """
+
+        known = [mirror.throughput for mirror in mirrors if mirror.throughput]
+        default = min(known) if known else 1
+
+        return {mirror: mirror.throughput or default for mirror in mirrors}
+
+    def _not_copied(self, repo, files):
+        return [remote_file['Path'] for remote_file in files if not os.path.exists(os.path.join(repo.local_path, remote_file['Path']))]
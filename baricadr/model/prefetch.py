@@ -0,0 +1,113 @@
+import fnmatch
+import os
+from datetime import datetime, timedelta
+
+from baricadr.db_models import BaricadrTask, CoAccess
+from baricadr.extensions import db
+
+from flask import current_app
+
+
+class Prefetcher():
+    """
+    Choose which files to prefetch after a single file was pulled: files from the same directory, matching some patterns, or often pulled just after it
+    """
+
+    def __init__(self, repo, patterns=[], learn=True, max_files=10):
+        """
+        :type repo: Repo object
+        :param repo: the repo to prefetch files in
+
+        :type patterns: list
+        :param patterns: glob patterns of the files to prefetch, in the directory of the pulled file. {name}, {stem} and {prefix} are replaced by the name of the pulled file, without its last extension, and up to its last '_'
+
+        :type learn: bool
+        :param learn: also prefetch the files pulled just after the pulled file in the past
+
+        :type max_files: int
+        :param max_files: maximum number of files to prefetch after each pull
+        """
+
+        self.repo = repo
+        self.patterns = patterns
+        self.learn = learn
+        self.max_files = max_files
+
+    def record(self, path, pulled):
+        """
+        Learn from a single file pull: the files of the same directory pulled recently are followed by this one
+
+        :type path: str
+        :param path: local path of the pulled file
+
+        :type pulled: datetime
+        :param pulled: time when the pull was asked
+        """
+
+        if not self.learn:
+            return
+
+        window = timedelta(seconds=current_app.config['PREFETCH_WINDOW'])
+        previous = BaricadrTask.query.filter(
+            BaricadrTask.type == 'pull',
+            BaricadrTask.path.startswith(os.path.join(os.path.dirname(path), '')),
+            BaricadrTask.path != path,
+            BaricadrTask.created >= pulled - window,
+            BaricadrTask.created < pulled
+        )
+        previous_paths = set(pt.path for pt in previous if os.path.dirname(pt.path) == os.path.dirname(path))
+        if not previous_paths:
+            return
+
+        known = CoAccess.query.filter(CoAccess.repo == self.repo.local_path, CoAccess.path.in_(previous_paths), CoAccess.next_path == path)
+        known = {co_access.path: co_access for co_access in known}
+        for previous_path in previous_paths:
+            co_access = known.get(previous_path)
+            if co_access is None:
+                co_access = CoAccess(repo=self.repo.local_path, path=previous_path, next_path=path, count=0)
+                db.session.add(co_access)
+            co_access.count += 1
+            co_access.last_seen = datetime.utcnow()
+        db.session.commit()
+
+    def candidates(self, path):
+        """
+        Find the files to prefetch after a pull
+
+        :type path: str
+        :param path: local path of the pulled file
+
+        :rtype: list
+        :return: local paths of the files to prefetch (missing locally), the most likely to be pulled first
+        """
+
+        dir_path = os.path.dirname(path)
+        name = os.path.basename(path)
+
+        learned = []
+        if self.learn:
+            co_accesses = CoAccess.query.filter(CoAccess.repo == self.repo.local_path, CoAccess.path == path, CoAccess.count >= current_app.config['PREFETCH_MIN_COUNT'])
+            learned = [co_access.next_path for co_access in co_accesses.order_by(CoAccess.count.desc()).limit(self.max_files)]
+
+        patterns = [self._expand(pattern, name) for pattern in self.patterns]
+
+        if not learned and not patterns:
+            return []
+
+        # Only prefetch files which exist on the remote (in a single listing of the directory)
+        missing = set()
+        for entry in self.repo.iter_remote_list(dir_path, missing=True, max_depth=1):
+            missing.add(os.path.join(dir_path, entry['Path']))
+
+        candidates = [learned_path for learned_path in learned if learned_path in missing]
+        for missing_path in sorted(missing):
+            if missing_path not in candidates and missing_path != path and any(fnmatch.fnmatch(os.path.basename(missing_path), pattern) for pattern in patterns):
+                candidates.append(missing_path)
+
+        return candidates[:self.max_files]
+
+    def _expand(self, pattern, name):
+        stem = os.path.splitext(name)[0]
+        prefix = stem.rsplit('_', 1)[0]
+
+        return pattern.replace('{name}', name).replace('{stem}', stem).replace('{prefix}', prefix)
@@ -0,0 +1,231 @@
+import threading
+import time
+
+from baricadr.model.bandwidth import PartThrottle
+
+
+class TransferProgress():
+    """
+    Progress of a pull, updated by backends while transferring and reported at a throttled rate
+
+    Backends transferring files themselves call add_bytes/add_files (from any thread), which also waits to stay within the bandwidth budget.
+    Backends running rclone call set_round_stats with the stats printed by rclone for the current transfer, and limit rclone to throttle.rclone_rate().
+    """
+
+    def __init__(self, plan, callback=None, interval=5, throttle=None):
+        """
+        :type plan: PullPlan
+        :param plan: the files to transfer
+
+        :type callback: function
+        :param callback: function(stats) called with the output of get_stats, at most every interval seconds
+
+        :type interval: int
+        :param interval: minimum time (in seconds) between two calls to callback
+
+        :type throttle: Throttle
+        :param throttle: bandwidth limit of the transfer, or None if not limited
+        """
+
+        self.callback = callback
+        self.interval = interval
+        self.throttle = throttle
+
+        self.total_files = len(plan.files)
+        self.total_bytes = plan.total_size()
+
+        self.files = 0
+        self.bytes = 0
+        self.speed = None
+
+        # Stats of the previous transfers (after a retry, rclone stats start from 0 again)
+        self.round_start_files = 0
+        self.round_start_bytes = 0
+
+        self.last_report = None
+        self.last_report_bytes = 0
+
+        self.lock = threading.Lock()
+
+    def add_bytes(self, num_bytes, wait=True):
+        """
+        Count bytes transferred
+
+        :type num_bytes: int
+        :param num_bytes: number of bytes transferred (negative to cancel bytes of a failed copy, transferred again)
+
+        :type wait: bool
+        :param wait: wait as long as needed to stay within the bandwidth budget (False if the transfer is already limited)
+        """
+
+        with self.lock:
+            self.bytes += num_bytes
+
+        if self.throttle:
+            if wait:
+                self.throttle.wait(num_bytes)
+            else:
+                self.throttle.count(num_bytes)
+
+    def add_files(self, num_files=1):
+        with self.lock:
+            self.files += num_files
+
+    def set_round_stats(self, num_bytes, num_files, speed=None):
+        """
+        Update the stats of the current transfer
+
+        :type num_bytes: int
+        :param num_bytes: bytes transferred since the start of the current transfer
+
+        :type num_files: int
+        :param num_files: files transferred since the start of the current transfer
+
+        :type speed: float
+        :param speed: current throughput (in bytes/s), if known
+        """
+
+        with self.lock:
+            new_bytes = self.round_start_bytes + num_bytes - self.bytes
+            self.bytes = self.round_start_bytes + num_bytes
+            self.files = self.round_start_files + num_files
+            self.speed = speed
+
+        if self.throttle and new_bytes > 0:
+            self.throttle.count(new_bytes)
+
+    def start_round(self):
+        """
+        Called before retrying a transfer
+        """
+
+        with self.lock:
+            self.round_start_bytes = self.bytes
+            self.round_start_files = self.files
+
+    def finish(self, num_files, num_bytes, duration):
+        """
+        Set the final stats of the pull
+
+        :type num_files: int
+        :param num_files: number of files transferred
+
+        :type num_bytes: int
+        :param num_bytes: number of bytes transferred
+
+        :type duration: float
+        :param duration: duration of the transfer (in seconds)
+        """
+
+        with self.lock:
+            self.files = num_files
+            self.bytes = num_bytes
+            self.total_files = max(self.total_files, num_files)
+            self.total_bytes = max(self.total_bytes, num_bytes)
+            self.speed = num_bytes / duration if duration > 0 else None
+
+    def get_stats(self):
+        """
+        :rtype: dict
+        :return: files, total_files, bytes, total_bytes, speed (in bytes/s) and eta (in seconds, None if unknown)
+        """
+
+        with self.lock:
+            speed = self.speed
+            if speed is None:
+                speed = self._measured_speed()
+
+            eta = None
+            if speed:
+                eta = int(max(self.total_bytes - self.bytes, 0) / speed)
+
+            return {
+                'files': self.files,
+                'total_files': self.total_files,
+                'bytes': self.bytes,
+                'total_bytes': self.total_bytes,
+                'speed': speed,
+                'eta': eta
+            }
+
+    def report(self, force=False):
+        """
+        Call the callback, if the last call was more than interval seconds ago
+
+        Must be called from the thread running the pull (the callback may write to the database).
+
+        :type force: bool
+        :param force: call the callback even if the interval is not reached
+        """
+
+        now = time.time()
+        if not force and self.last_report is not None and now - self.last_report < self.interval:
+            return
+
+        stats = self.get_stats()
+        self.last_report = now
+        self.last_report_bytes = stats['bytes']
+
+        if self.callback:
+            self.callback(stats)
+
+    def _measured_speed(self):
+        if self.last_report is None:
+            return None
+
+        elapsed = time.time() - self.last_report
+        if elapsed <= 0:
+            return None
+
+        return (self.bytes - self.last_report_bytes) / elapsed
+
+
+class PartProgress():
+    """
+    Progress of a part of a transfer running in another thread, added to the progress of the whole pull
+
+    Only the thread running the pull reports the progress: report() does nothing here.
+    """
+
+    def __init__(self, progress, parts=1):
+        """
+        :type progress: TransferProgress
+        :param progress: progress of the whole pull
+
+        :type parts: int
+        :param parts: number of parts transferred in parallel, sharing the bandwidth limit of the pull
+        """
+
+        self.progress = progress
+        self.interval = progress.interval
+        self.throttle = progress.throttle
+        if self.throttle and parts > 1:
+            self.throttle = PartThrottle(progress.throttle, parts)
+
+        self.bytes = 0
+        self.files = 0
+
+        self.lock = threading.Lock()
+
+    def add_bytes(self, num_bytes, wait=True):
+        with self.lock:
+            self.bytes += num_bytes
+        self.progress.add_bytes(num_bytes, wait)
+
+    def add_files(self, num_files=1):
+        with self.lock:
+            self.files += num_files
+        self.progress.add_files(num_files)
+
+    def set_round_stats(self, num_bytes, num_files, speed=None):
+        # Stats are since the start of this part: only add the difference
+        with self.lock:
+            new_bytes = num_bytes - self.bytes
+            new_files = num_files - self.files
+            self.bytes = num_bytes
+            self.files = num_files
+        self.progress.add_bytes(new_bytes, wait=False)
+        self.progress.add_files(new_files)
+
+    def report(self, force=False):
+        pass
@@ -1,16 +1,25 @@
 import datetime
-import fnmatch
+import itertools
 import os
+import re
 import tempfile
 import time
 
-from baricadr.db_models import BaricadrTask
-
-import dateutil.parser
+from baricadr.db_models import BaricadrTask, EvictionState
+from baricadr.extensions import db
+from baricadr.model import checksums
+from baricadr.model.excludes import ExcludeMatcher
+from baricadr.model.freeze import BATCH_SIZE, EvictionHeap, FreezeExecutor, FreezeReport, disk_usage, freezable_mask, parse_mod_times
+from baricadr.model.freeze_scan import FreezeScanner
+from baricadr.model.manifest import Manifest
+from baricadr.model.mirrors import MirrorBackend
+from baricadr.model.prefetch import Prefetcher
+from baricadr.model.tuning import auto_transfer_options
+from baricadr.model.walker import walk_files
 
 from flask import current_app
 
-from tzlocal import get_localzone
+import numpy
 
 import yaml
 
@@ -31,17 +40,19 @@ class Repo():
         self.exclude = None
         if 'exclude' in conf:
             self.exclude = conf['exclude']
+        # Applied to local walks and remote listings
+        self.excludes = ExcludeMatcher(self.exclude)
         self.conf = conf
 
         # Default behaviour should be non-freeze
         self.freezable = False
+        self.freeze_age = 180
         if 'freezable' in conf and conf['freezable'] is True:
             # Skip if not freezable
             if not perms['freezable']:
                 raise ValueError("Malformed repository definition for local path '%s', this path does not support atime" % local_path)
             # If freezable, set freeze_age
             self.freezable = True
-            self.freeze_age = 180
             if 'freeze_age' in conf:
                 try:
                     conf['freeze_age'] = int(conf['freeze_age'])
@@ -68,22 +79,212 @@ class Repo():
 
                 self.auto_freeze_interval = conf['auto_freeze_interval']
 
+            # Capacity mode: evict the least recently accessed files when the disk usage is above the high watermark, down to the low watermark
+            self.freeze_high_watermark = None
+            self.freeze_low_watermark = None
+            if 'freeze_low_watermark' in conf and 'freeze_high_watermark' not in conf:
+                raise ValueError("Malformed repository definition, freeze_low_watermark needs a freeze_high_watermark in '%s'" % conf)
+
+            if 'freeze_high_watermark' in conf:
+                for option in ['freeze_high_watermark', 'freeze_low_watermark']:
+                    if option not in conf:
+                        continue
+                    try:
+                        conf[option] = int(conf[option])
+                    except ValueError:
+                        raise ValueError("Malformed repository definition, %s must be an integer in percent in '%s'" % (option, conf))
+
+                    if conf[option] < 1 or conf[option] > 100:
+                        raise ValueError("Malformed repository definition, %s must be an integer in percent >0 and <=100 in '%s'" % (option, conf))
+
+                self.freeze_high_watermark = conf['freeze_high_watermark']
+                self.freeze_low_watermark = conf.get('freeze_low_watermark', max(self.freeze_high_watermark - 10, 1))
+                if self.freeze_low_watermark >= self.freeze_high_watermark:
+                    raise ValueError("Malformed repository definition, freeze_low_watermark must be lower than freeze_high_watermark in '%s'" % conf)
+
+        # Remove the directories left empty after freezing files
+        self.freeze_prune_empty = False
+        if 'freeze_prune_empty' in conf and conf['freeze_prune_empty'] is True:
+            self.freeze_prune_empty = True
+
+        # Transfer options, set by auto_transfer_options for each pull in 'auto' mode, unless explicitly set
+        self.transfer_tuning = None
+        if 'transfer_tuning' in conf:
+            if conf['transfer_tuning'] != 'auto':
+                raise ValueError("Malformed repository definition, transfer_tuning can only be 'auto' in '%s'" % conf)
+            self.transfer_tuning = conf['transfer_tuning']
+
+        self.transfer_options = {}
+        for option in ['transfers', 'checkers', 'multi_thread_streams']:
+            if option in conf:
+                try:
+                    conf[option] = int(conf[option])
+                except ValueError:
+                    raise ValueError("Malformed repository definition, %s must be an integer in '%s'" % (option, conf))
+
+                if conf[option] < 0 or conf[option] > 256:
+                    raise ValueError("Malformed repository definition, %s must be an integer >=0 and <=256 in '%s'" % (option, conf))
+
+                self.transfer_options[option] = conf[option]
+
+        if 'buffer_size' in conf:
+            conf['buffer_size'] = str(conf['buffer_size'])
+            if not re.match(r'^[0-9]+[bkMG]?$', conf['buffer_size']):
+                raise ValueError("Malformed repository definition, buffer_size must be a size like '16M' in '%s'" % conf)
+
+            self.transfer_options['buffer_size'] = conf['buffer_size']
+
+        # Compare hashes of local and remote files when pulling and freezing
+        self.integrity = False
+        if 'integrity' in conf and conf['integrity'] is True:
+            self.integrity = True
+
+        # Keep a persistent index of remote files in the database
+        self.manifest = None
+        if 'manifest' in conf and conf['manifest'] is True:
+            self.manifest_refresh_interval = 1
+            if 'manifest_refresh_interval' in conf:
+                try:
+                    conf['manifest_refresh_interval'] = int(conf['manifest_refresh_interval'])
+                except ValueError:
+                    raise ValueError("Malformed repository definition, manifest_refresh_interval must be an integer in hours in '%s'" % conf)
+
+                if conf['manifest_refresh_interval'] < 1 or conf['manifest_refresh_interval'] > 10000:
+                    raise ValueError("Malformed repository definition, manifest_refresh_interval must be an integer in hours >0 and <10000 in '%s'" % conf)
+
+                self.manifest_refresh_interval = conf['manifest_refresh_interval']
+
+            manifest_full_refresh_interval = 7
+            if 'manifest_full_refresh_interval' in conf:
+                try:
+                    conf['manifest_full_refresh_interval'] = int(conf['manifest_full_refresh_interval'])
+                except ValueError:
+                    raise ValueError("Malformed repository definition, manifest_full_refresh_interval must be an integer in days in '%s'" % conf)
+
+                if conf['manifest_full_refresh_interval'] < 1 or conf['manifest_full_refresh_interval'] > 10000:
+                    raise ValueError("Malformed repository definition, manifest_full_refresh_interval must be an integer in days >0 and <10000 in '%s'" % conf)
+
+                manifest_full_refresh_interval = conf['manifest_full_refresh_interval']
+
+            self.manifest = Manifest(self, manifest_full_refresh_interval)
+
+        # Prefetch the files likely to be pulled next, after single file pulls
+        self.prefetcher = None
+        if 'prefetch' in conf and conf['prefetch'] is True:
+            prefetch_patterns = []
+            if 'prefetch_patterns' in conf:
+                prefetch_patterns = [pattern.strip() for pattern in str(conf['prefetch_patterns']).split(',') if pattern.strip()]
+
+            prefetch_learn = True
+            if 'prefetch_learn' in conf and conf['prefetch_learn'] is False:
+                prefetch_learn = False
+
+            prefetch_max_files = 10
+            if 'prefetch_max_files' in conf:
+                try:
+                    conf['prefetch_max_files'] = int(conf['prefetch_max_files'])
+                except ValueError:
+                    raise ValueError("Malformed repository definition, prefetch_max_files must be an integer in '%s'" % conf)
+
+                if conf['prefetch_max_files'] < 1 or conf['prefetch_max_files'] > 1000:
+                    raise ValueError("Malformed repository definition, prefetch_max_files must be an integer >0 and <=1000 in '%s'" % conf)
+
+                prefetch_max_files = conf['prefetch_max_files']
+
+            self.prefetcher = Prefetcher(self, prefetch_patterns, prefetch_learn, prefetch_max_files)
+
         self.backend = current_app.backends.get_by_name(conf['backend'], conf)
 
+        # Other copies of the remote, used together with the main backend
+        if 'mirrors' in conf:
+            if not isinstance(conf['mirrors'], list) or not conf['mirrors']:
+                raise ValueError("Malformed repository definition, mirrors must be a list of backend definitions in '%s'" % conf)
+
+            backends = [self.backend]
+            for mirror_conf in conf['mirrors']:
+                if not isinstance(mirror_conf, dict) or 'backend' not in mirror_conf:
+                    raise ValueError("Malformed repository definition, missing backend in mirror '%s'" % mirror_conf)
+
+                backends.append(current_app.backends.get_by_name(mirror_conf['backend'], mirror_conf))
+
+            self.backend = MirrorBackend(backends, current_app.config['MIRROR_PROBE_TTL'])
+
     def is_in_repo(self, path):
         path = os.path.join(path, "")
 
         return path.startswith(os.path.join(self.local_path, ""))
 
-    def pull(self, path):
-        return self.backend.pull(self, path)
+    def pull(self, path, task_id=None, progress_callback=None, other_paths=None, priority=None):
+        return self.backend.pull(self, path, task_id, progress_callback, other_paths, priority)
 
     def remote_is_single(self, path):
         return self.backend.remote_is_single(self, path)
 
+    def get_transfer_options(self, plan):
+        """
+        Get the options to use for transferring the files of a pull plan
+
+        :type plan: PullPlan
+        :param plan: the files to transfer
+
+        :rtype: dict
+        :return: transfer options (transfers, checkers, multi_thread_streams, buffer_size), only those which are set
+        """
+
+        options = {}
+        if self.transfer_tuning == 'auto':
+            options = auto_transfer_options(plan, self.recent_throughput())
+            current_app.logger.info("Automatic transfer options for %s files (%s bytes): %s" % (len(plan.files), plan.total_size(), options))
+
+        # Explicit options have precedence
+        options.update(self.transfer_options)
+
+        return options
+
+    def recent_throughput(self, num_tasks=20):
+        """
+        Get the average throughput of the last pulls in this repo
+
+        :type num_tasks: int
+        :param num_tasks: Number of recent pull tasks to look at
+
+        :rtype: float
+        :return: average throughput in bytes/s, or None if unknown
+        """
+
+        tasks = BaricadrTask.query.filter(BaricadrTask.type == 'pull', self.tasks_filter(), BaricadrTask.transferred_bytes > 0, BaricadrTask.transfer_time > 0)
+        tasks = tasks.order_by(BaricadrTask.finished.desc()).limit(num_tasks).all()
+
+        if not tasks:
+            return None
+
+        return sum([task.transferred_bytes for task in tasks]) / sum([task.transfer_time for task in tasks])
+
+    def tasks_filter(self):
+        """
+        Get a filter on the BaricadrTask query, to select the tasks on paths of this repo
+        """
+
+        return db.or_(BaricadrTask.path == self.local_path, BaricadrTask.path.startswith(os.path.join(self.local_path, '')))
+
     def relative_path(self, path):
         return path[len(self.local_path) + 1:]
 
+    def is_excluded(self, path, is_dir=False):
+        """
+        Check if a local path is excluded (for directories: if all the files inside it are excluded)
+
+        Can be used as the skip function of walk_files.
+        """
+
+        if not self.excludes:
+            return False
+
+        if is_dir:
+            return self.excludes.prunes(self.relative_path(path))
+
+        return self.excludes.matches(self.relative_path(path))
+
     def remote_list(self, path, missing=False, max_depth=1, from_root=False, full=False):
         """
         List files from remote repository
@@ -106,7 +307,65 @@ class Repo():
 
         return self.backend.remote_list(self, path, missing, max_depth, from_root, full)
 
-    def freeze(self, path, force=False, dry_run=False):
+    def cached_remote_list(self, path, missing=False, max_depth=1, from_root=False, full=False):
+        """
+        Same as remote_list, using the listing cache if it is enabled
+
+        A stale cached listing is returned as is, and refreshed in background.
+
+        :rtype: list
+        :return: list of files
+        """
+
+        cache = current_app.listing_cache
+        if not cache:
+            return self.remote_list(path, missing, max_depth, from_root, full)
+
+        cached = cache.get(self, path, missing, max_depth, from_root, full)
+        if cached:
+            files, stale = cached
+            if stale and cache.lock_refresh(self, path, missing, max_depth, from_root, full):
+                current_app.logger.debug("Refreshing stale cached listing for path %s" % path)
+                current_app.celery.send_task('refresh_listing', (path, missing, max_depth, from_root, full))
+            return files
+
+        files = self.remote_list(path, missing, max_depth, from_root, full)
+        cache.set(self, path, files, missing, max_depth, from_root, full)
+
+        return files
+
+    def iter_remote_list(self, path, missing=False, max_depth=1, from_root=False, full=False, hashes=False):
+        """
+        Same as remote_list, but iterating over the remote files while they are listed
+
+        Uses the manifest when available: pulls and freezes list the remote with Backend.iter_remote_list instead, to never miss recent files.
+
+        :type hashes: bool
+        :param hashes: Add remote hashes to files (in a 'Hashes' key, only with full=True), when the remote supports it
+
+        :rtype: generator
+        :return: generator of files
+        """
+
+        if not (self.manifest and self.manifest.is_ready()):
+            return self.backend.iter_remote_list(self, path, missing, max_depth, from_root, full, hashes)
+
+        try:
+            max_depth = int(max_depth)
+        except ValueError:
+            max_depth = 1
+
+        entries = self.manifest.list_entries(self.relative_path(path), max_depth)
+
+        # Files added recently may not be in the manifest yet
+        first_entry = list(itertools.islice(entries, 1))
+        if not first_entry:
+            current_app.logger.info("Path %s not found in manifest, listing remote" % path)
+            return self.backend.iter_remote_list(self, path, missing, max_depth, from_root, full, hashes)
+
+        return self.backend.process_listing(self, path, itertools.chain(first_entry, entries), missing, max_depth, from_root, full)
+
+    def freeze(self, path, force=False, dry_run=False, report_path=None, incremental=False):
         """
         Remove files from local repository
 
@@ -119,31 +378,172 @@ class Repo():
         :type dry_run: bool
         :param dry_run: Do not remove anything, just print what would be done in normal mode.
 
-        :rtype: list
-        :return: list of freezed files
-        """
+        :type report_path: str
+        :param report_path: Write the freezed files (or the files which would be freezed in dry-run mode) in this gzipped JSON lines file
+
+        :type incremental: bool
+        :param incremental: Skip the directories which could not contain freezable files at the end of the previous incremental freeze (see FreezeScanner). Ignored with force or dry_run.
 
-        # TODO [LOW] keep track of md5 if needed for checking
-        # TODO [LOW] check rclone check -> does it work without hash support with sftp in rclone?
+        :rtype: dict
+        :return: number of freezed files (or which would be freezed in dry-run mode), bytes, errors and removed directories (the files are listed in the report)
+        """
 
         current_app.logger.info("Asked to freeze '%s'" % path)
         if not (force or self.freezable):
-            return []
+            return {'files': 0, 'bytes': 0, 'errors': 0, 'dirs': 0}
 
-        remote_list = self.remote_list(path, max_depth=0, from_root=True, full=True)
+        remote_index = self._get_remote_index(path)
 
-        freezables = self._get_freezable(path, remote_list, force)
+        report = None
+        if report_path:
+            report = FreezeReport(report_path)
 
-        current_app.logger.info("Freezable files: %s" % freezables)
+        scanner = None
+        if incremental and not (force or dry_run) and os.path.isdir(path):
+            scanner = FreezeScanner(self, path, current_app.config['WALK_WORKERS'])
+            batches = scanner.iter_batches()
+        else:
+            batches = ((candidates, None) for candidates in self._iter_candidates(path))
 
-        for to_freeze in freezables:
-            if dry_run:
-                current_app.logger.info("Would freeze '%s' (dry-run mode)" % (to_freeze))
-            else:
-                current_app.logger.info("Freezing '%s'" % (to_freeze))
-                self._do_freeze(to_freeze)
+        executor = FreezeExecutor(self.local_path, current_app.config['FREEZE_WORKERS'], dry_run, self.freeze_prune_empty, report)
+        try:
+            for candidates, scanned_dirs in batches:
+                freezables = self._filter_freezable(candidates, remote_index, force)
+                if self.integrity and freezables:
+                    verified = set(self._verify_freezables([file_path for file_path, size in freezables], remote_index))
+                    freezables = [(file_path, size) for file_path, size in freezables if file_path in verified]
+
+                batch_freezed = executor.freeze(freezables)
+                if scanner:
+                    scanner.record(scanned_dirs, batch_freezed)
+
+            stats = executor.finish()
+            if scanner:
+                scanner.finish()
+        finally:
+            if report:
+                report.close()
+
+        current_app.logger.info("%s %s files (%s bytes) in '%s': %s errors, %s empty directories removed" % ("Would freeze" if dry_run else "Freezed", stats['files'], stats['bytes'], path, stats['errors'], stats['dirs']))
+
+        return stats
+
+    def evict(self, report_path=None):
+        """
+        Remove the least recently accessed files when the disk usage is above the high watermark, until it is down to the low watermark
+
+        Files are freezed even if accessed less than freeze_age days ago, but only if they were not modified since pulled (like with force).
+        Old and big files are removed first (see EvictionHeap).
+
+        :type report_path: str
+        :param report_path: Write the freezed files in this gzipped JSON lines file
+
+        :rtype: dict
+        :return: number of freezed files, bytes, errors and removed directories (the files are listed in the report)
+        """
+
+        if not self.freezable or self.freeze_high_watermark is None:
+            return {'files': 0, 'bytes': 0, 'errors': 0, 'dirs': 0}
+
+        used, size = disk_usage(self.local_path)
+        if used * 100 < size * self.freeze_high_watermark:
+            current_app.logger.info("Disk usage of '%s' is below the high watermark (%s/%s bytes, %s%%), nothing to evict" % (self.local_path, used, size, self.freeze_high_watermark))
+            self.clear_eviction_delay()
+            return {'files': 0, 'bytes': 0, 'errors': 0, 'dirs': 0}
+
+        if self.eviction_delayed():
+            current_app.logger.info("Disk usage of '%s' is above the high watermark (%s/%s bytes, %s%%), but the last eviction could not reach the low watermark: waiting before trying again" % (self.local_path, used, size, self.freeze_high_watermark))
+            return {'files': 0, 'bytes': 0, 'errors': 0, 'dirs': 0}
+
+        bytes_to_free = used - size * self.freeze_low_watermark // 100
+        current_app.logger.info("Disk usage of '%s' is above the high watermark (%s/%s bytes, %s%%), evicting %s bytes" % (self.local_path, used, size, self.freeze_high_watermark, bytes_to_free))
 
-        return freezables
+        remote_index = self._get_remote_index(self.local_path)
+
+        heap = EvictionHeap(bytes_to_free)
+        for candidates in self._iter_candidates(self.local_path):
+            atimes = {file_path: file_stat.st_atime for file_path, file_stat in candidates}
+            for file_path, file_size in self._filter_freezable(candidates, remote_index, True):
+                heap.push(file_path, file_size, atimes[file_path])
+
+        evictables = heap.files()
+        if self.integrity and evictables:
+            verified = set(self._verify_freezables([file_path for file_path, file_size in evictables], remote_index))
+            evictables = [(file_path, file_size) for file_path, file_size in evictables if file_path in verified]
+
+        if heap.size < bytes_to_free:
+            self._delay_evictions(heap.size)
+        else:
+            self.clear_eviction_delay()
+
+        report = None
+        if report_path:
+            report = FreezeReport(report_path)
+
+        executor = FreezeExecutor(self.local_path, current_app.config['FREEZE_WORKERS'], False, self.freeze_prune_empty, report)
+        try:
+            executor.freeze(evictables)
+            stats = executor.finish()
+        finally:
+            if report:
+                report.close()
+
+        current_app.logger.info("Evicted %s files (%s bytes) in '%s': %s errors, %s empty directories removed" % (stats['files'], stats['bytes'], self.local_path, stats['errors'], stats['dirs']))
+
+        return stats
+
+    def eviction_delayed(self):
+        """
+        Check if evictions should wait, after evictions which could not reach the low watermark
+
+        :rtype: bool
+        :return: True if no eviction should be run for now
+        """
+
+        state = EvictionState.query.filter_by(repo=self.local_path).one_or_none()
+
+        return state is not None and state.next_try > datetime.datetime.utcnow()
+
+    def clear_eviction_delay(self):
+        """
+        Allow evictions again right away (the disk usage went down, or the last eviction reached the low watermark)
+        """
+
+        if EvictionState.query.filter_by(repo=self.local_path).delete():
+            db.session.commit()
+
+    def _delay_evictions(self, freeable):
+        """
+        Wait before the next eviction, with an exponential backoff: the disk is probably filled with data outside of the repo, evicting again would walk the repo for nothing
+        """
+
+        state = EvictionState.query.filter_by(repo=self.local_path).one_or_none()
+        if state is None:
+            state = EvictionState(repo=self.local_path, failures=0)
+            db.session.add(state)
+
+        state.failures += 1
+        delay = min(current_app.config['WATERMARK_CHECK_INTERVAL'] * 2 ** state.failures, current_app.config['WATERMARK_BACKOFF_MAX'])
+        state.next_try = datetime.datetime.utcnow() + datetime.timedelta(seconds=delay)
+        db.session.commit()
+
+        # Only logged once, until an eviction reaches the low watermark
+        if state.failures == 1:
+            current_app.logger.warning("Not enough files can be evicted in '%s' to reach the low watermark (%s%%): %s bytes can be freed. Next evictions will wait %s seconds (doubled each time, up to %s seconds)" % (self.local_path, self.freeze_low_watermark, freeable, delay, current_app.config['WATERMARK_BACKOFF_MAX']))
+        else:
+            current_app.logger.info("Not enough files can be evicted in '%s' to reach the low watermark (%s%%): %s bytes can be freed, waiting %s seconds before the next eviction" % (self.local_path, self.freeze_low_watermark, freeable, delay))
+
+    def _get_remote_index(self, path):
+        # Only keep what is needed to check if files can be freezed, indexed by relative path
+        # Always list the remote: the manifest only forgets deleted remote files on full refreshes, and freezing a file deleted on the remote would lose it
+        remote_index = {}
+        for entry in self.backend.iter_remote_list(self, path, False, 0, True, True, self.integrity):
+            remote_file = {'ModTime': entry['ModTime']}
+            if self.integrity:
+                remote_file['Hashes'] = entry.get('Hashes')
+            remote_index[entry['Path']] = remote_file
+
+        return remote_index
 
     # Might actually use this to run safety checks (can_write? others?)
     def _check_perms(self):
@@ -170,94 +570,104 @@ class Repo():
 
         return perms
 
-    def _get_freezable(self, path, remote_list, force=False):
-        freezables = []
-
-        excludes = []
-        if self.exclude:
-            excludes = self.exclude.split(',')
+    def _get_freezable(self, path, remote_index, force=False):
+        return [file_path for candidates in self._iter_candidates(path) for file_path, size in self._filter_freezable(candidates, remote_index, force)]
 
-        if os.path.exists(path) and os.path.isfile(path):
-            for ex in excludes:
-                if fnmatch.fnmatch(path, ex.strip()):
-                    current_app.logger.info("Found excluded path: %s with expression %s" % (path, ex.strip()))
-                    return
-            if self._can_freeze(path, remote_list, force):
-                freezables.append(path)
-        else:
-            for root, subdirs, files in os.walk(path):
-                for name in files:
-                    candidate = os.path.join(root, name)
-                    current_app.logger.info("Evaluating freezable for path: %s " % (candidate))
-                    excluded = False
-                    for ex in excludes:
-                        if fnmatch.fnmatch(candidate, ex.strip()):
-                            current_app.logger.info("Found excluded path: %s with expression %s" % (candidate, ex.strip()))
-                            excluded = True
-                            break
-                    if not excluded and self._can_freeze(candidate, remote_list, force):
-                        freezables.append(candidate)
+    def _iter_candidates(self, path):
+        """
+        Walk the local files to check for freezing, by batches of BATCH_SIZE files
 
-        return freezables
+        :rtype: generator
+        :return: generator of lists of (path, os.stat_result) tuples
+        """
 
-    def _can_freeze(self, file_to_check, remote_list, force):
+        if os.path.exists(path) and os.path.isfile(path):
+            if self.is_excluded(path):
+                current_app.logger.info("Found excluded path: %s" % path)
+                return
+            yield [(path, os.stat(path))]
+            return
+
+        candidates = []
+        for candidate in walk_files(path, workers=current_app.config['WALK_WORKERS'], skip=self.is_excluded):
+            candidates.append(candidate)
+            if len(candidates) >= BATCH_SIZE:
+                yield candidates
+                candidates = []
+
+        if candidates:
+            yield candidates
+
+    def _filter_freezable(self, candidates, remote_index, force):
         """
-        Check if a file should be freezed or not
+        Check which files should be freezed, all at once
 
-        :type file_to_check: str
-        :param file_to_check: Path of a file to check
+        :type candidates: list
+        :param candidates: (path, os.stat_result) tuples of the files to check
 
-        :type remote_list: list
-        :param remote_list: List of dicts containing informations about remote files (path, mtime)
+        :type remote_index: dict
+        :param remote_index: Dicts containing informations about remote files (mtime), by relative path
 
         :type force: bool
         :param force: Whether to ignore atime
 
-        :rtype: bool
-        :return: True if the file should be freezed
+        :rtype: list
+        :return: (path, size) tuples of the files which should be freezed
         """
 
-        relative_path = self.relative_path(file_to_check)
-        # Check if in remote list
-        remote_file = next((item for item in remote_list if item["Path"] == relative_path), None)
-
-        if not remote_file:
-            return False
-
-        # Check if modified since pulled
-        tz = get_localzone()
+        # Only files which are in the remote list
+        paths = []
+        mod_times = []
+        stats = []
+        for candidate, file_stat in candidates:
+            remote_file = remote_index.get(self.relative_path(candidate))
+            if not remote_file:
+                continue
+            paths.append(candidate)
+            mod_times.append(remote_file['ModTime'])
+            stats.append((file_stat.st_mtime, file_stat.st_atime, file_stat.st_size))
+
+        if not paths:
+            current_app.logger.info("Checked %s files for freezing: none is in the remote list" % len(candidates))
+            return []
 
-        last_modif_remote = dateutil.parser.isoparse(remote_file['ModTime'])
-        last_modif_local = datetime.datetime.fromtimestamp(os.stat(file_to_check).st_mtime, tz=tz)
+        local_mtimes, local_atimes, sizes = numpy.array(stats, dtype=numpy.float64).T
+        mask = freezable_mask(local_mtimes, local_atimes, parse_mod_times(mod_times), self.freeze_age, force)
 
-        current_app.logger.info("Checking if we should freeze '%s': local modification on '%s' , remote modification on '%s' => Delta is %s seconds" % (file_to_check, last_modif_local, last_modif_remote, (last_modif_local - last_modif_remote).total_seconds()))
+        current_app.logger.info("Checked %s files for freezing (freeze_age=%s, force=%s): %s in the remote list, %s freezable (%s bytes)" % (len(candidates), self.freeze_age, force, len(paths), int(mask.sum()), int(sizes[mask].sum())))
 
-        # Assuming 10s delay? Maybe more? -> Might need to be fine-tuned. Tests shows 0.22s
-        if (last_modif_local - last_modif_remote).total_seconds() > 10:
-            return False
+        return [(file_path, int(size)) for file_path, size, freezable in zip(paths, sizes, mask) if freezable]
 
-        # Skip check if force
-        if force:
-            current_app.logger.info("Checking if we should freeze '%s' => force is set to True, freezing" % (file_to_check))
-            return True
+    def _verify_freezables(self, freezables, remote_index):
+        """
+        Only keep files identical to the remote files (comparing hashes)
 
-        last_access = datetime.datetime.fromtimestamp(os.stat(file_to_check).st_atime).date()
-        now = datetime.date.today()
-        delta = now - last_access
-        delta = delta.days
-        current_app.logger.info("Checking if we should freeze '%s' (freeze_age=%s): last accessed on %s (%s days ago) =>  %s" % (file_to_check, self.freeze_age, last_access, delta, (force or (delta > self.freeze_age))))
+        :type freezables: list
+        :param freezables: local paths of files which could be freezed
 
-        return delta > self.freeze_age
+        :type remote_index: dict
+        :param remote_index: Dicts containing informations about remote files (mtime, hashes), by relative path
 
-    def _do_freeze(self, file_to_freeze):
+        :rtype: list
+        :return: local paths of files which can be freezed safely
         """
-        Removes a cold file from local repository
 
-        :type path: str
-        :param path: Path of a file to freeze
-        """
+        to_verify = {}
+        for local_path in freezables:
+            remote_file = remote_index.get(self.relative_path(local_path))
+            to_verify[local_path] = remote_file['Hashes'] if remote_file else None
+        results = checksums.verify_files(to_verify, current_app.config['CHECKSUM_WORKERS'])
+
+        verified = []
+        for local_path in freezables:
+            if results[local_path] is None:
+                current_app.logger.warning("Not freezing '%s': no usable remote hash to compare with" % local_path)
+            elif not results[local_path]:
+                current_app.logger.warning("Not freezing '%s': local file differs from the remote file" % local_path)
+            else:
+                verified.append(local_path)
 
-        os.unlink(file_to_freeze)
+        return verified
 
 
 class Repos():
@@ -355,3 +765,44 @@ class Repos():
                 locking.append(rt.task_id)
 
         return locking
+
+    def claim_coalesced_pulls(self, task_id, repo):
+        """
+        Claim the pull tasks of a repo which did not start yet, to run them in the same transfer as task_id.
+        Claimed tasks are marked as 'pulling', and their own celery task will exit without doing anything.
+
+        Tasks on a path where a subdirectory is being pulled/freezed by another task, or will be (in their wait_for), are not claimed, they need to wait for it.
+
+        :type task_id: str
+        :param task_id: id of the pull task claiming the others
+
+        :type repo: Repo object
+        :param repo: the repo being pulled
+
+        :rtype: list
+        :return: the claimed BaricadrTask objects
+        """
+
+        pending = BaricadrTask.query.filter(BaricadrTask.type == 'pull', BaricadrTask.status == 'new', BaricadrTask.task_id != task_id, repo.tasks_filter()).all()
+        if not pending:
+            return []
+
+        # Including tasks which did not start yet: tasks on a subdirectory created before a pull are in its wait_for (and cannot be created after it)
+        running = BaricadrTask.query.filter(BaricadrTask.finished.is_(None), BaricadrTask.task_id != task_id).all()
+        to_claim = []
+        for pt in pending:
+            if not any(rt.path.startswith(os.path.join(pt.path, '')) for rt in running):
+                to_claim.append(pt.id)
+
+        if not to_claim:
+            return []
+
+        # Only claim tasks which did not start in the meantime
+        BaricadrTask.query.filter(BaricadrTask.id.in_(to_claim), BaricadrTask.status == 'new').update({
+            'status': 'pulling',
+            'started': datetime.datetime.utcnow(),
+            'coalesced_into': task_id
+        }, synchronize_session=False)
+        db.session.commit()
+
+        return BaricadrTask.query.filter(BaricadrTask.coalesced_into == task_id, BaricadrTask.finished.is_(None)).all()
@@ -0,0 +1,316 @@
+import concurrent.futures
+import heapq
+import itertools
+import os
+from collections import OrderedDict
+
+from baricadr.db_models import BaricadrTask, RemoteFile
+from baricadr.extensions import db
+
+import numpy
+
+
+DAY = 86400
+
+# Policies which can be simulated: 'age' is the freeze_age behaviour (with auto_freeze), the others evict files when the disk is full
+POLICIES = ['age', 'lru', 'lfu', 'gdsf']
+
+
+class EventLog():
+    """
+    Accesses to replay in the simulator, as arrays: an access is a pull asked to baricadr
+
+    A path is pulled from the remote on the first access, and on each access after it was freezed (a miss). Other accesses are hits.
+    """
+
+    def __init__(self, times, paths, sizes):
+        """
+        :type times: list
+        :param times: timestamps of the accesses (sorted)
+
+        :type paths: list
+        :param paths: path accessed by each access
+
+        :type sizes: dict
+        :param sizes: size (in bytes) of each path
+        """
+
+        self.times = numpy.asarray(times, dtype=numpy.float64)
+        self.paths, self.objects = numpy.unique(numpy.asarray(paths, dtype=str), return_inverse=True)
+        self.object_sizes = numpy.array([sizes[path] for path in self.paths], dtype=numpy.int64)
+        self.sizes = self.object_sizes[self.objects]
+
+        # Time of the previous access to the same path (nan for the first one)
+        order = numpy.lexsort((numpy.arange(len(self.objects)), self.objects))
+        same = numpy.zeros(len(order), dtype=bool)
+        same[1:] = self.objects[order][1:] == self.objects[order][:-1]
+        self.prev_times = numpy.full(len(self.times), numpy.nan)
+        self.prev_times[order[1:][same[1:]]] = self.times[order[:-1][same[1:]]]
+        self.first = numpy.isnan(self.prev_times)
+
+        # Last access to each path
+        self.last_times = numpy.full(len(self.paths), numpy.nan)
+        self.last_times[self.objects] = self.times
+
+        # Plain lists are faster to iterate over in the replay loops
+        self._lists = None
+
+    def __len__(self):
+        return len(self.times)
+
+    def lists(self):
+        if self._lists is None:
+            self._lists = (self.objects.tolist(), self.sizes.tolist())
+        return self._lists
+
+
+def load_events(repo_path=None, since=None):
+    """
+    Load the accesses from the pull tasks in the database
+
+    Only finished pulls are used (prefetched files were not asked by users). The size of a path is the most bytes transferred when pulling it,
+    or its size in the repo manifest. Paths of unknown size (never transferred, e.g. pulled before the task history was kept) are ignored.
+    Tasks are deleted after CLEANUP_AGE seconds: the history is not longer than that.
+
+    :type repo_path: str
+    :param repo_path: Only replay the accesses to this repo
+
+    :type since: datetime.datetime
+    :param since: Only replay the accesses after this date
+
+    :rtype: tuple
+    :return: the EventLog, and the number of ignored accesses
+    """
+
+    query = BaricadrTask.query.filter(BaricadrTask.type == 'pull', BaricadrTask.status == 'finished')
+    if repo_path:
+        query = query.filter(BaricadrTask.path.startswith(os.path.join(repo_path, ''), autoescape=True))
+
+    # Sizes from the whole history
+    sizes = {}
+    for path, transferred in query.with_entities(BaricadrTask.path, db.func.max(BaricadrTask.transferred_bytes)).group_by(BaricadrTask.path):
+        if transferred:
+            sizes[path] = transferred
+
+    if since:
+        query = query.filter(BaricadrTask.created >= since)
+    accesses = [(created.timestamp(), path) for path, created in query.order_by(BaricadrTask.created).with_entities(BaricadrTask.path, BaricadrTask.created)]
+
+    missing = set(path for created, path in accesses if path not in sizes)
+    if missing and repo_path:
+        prefix = os.path.join(repo_path, '')
+        for remote_file in RemoteFile.query.filter(RemoteFile.repo == repo_path).with_entities(RemoteFile.path, RemoteFile.size):
+            path = prefix + remote_file.path
+            if path in missing and remote_file.size:
+                sizes[path] = remote_file.size
+
+    known = [(created, path) for created, path in accesses if path in sizes]
+
+    return EventLog([created for created, path in known], [path for created, path in known], sizes), len(accesses) - len(known)
+
+
+def simulate(events, policy, capacity=None, freeze_age=180, freeze_interval=7):
+    """
+    Replay accesses against a policy
+
+    :type events: EventLog
+    :param events: the accesses to replay
+
+    :type policy: str
+    :param policy: 'age' (files not accessed for freeze_age days are freezed every freeze_interval days), 'lru' (least recently used), 'lfu' (least frequently used) or 'gdsf' (greedy dual size frequency, favours small and frequently used files)
+
+    :type capacity: int
+    :param capacity: disk capacity (in bytes) available for the repo: required for all policies but 'age' (which does not depend on it, see the peak usage)
+
+    :type freeze_age: int
+    :param freeze_age: for 'age', number of days after the last access before a file is freezed
+
+    :type freeze_interval: int
+    :param freeze_interval: for 'age', number of days between two freezes (auto_freeze_interval)
+
+    :rtype: dict
+    :return: the policy parameters, number of accesses and hits, hit ratio, bytes pulled again after being freezed, and peak disk usage
+    """
+
+    if policy == 'age':
+        hits, repulled, peak = _simulate_age(events, freeze_age * DAY, freeze_interval * DAY)
+    elif policy in POLICIES:
+        if not capacity:
+            raise ValueError("A capacity is needed to simulate the '%s' policy" % policy)
+        hits, repulled, peak = _simulate_capacity(events, policy, capacity)
+    else:
+        raise ValueError("Unknown policy '%s', must be one of %s" % (policy, ', '.join(POLICIES)))
+
+    result = {
+        'policy': policy,
+        'capacity': capacity if policy != 'age' else None,
+        'freeze_age': freeze_age if policy == 'age' else None,
+        'accesses': len(events),
+        'hits': hits,
+        'hit_ratio': hits / len(events) if len(events) else 0.0,
+        'bytes_pulled': int(events.sizes[events.first].sum()),
+        'bytes_repulled': repulled,
+        'peak_usage': peak
+    }
+
+    return result
+
+
+def sweep(events, configs, workers=1):
+    """
+    Simulate several policies and parameters, in parallel processes
+
+    :type events: EventLog
+    :param events: the accesses to replay
+
+    :type configs: list
+    :param configs: dicts of arguments for simulate (policy, capacity, freeze_age, freeze_interval)
+
+    :type workers: int
+    :param workers: Number of simulations run in parallel
+
+    :rtype: list
+    :return: the results of simulate, in the same order as configs
+    """
+
+    if workers <= 1 or len(configs) <= 1:
+        return [simulate(events, **config) for config in configs]
+
+    # A chunk of configs per process, so that the events are only sent once to each of them
+    workers = min(workers, len(configs))
+    chunks = [configs[index::workers] for index in range(workers)]
+
+    results = [None] * len(configs)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for index, chunk_results in enumerate(executor.map(_simulate_chunk, [events] * workers, chunks)):
+            results[index::workers] = chunk_results
+
+    return results
+
+
+def sweep_configs(policies, capacities=[], freeze_ages=[], freeze_interval=7):
+    """
+    Build all the combinations of parameters to simulate
+
+    :rtype: list
+    :return: dicts of arguments for simulate
+    """
+
+    configs = []
+    for policy in policies:
+        if policy == 'age':
+            for freeze_age in freeze_ages:
+                configs.append({'policy': policy, 'freeze_age': freeze_age, 'freeze_interval': freeze_interval})
+        else:
+            for capacity in capacities:
+                configs.append({'policy': policy, 'capacity': capacity})
+
+    return configs
+
+
+def _simulate_chunk(events, configs):
+    return [simulate(events, **config) for config in configs]
+
+
+def _simulate_age(events, age, interval):
+    # Freezes run every interval from the first access, and remove the files last accessed more than age before
+    start = events.times[0] if len(events) else 0
+
+    def freezed_at(last_access):
+        return start + (numpy.floor((last_access + age - start) / interval) + 1) * interval
+
+    # A path is still there if it was not freezed since its previous access
+    hit = ~events.first & (events.times < freezed_at(numpy.nan_to_num(events.prev_times)))
+    miss = ~hit
+    repulled = int(events.sizes[miss & ~events.first].sum())
+
+    # Disk usage: each miss adds a file, removed when freezed after its previous access (or after its last one)
+    evicted = miss & ~events.first
+    last_freezed = freezed_at(events.last_times)
+    last_gone = last_freezed <= events.times[-1] if len(events) else numpy.zeros(0, dtype=bool)
+    change_times = numpy.concatenate([events.times[miss], freezed_at(events.prev_times[evicted]), last_freezed[last_gone]])
+    changes = numpy.concatenate([events.sizes[miss], -events.sizes[evicted], -events.object_sizes[last_gone]])
+
+    # Removals first when at the same time
+    order = numpy.lexsort((changes, change_times))
+    usage = numpy.cumsum(changes[order])
+    peak = int(usage.max()) if len(usage) else 0
+
+    return int(hit.sum()), repulled, peak
+
+
+def _simulate_capacity(events, policy, capacity):
+    objects, sizes = events.lists()
+    seen = set()
+    hits = 0
+    repulled = 0
+    used = 0
+    peak = 0
+
+    if policy == 'lru':
+        cache = OrderedDict()
+        for obj, size in zip(objects, sizes):
+            if obj in cache:
+                hits += 1
+                cache.move_to_end(obj)
+                continue
+
+            if obj in seen:
+                repulled += size
+            seen.add(obj)
+
+            if size > capacity:
+                # Never fits: pulled and removed right away
+                continue
+            while used + size > capacity:
+                evicted, evicted_size = cache.popitem(last=False)
+                used -= evicted_size
+            cache[obj] = size
+            used += size
+            peak = max(peak, used)
+
+        return hits, repulled, peak
+
+    # Priority queue, with outdated entries skipped when popped
+    cache = {}
+    heap = []
+    counter = itertools.count()
+    inflation = 0.0
+    for index, (obj, size) in enumerate(zip(objects, sizes)):
+        cached = cache.get(obj)
+        if cached is not None:
+            hits += 1
+            freq = cached[1] + 1
+        else:
+            if obj in seen:
+                repulled += size
+            seen.add(obj)
+
+            if size > capacity:
+                continue
+            while used + size > capacity:
+                priority, count, evicted = heapq.heappop(heap)
+                if cache[evicted][0] != (priority, count):
+                    continue
+                used -= cache.pop(evicted)[2]
+                if policy == 'gdsf':
+                    inflation = priority
+            freq = 1
+            used += size
+            peak = max(peak, used)
+
+        if policy == 'lfu':
+            # Least recently used first, for the same frequency
+            priority = freq + index / len(objects)
+        else:
+            priority = inflation + freq / max(size, 1)
+
+        entry = (priority, next(counter))
+        cache[obj] = (entry, freq, size)
+        heapq.heappush(heap, entry + (obj,))
+
+        if len(heap) > 2 * len(cache) + 1000:
+            heap = [entry + (cached_obj,) for cached_obj, (entry, freq, size) in cache.items()]
+            heapq.heapify(heap)
+
+    return hits, repulled, peak
@@ -0,0 +1,52 @@
+import statistics
+
+
+MB = 1024 * 1024
+GB = 1024 * MB
+
+
+def auto_transfer_options(plan, throughput=None):
+    """
+    Choose transfer options for a pull, from the planned files and the throughput of previous pulls
+
+    :type plan: PullPlan
+    :param plan: the files to transfer
+
+    :type throughput: float
+    :param throughput: average throughput (in bytes/s) of previous pulls from the same repo, or None if unknown
+
+    :rtype: dict
+    :return: transfer options (transfers, checkers, multi_thread_streams, buffer_size)
+    """
+
+    sizes = [max(remote_file['Size'], 0) for remote_file in plan.files]
+    if not sizes:
+        return {}
+
+    num_files = len(sizes)
+    median_size = statistics.median(sizes)
+    max_size = max(sizes)
+
+    if median_size < MB:
+        # Lots of small files: latency bound, run many transfers in parallel
+        transfers = min(32, max(4, num_files // 50))
+        multi_thread_streams = 0
+    elif num_files <= 4 and max_size >= GB:
+        # A few big files: split each file in multiple streams
+        transfers = num_files
+        multi_thread_streams = 8
+    else:
+        transfers = min(8, num_files)
+        multi_thread_streams = 4
+
+    # Buffer about half a second of transfer for each file, within sane limits
+    buffer_size = 16
+    if throughput:
+        buffer_size = int(min(256, max(16, throughput / transfers / 2 / MB)))
+
+    return {
+        'transfers': transfers,
+        'checkers': 2 * transfers,
+        'multi_thread_streams': multi_thread_streams,
+        'buffer_size': '%sM' % buffer_size
+    }
@@ -0,0 +1,73 @@
+import concurrent.futures
+import os
+
+
+def walk_files(path, max_depth=0, workers=8, follow_links=False, skip=None):
+    """
+    List local files, scanning subdirectories in parallel
+
+    Metadata latency dominates on network filesystems, so each directory is scanned (and its files stat'ed) in a pool of threads.
+    Files are yielded as soon as their directory is scanned, in no particular order.
+    Directories which cannot be read, and files which disappear while walking, are skipped (like os.walk).
+
+    :type path: str
+    :param path: Path of a directory (or a single file)
+
+    :type max_depth: int
+    :param max_depth: Restrict to a max depth. Set to 0 for all files.
+
+    :type workers: int
+    :param workers: Number of directories scanned in parallel
+
+    :type follow_links: bool
+    :param follow_links: Walk into symlinks to directories
+
+    :type skip: function
+    :param skip: called with the path of each file or subdirectory, and whether it is a directory. Return True to skip the file, or the whole subdirectory.
+
+    :rtype: generator
+    :return: generator of (path, os.stat_result) tuples, for each file
+    """
+
+    if not os.path.isdir(path):
+        try:
+            yield path, os.stat(path)
+        except OSError:
+            pass
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set([executor.submit(_scan_dir, path, max_depth, follow_links, skip)])
+        try:
+            while pending:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    files, subdirs = future.result()
+                    for subdir, subdir_depth in subdirs:
+                        pending.add(executor.submit(_scan_dir, subdir, subdir_depth, follow_links, skip))
+                    for file_record in files:
+                        yield file_record
+        finally:
+            # When the caller stops iterating
+            for future in pending:
+                future.cancel()
+
+
+def _scan_dir(dir_path, max_depth, follow_links, skip):
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        if (not max_depth or max_depth > 1) and (follow_links or not entry.is_symlink()) and not (skip and skip(entry.path, True)):
+                            subdirs.append((entry.path, 0 if not max_depth else max_depth - 1))
+                    elif not (skip and skip(entry.path, False)):
+                        files.append((entry.path, entry.stat()))
+                except OSError:
+                    continue
+    except OSError:
+        pass
+
+    return files, subdirs
@@ -1,9 +1,10 @@
 import os
 import time
+import uuid
 from datetime import datetime, timedelta
 
 from baricadr.app import create_app, create_celery
-from baricadr.db_models import BaricadrTask
+from baricadr.db_models import BaricadrTask, PullCheckpoint
 from baricadr.extensions import db, mail
 
 from celery.result import AsyncResult
@@ -34,16 +35,79 @@ def on_failure(self, exc, task_id, args, kwargs, einfo):
     dbtask.finished = datetime.utcnow()
     db.session.commit()
 
+    # Local files may have changed anyway
+    invalidate_listings(dbtask.path)
 
-def manage_repo(self, type, path, task_id, email=None, wait_for=[], sleep=0):
+    # Pulls which were run in the same transfer failed too
+    for coalesced in BaricadrTask.query.filter(BaricadrTask.coalesced_into == task_id, BaricadrTask.finished.is_(None)):
+        finish_coalesced(coalesced, str(exc))
 
-    # Wait a bit in case the tasks begin just before it is recorded in the db
-    time.sleep(2)
-    dbtask = BaricadrTask.query.filter_by(task_id=task_id).one()
-    dbtask.status = 'waiting' if wait_for else 'started'
-    dbtask.started = datetime.utcnow()
+
+def finish_coalesced(dbtask, error=None):
+    """
+    Mark a pull run by another task as finished (or failed), and send its email
+    """
+
+    dbtask.status = 'failed' if error else 'finished'
+    dbtask.error = error
+    dbtask.finished = datetime.utcnow()
     db.session.commit()
 
+    invalidate_listings(dbtask.path)
+
+    if dbtask.email:
+        if error:
+            msg = Message(subject="Failed to pull",
+                          body="Failed to pull %s. Exception raised : %s" % (dbtask.path, error),
+                          sender=app.config.get('SENDER_EMAIL', 'from@example.com'),
+                          recipients=[dbtask.email])
+        else:
+            msg = Message(subject="Finished pulling",
+                          body="Finished pull %s" % (dbtask.path),
+                          sender=app.config.get('SENDER_EMAIL', 'from@example.com'),
+                          recipients=[dbtask.email])
+        mail.send(msg)
+
+
+def invalidate_listings(path):
+
+    if not app.listing_cache:
+        return
+
+    try:
+        repo = app.repos.get_repo(os.path.abspath(path))
+    except RuntimeError:
+        return
+
+    app.listing_cache.invalidate(repo, os.path.abspath(path))
+
+
+def manage_repo(self, type, path, task_id, email=None, wait_for=[], sleep=0, prefetch=False, incremental=False, evict=False):
+
+    # Prefetches are not delayed, and must not slow down pulls asked by users
+    coalesce = type == 'pull' and app.config['PULL_COALESCE_WINDOW'] > 0 and not prefetch
+
+    # Wait a bit in case the tasks begin just before it is recorded in the db (pulls are already delayed when coalescing)
+    if not coalesce or app.config['PULL_COALESCE_WINDOW'] < 2:
+        time.sleep(2)
+
+    if coalesce:
+        # Another pull may have claimed this one in the meantime
+        started = BaricadrTask.query.filter_by(task_id=task_id, status='new').update({
+            'status': 'waiting' if wait_for else 'started',
+            'started': datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+        dbtask = BaricadrTask.query.filter_by(task_id=task_id).one()
+        if not started:
+            app.logger.info("Pull task %s is run by task %s, nothing to do" % (task_id, dbtask.coalesced_into))
+            return
+    else:
+        dbtask = BaricadrTask.query.filter_by(task_id=task_id).one()
+        dbtask.status = 'waiting' if wait_for else 'started'
+        dbtask.started = datetime.utcnow()
+        db.session.commit()
+
     vocab = {'pull': 'pulling', 'freeze': 'freezing'}
 
     # For internal testing, cannot be set by api
@@ -55,8 +119,7 @@ def manage_repo(self, type, path, task_id, email=None, wait_for=[], sleep=0):
             tries = 0
             # Wait at most MAX_TASK_DURATION, then continue
             while tries < app.config['MAX_TASK_DURATION']:
-                res = AsyncResult(wait_id)
-                if str(res.ready()).lower() == "true":
+                if is_done(wait_id):
                     break
                 time.sleep(1)
                 tries += 1
@@ -72,16 +135,65 @@ def manage_repo(self, type, path, task_id, email=None, wait_for=[], sleep=0):
     asked_path = os.path.abspath(path)
     repo = app.repos.get_repo(asked_path)
 
+    coalesced = []
     if type == "pull":
-        repo.pull(asked_path)
+        if coalesce:
+            app.repos.claim_coalesced_pulls(task_id, repo)
+
+        # Pulls run by this task: claimed pulls, or other prefetched files
+        coalesced = BaricadrTask.query.filter(BaricadrTask.coalesced_into == task_id, BaricadrTask.finished.is_(None)).all()
+        if coalesced:
+            app.logger.info("Pulling %s other paths in task %s" % (len(coalesced), task_id))
+            for ct in coalesced:
+                ct.status = 'pulling'
+                ct.started = ct.started or datetime.utcnow()
+            db.session.commit()
+
+        def save_progress(progress):
+            values = {
+                'progress_files': progress['files'],
+                'progress_total_files': progress['total_files'],
+                'progress_bytes': progress['bytes'],
+                'progress_total_bytes': progress['total_bytes'],
+                'progress_speed': progress['speed'],
+                'progress_eta': progress['eta'],
+                'progress_updated': datetime.utcnow()
+            }
+            # Coalesced pulls share the progress of the whole transfer
+            task_ids = [task_id] + [ct.task_id for ct in coalesced]
+            BaricadrTask.query.filter(BaricadrTask.task_id.in_(task_ids)).update(values, synchronize_session=False)
+            db.session.commit()
+
+        stats = repo.pull(asked_path, task_id, save_progress, [ct.path for ct in coalesced], 'low' if prefetch else None)
+        dbtask.transferred_files = stats['files']
+        dbtask.transferred_bytes = stats['bytes']
+        dbtask.transfer_time = stats['duration']
     else:
-        repo.freeze(asked_path)
+        if app.config.get('REPORTS_DIR'):
+            dbtask.report = os.path.join(app.config['REPORTS_DIR'], '%s.jsonl.gz' % task_id)
+            db.session.commit()
+        if evict:
+            repo.evict(report_path=dbtask.report)
+        else:
+            repo.freeze(asked_path, report_path=dbtask.report, incremental=incremental)
+
+    invalidate_listings(asked_path)
 
     dbtask.status = 'finished'
 
     dbtask.finished = datetime.utcnow()
     db.session.commit()
 
+    for ct in coalesced:
+        finish_coalesced(ct, stats['errors'].get(ct.path))
+
+    if type == 'pull' and repo.prefetcher and not prefetch and os.path.isfile(asked_path):
+        try:
+            repo.prefetcher.record(asked_path, dbtask.created)
+            enqueue_prefetch(repo, asked_path)
+        except RuntimeError as e:
+            app.logger.warning("Could not prefetch files after pulling %s: %s" % (asked_path, e))
+
     if email:
         msg = Message(subject="Finished %s" % (vocab[type]),
                       body="Finished %s %s" % (type, path),  # TODO [LOW] better text
@@ -90,15 +202,83 @@ def manage_repo(self, type, path, task_id, email=None, wait_for=[], sleep=0):
         mail.send(msg)
 
 
+def is_done(task_id):
+    """
+    Check if a task is finished, in the db if it is still there (pulls run by another task have no running celery task), or in celery
+    """
+
+    finished = db.session.query(BaricadrTask.finished).filter_by(task_id=task_id).first()
+    if finished is not None:
+        return finished[0] is not None
+
+    return str(AsyncResult(task_id).ready()).lower() == "true"
+
+
+def enqueue_prefetch(repo, path):
+    """
+    Prefetch the files likely to be pulled after path, in a single background pull
+
+    Each prefetched file gets its own task in the db, so that pulls asked for them wait for the prefetch.
+    """
+
+    candidates = [candidate for candidate in repo.prefetcher.candidates(path) if not app.repos.is_already_touching(candidate)]
+    if not candidates:
+        return
+
+    task = app.celery.send_task('prefetch', (candidates[0], None))
+    app.logger.info("Prefetching %s files after pulling %s, in task %s" % (len(candidates), path, task.task_id))
+
+    db.session.add(BaricadrTask(path=candidates[0], type='prefetch', task_id=task.task_id))
+    for candidate in candidates[1:]:
+        db.session.add(BaricadrTask(path=candidate, type='prefetch', task_id=str(uuid.uuid4()), status='waiting', coalesced_into=task.task_id))
+    db.session.commit()
+
+
 # Maybe fuse the tasks also?
 @celery.task(bind=True, name="pull", on_failure=on_failure)
 def pull(self, path, email=None, wait_for=[], sleep=0):
     manage_repo(self, 'pull', path, pull.request.id, email=email, wait_for=wait_for, sleep=sleep)
 
 
+@celery.task(bind=True, name="prefetch", on_failure=on_failure)
+def prefetch(self, path, email=None):
+    manage_repo(self, 'pull', path, prefetch.request.id, email=email, prefetch=True)
+
+
 @celery.task(bind=True, name="freeze", on_failure=on_failure)
-def freeze(self, path, email=None, wait_for=[], sleep=0):
-    manage_repo(self, 'freeze', path, freeze.request.id, email=email, wait_for=wait_for, sleep=sleep)
+def freeze(self, path, email=None, wait_for=[], sleep=0, incremental=False, evict=False):
+    manage_repo(self, 'freeze', path, freeze.request.id, email=email, wait_for=wait_for, sleep=sleep, incremental=incremental, evict=evict)
+
+
+@celery.task(bind=True, name="refresh_listing")
+def refresh_listing(self, path, missing=False, max_depth=1, from_root=False, full=False):
+    """
+    Refresh a stale listing in the listing cache
+    """
+
+    repo = app.repos.get_repo(path)
+    files = repo.remote_list(path, missing, max_depth, from_root, full)
+    app.listing_cache.set(repo, path, files, missing, max_depth, from_root, full)
+
+
+@celery.task(bind=True, name="refresh_manifest")
+def refresh_manifest(self, repo_path, full=False):
+    """
+    Refresh the manifest of remote files of a repo
+    """
+
+    repo = app.repos.get_repo(repo_path)
+    if not repo.manifest:
+        return
+
+    if repo.manifest.is_refreshing(app.config['MAX_TASK_DURATION']):
+        app.logger.info("Manifest of repo %s is already being refreshed, skipping" % repo.local_path)
+        return
+
+    self.update_state(state='PROGRESS')
+    repo.manifest.refresh(full)
+
+    invalidate_listings(repo.local_path)
 
 
 @celery.task(bind=True, name="cleanup_zombie_tasks")
@@ -140,11 +320,19 @@ def cleanup_tasks(self, cleanup_age):
     num = 0
     for ft in finished_tasks:
         app.logger.debug("Clearing finished task %s with status %s (type = %s, path = %s)'" % (ft.task_id, ft.status, ft.type, ft.path))
+        if ft.report and os.path.exists(ft.report):
+            os.unlink(ft.report)
         db.session.delete(ft)
         db.session.commit()
         num += 1
 
     app.logger.debug("Cleared %s finished tasks" % (num))
+
+    # Checkpoints of pulls which were interrupted, and never resumed
+    max_date = datetime.utcnow() - timedelta(seconds=app.config['PULL_CHECKPOINT_AGE'])
+    num = PullCheckpoint.query.filter(PullCheckpoint.created < max_date).delete()
+    db.session.commit()
+    app.logger.debug("Cleared %s expired pull checkpoints" % (num))
     self.update_state(state='PROGRESS')
 
 
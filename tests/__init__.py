@@ -1,4 +1,7 @@
+import gzip
+import json
 import os
+import tempfile
 
 
 class BaricadrTestCase():
@@ -16,3 +19,22 @@ class BaricadrTestCase():
         else:
             old_time = os.stat(path).st_atime - age
             os.utime(path, (old_time, old_time))  # TODO [HI] leave utime unmodified
+
+    def freeze_files(self, repo, path=None, evict=False, **kwargs):
+        """
+        Freeze files (or evict them), and get the paths of the freezed files (or which would be freezed in dry-run mode) from the report
+        """
+        with tempfile.TemporaryDirectory() as report_dir:
+            report_path = os.path.join(report_dir, 'report.jsonl.gz')
+            if evict:
+                repo.evict(report_path=report_path)
+            else:
+                repo.freeze(path, report_path=report_path, **kwargs)
+
+            records = []
+            # No report if nothing was done (e.g. repo not freezable)
+            if os.path.exists(report_path):
+                with gzip.open(report_path, 'rt') as report:
+                    records = [json.loads(line) for line in report]
+
+        return [os.path.join(repo.local_path, record['path']) for record in records if record['action'] in ('freezed', 'would_freeze')]
@@ -1,6 +1,8 @@
 import os
 from pathlib import Path
 
+from baricadr.model.listing_cache import ListingCache
+
 from . import BaricadrTestCase
 
 
@@ -92,6 +94,48 @@ class TestApiList(BaricadrTestCase):
 
         assert sorted(expected, key=lambda k: k['Path']) == sorted(response.json, key=lambda k: k['Path'])
 
+    def test_list_cached(self, client):
+        """
+            Get files from the listing cache
+        """
+        app = client.application
+        cache = ListingCache(app.config['CELERY_BROKER_URL'], 60)
+        app.listing_cache = cache
+
+        repo = app.repos.get_repo("/repos/test_repo/")
+        cache.invalidate(repo, "/repos/test_repo/")
+
+        body = {"path": "/repos/test_repo/", "max_depth": 1}
+        response = client.post("/list", json=body)
+
+        assert response.status_code == 200
+        assert set([file['Path'] for file in response.json]) == set(["file.txt", "file2.txt"])
+
+        files, stale = cache.get(repo, "/repos/test_repo/", max_depth=1)
+        assert not stale
+        assert set([file['Path'] for file in files]) == set(["file.txt", "file2.txt"])
+
+        # Next call is answered from the cache
+        cache.set(repo, "/repos/test_repo/", [{"Path": "cached.txt"}], max_depth=1)
+        response = client.post("/list", json=body)
+
+        assert response.status_code == 200
+        assert response.json == [{"Path": "cached.txt"}]
+
+        # Other parameters are cached separately
+        body = {"path": "/repos/test_repo/", "max_depth": 2}
+        response = client.post("/list", json=body)
+
+        assert response.status_code == 200
+        assert set([file['Path'] for file in response.json]) == set(["file.txt", "file2.txt", "subdir/subfile.txt"])
+
+        # Touching a subdir invalidates the listing of its parents
+        cache.invalidate(repo, "/repos/test_repo/subdir")
+        assert cache.get(repo, "/repos/test_repo/", max_depth=1) is None
+        assert cache.get(repo, "/repos/test_repo/", max_depth=2) is None
+
+        app.listing_cache = None
+
 
 # TODO [LOW] test checksum
 # TODO [LOW] document how to run backups: disable --delete mode!! + how to handle moved data (not a problem with archive)?
@@ -83,6 +83,11 @@ class TestApiPull(BaricadrTestCase):
         assert response.json['status'] == "finished"
         assert not response.json['error']
 
+        # Progress is exposed
+        assert response.json['progress']['files'] == response.json['progress']['total_files']
+        assert response.json['progress']['total_files'] > 0
+        assert response.json['progress']['eta'] == 0
+
         assert os.path.exists(repo_dir + '/subfile.txt')
         assert os.path.isdir(repo_dir + '/subsubdir')
         assert os.path.exists(repo_dir + '/subsubdir/subsubfile.txt')
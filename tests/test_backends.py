@@ -1,8 +1,15 @@
 import os
 import tempfile
+from unittest import mock
+
+import boto3
+
+from moto import mock_s3
 
 import pytest
 
+import requests
+
 from . import BaricadrTestCase
 
 
@@ -18,6 +25,84 @@ class TestBackends(BaricadrTestCase):
 
         assert be.__class__.__name__ == 'SftpBackend'
 
+    def test_get_shared(self, app):
+        conf = {
+            'url': 'foo:/some/where',
+            'user': 'foo',
+            'password': 'pass'
+        }
+        be = app.backends.get_by_name("sftp", conf)
+
+        # Repo-specific options should not prevent sharing the backend
+        conf_other_repo = dict(conf, exclude="*xml", freeze_age=3)
+        be_other_repo = app.backends.get_by_name("sftp", conf_other_repo)
+
+        assert be is be_other_repo
+
+        conf_other_user = dict(conf, user='bar')
+        be_other_user = app.backends.get_by_name("sftp", conf_other_user)
+
+        assert be is not be_other_user
+        assert be.remote_name != be_other_user.remote_name
+
+    def test_get_shared_native(self, app):
+        conf = {
+            'url': 'native:/some/where',
+            'user': 'foo',
+            'password': 'pass'
+        }
+
+        # Session pools are only created for new settings
+        with mock.patch('baricadr.model.backends.SftpSessionPool') as session_pool:
+            be = app.backends.get_by_name("sftp-native", conf)
+            be_other_repo = app.backends.get_by_name("sftp-native", dict(conf, exclude="*xml"))
+
+        assert be is be_other_repo
+        assert session_pool.call_count == 1
+
+    def test_rclone_config(self, app):
+        conf = {
+            'url': 'foo:/some/where',
+            'user': 'foo',
+            'password': 'pass'
+        }
+        be = app.backends.get_by_name("sftp", conf)
+        be_other = app.backends.get_by_name("sftp", dict(conf, url='bar:/some/where'))
+
+        config_path = app.backends.rclone_config.get_path()
+
+        # The same file is used for all calls
+        assert app.backends.rclone_config.get_path() == config_path
+
+        with open(config_path, 'r') as config_file:
+            content = config_file.read()
+
+        assert '[%s]' % be.remote_name in content
+        assert '[%s]' % be_other.remote_name in content
+        assert 'host = bar' in content
+        assert 'pass = %s' % be.get_obscure_password() in content
+        assert 'pass = pass' not in content
+
+    def test_rclone_daemon_timeout(self, app):
+        conf = {
+            'url': 'hung:/some/where',
+            'user': 'foo',
+            'password': 'pass',
+            'rclone_daemon': True
+        }
+        be = app.backends.get_by_name("sftp", conf)
+        daemon = be.rclone_daemon
+
+        with mock.patch.object(daemon, '_ensure_running'), mock.patch.object(daemon, 'url', 'http://127.0.0.1:1/'), mock.patch.object(daemon, 'session') as session, mock.patch.object(daemon, 'stop') as stop:
+            session.post.side_effect = requests.exceptions.Timeout()
+            with mock.patch.object(be, '_lsjson', return_value=iter([{'Path': 'file.txt'}])) as lsjson:
+                # Listed with rclone lsjson instead
+                assert list(be.list_entries('')) == [{'Path': 'file.txt'}]
+
+        assert session.post.call_args[1]['timeout'] == app.config['RCLONE_DAEMON_TIMEOUT']
+        stop.assert_called_once_with(kill=True)
+        assert lsjson.called
+
     def test_get_empty_conf(self, app):
         conf = {}
         with pytest.raises(ValueError):
@@ -307,3 +392,536 @@ class TestBackends(BaricadrTestCase):
                 'subsubdir/poutrelle.xml',
                 'subsubdir/subsubfile.txt',
             ])
+
+    def test_pull_sftp_daemon_single(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            single_file = local_path + '/subdir/subsubdir2/subsubsubdir/subsubsubdir2/a file'
+
+            conf = {
+                local_path: {
+                    'backend': 'sftp',
+                    'url': 'sftp:test-repo/',
+                    'user': 'foo',
+                    'password': 'pass',
+                    'rclone_daemon': True
+                }
+            }
+
+            app.repos.read_conf_from_str(str(conf))
+
+            repo = app.repos.get_repo(single_file)
+            assert repo.remote_is_single(single_file)
+
+            repo.pull(single_file)
+
+            assert os.path.exists(single_file)
+            assert os.path.isfile(single_file)
+
+    def test_pull_sftp_daemon_repo(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            single_file = local_path + '/subdir/'
+
+            conf = {
+                local_path: {
+                    'backend': 'sftp',
+                    'url': 'sftp:test-repo',
+                    'user': 'foo',
+                    'password': 'pass',
+                    'exclude': '*xml',
+                    'rclone_daemon': True
+                }
+            }
+
+            app.repos.read_conf_from_str(str(conf))
+
+            repo = app.repos.get_repo(single_file)
+            assert not repo.remote_is_single(single_file)
+
+            repo.pull(single_file)
+            assert os.path.isfile(single_file + '/subfile.txt')
+            assert os.path.isfile(single_file + '/subsubdir/subsubfile.txt')
+            assert os.path.isfile(single_file + '/subsubdir2/subsubsubdir/subsubsubdir2/a file')
+            assert not os.path.exists(single_file + '/subsubdir/poutrelle.xml')
+
+    def test_remote_list_sftp_daemon(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            target = local_path + '/subdir/'
+
+            conf = {
+                local_path: {
+                    'backend': 'sftp',
+                    'url': 'sftp:test-repo/',
+                    'user': 'foo',
+                    'password': 'pass',
+                    'rclone_daemon': True
+                }
+            }
+
+            app.repos.read_conf_from_str(str(conf))
+            repo = app.repos.get_repo(target)
+
+            # Order is unreliable, compare sets
+            assert set([file['Path'] for file in repo.remote_list(target, max_depth=2)]) == set([
+                'subfile.txt',
+                'subsubdir2/poutrelle.xml',
+                'subsubdir2/subsubfile.txt',
+                'subsubdir/poutrelle.tsv',
+                'subsubdir/poutrelle.xml',
+                'subsubdir/subsubfile.txt',
+            ])
+
+    def test_daemon_restart(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            target = local_path + '/subdir/'
+
+            conf = {
+                local_path: {
+                    'backend': 'sftp',
+                    'url': 'sftp:test-repo/',
+                    'user': 'foo',
+                    'password': 'pass',
+                    'rclone_daemon': True
+                }
+            }
+
+            app.repos.read_conf_from_str(str(conf))
+            repo = app.repos.get_repo(target)
+
+            assert len(repo.remote_list(target, max_depth=1)) == 1
+
+            # Kill the daemon, it should be restarted on next call
+            app.backends.rclone_daemon.process.kill()
+            app.backends.rclone_daemon.process.wait()
+
+            assert len(repo.remote_list(target, max_depth=1)) == 1
+            assert app.backends.rclone_daemon.process.poll() is None
+
+    def test_iter_remote_list_sftp(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            target = local_path + '/subdir/subsubdir'
+
+            conf = {
+                local_path: {
+                    'backend': 'sftp',
+                    'url': 'sftp:test-repo/',
+                    'user': 'foo',
+                    'password': 'pass'
+                }
+            }
+
+            app.repos.read_conf_from_str(str(conf))
+            repo = app.repos.get_repo(target)
+
+            remote_files = repo.iter_remote_list(target, max_depth=0, from_root=True, full=True)
+
+            # Entries are produced while the listing runs
+            assert not isinstance(remote_files, list)
+
+            remote_files = list(remote_files)
+            assert set([file['Path'] for file in remote_files]) == set([
+                'subdir/subsubdir/poutrelle.tsv',
+                'subdir/subsubdir/poutrelle.xml',
+                'subdir/subsubdir/subsubfile.txt',
+            ])
+            assert all('ModTime' in file for file in remote_files)
+
+            # Single file
+            remote_files = list(repo.iter_remote_list(target + '/poutrelle.tsv', max_depth=0, from_root=True))
+            assert remote_files == [{'Path': 'subdir/subsubdir/poutrelle.tsv'}]
+
+    def test_plan_pull_sftp(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            target = local_path + '/subdir/subsubdir'
+
+            conf = {
+                local_path: {
+                    'backend': 'sftp',
+                    'url': 'sftp:test-repo/',
+                    'user': 'foo',
+                    'password': 'pass',
+                    'exclude': '*xml'
+                }
+            }
+
+            app.repos.read_conf_from_str(str(conf))
+            repo = app.repos.get_repo(target)
+
+            os.makedirs(target)
+            with open(target + '/subsubfile.txt', 'w') as local_file:
+                local_file.write('local copy')
+
+            plan = repo.backend.plan_pull(repo, target)
+
+            # Existing and excluded files are not planned
+            assert [remote_file['Path'] for remote_file in plan.files] == ['subdir/subsubdir/poutrelle.tsv']
+            assert plan.total_size() == plan.files[0]['Size']
+
+    def test_pull_sftp_touch_transferred(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            target = local_path + '/subdir/subsubdir'
+
+            conf = {
+                local_path: {
+                    'backend': 'sftp',
+                    'url': 'sftp:test-repo/',
+                    'user': 'foo',
+                    'password': 'pass'
+                }
+            }
+
+            app.repos.read_conf_from_str(str(conf))
+            repo = app.repos.get_repo(target)
+
+            os.makedirs(target)
+            existing = target + '/subsubfile.txt'
+            with open(existing, 'w') as local_file:
+                local_file.write('local copy')
+            self.set_old_atime(existing, recursive=False)
+            old_atime = os.stat(existing).st_atime
+
+            repo.pull(target)
+
+            assert os.path.isfile(target + '/poutrelle.tsv')
+            assert os.path.isfile(target + '/poutrelle.xml')
+
+            # Existing file is left untouched
+            assert os.stat(existing).st_atime == old_atime
+            with open(existing, 'r') as local_file:
+                assert local_file.read() == 'local copy'
+
+    def _create_s3_bucket(self):
+        client = boto3.client('s3', region_name='us-east-1', aws_access_key_id='someone', aws_secret_access_key='xxxxx')
+        client.create_bucket(Bucket='test-bucket')
+        client.put_object(Bucket='test-bucket', Key='repo/file.txt', Body=b'some content')
+        client.put_object(Bucket='test-bucket', Key='repo/subdir/subfile.txt', Body=b'some other content')
+        client.put_object(Bucket='test-bucket', Key='repo/subdir/subsubdir/big.bin', Body=os.urandom(6 * 1024 * 1024))
+
+        return client
+
+    @mock_s3
+    def test_remote_list_s3(self, app):
+        self._create_s3_bucket()
+
+        with tempfile.TemporaryDirectory() as local_path:
+            conf = {
+                local_path: {
+                    'backend': 's3',
+                    'url': 'test-bucket/repo',
+                    'user': 'someone',
+                    'password': 'xxxxx',
+                    'region': 'us-east-1'
+                }
+            }
+
+            app.repos.read_conf_from_str(str(conf))
+            repo = app.repos.get_repo(local_path)
+
+            assert [file['Path'] for file in repo.remote_list(local_path, max_depth=1)] == ['file.txt']
+            assert set([file['Path'] for file in repo.remote_list(local_path, max_depth=0)]) == set([
+                'file.txt',
+                'subdir/subfile.txt',
+                'subdir/subsubdir/big.bin'
+            ])
+            assert [file['Path'] for file in repo.remote_list(local_path + '/subdir', max_depth=1)] == ['subfile.txt']
+            assert repo.remote_is_single(local_path + '/subdir/subfile.txt')
+            assert not repo.remote_is_single(local_path + '/subdir')
+
+            with pytest.raises(RuntimeError):
+                repo.remote_list(local_path + '/nothing')
+
+    @mock_s3
+    def test_pull_s3(self, app):
+        client = self._create_s3_bucket()
+
+        with tempfile.TemporaryDirectory() as local_path:
+            conf = {
+                local_path: {
+                    'backend': 's3',
+                    'url': 'test-bucket/repo',
+                    'user': 'someone',
+                    'password': 'xxxxx',
+                    'region': 'us-east-1',
+                    'buffer_size': '5M',
+                    'multi_thread_streams': 2
+                }
+            }
+
+            app.repos.read_conf_from_str(str(conf))
+            repo = app.repos.get_repo(local_path)
+            # Force ranged downloads for the big file
+            repo.backend.multipart_threshold = 5 * 1024 * 1024
+
+            os.makedirs(local_path + '/subdir')
+            with open(local_path + '/subdir/subfile.txt', 'w') as local_file:
+                local_file.write('local copy')
+
+            stats = repo.pull(local_path)
+
+            assert stats['files'] == 2
+
+            with open(local_path + '/file.txt', 'rb') as local_file:
+                assert local_file.read() == b'some content'
+
+            remote_big = client.get_object(Bucket='test-bucket', Key='repo/subdir/subsubdir/big.bin')['Body'].read()
+            with open(local_path + '/subdir/subsubdir/big.bin', 'rb') as local_file:
+                assert local_file.read() == remote_big
+
+            # Existing file is left untouched
+            with open(local_path + '/subdir/subfile.txt', 'r') as local_file:
+                assert local_file.read() == 'local copy'
+
+            # No temp file left
+            assert sorted(os.listdir(local_path + '/subdir/subsubdir')) == ['big.bin']
+
+    @mock_s3
+    def test_pull_s3_single(self, app):
+        self._create_s3_bucket()
+
+        with tempfile.TemporaryDirectory() as local_path:
+            conf = {
+                local_path: {
+                    'backend': 's3',
+                    'url': 'test-bucket/repo',
+                    'user': 'someone',
+                    'password': 'xxxxx',
+                    'region': 'us-east-1'
+                }
+            }
+
+            app.repos.read_conf_from_str(str(conf))
+            repo = app.repos.get_repo(local_path)
+
+            repo.pull(local_path + '/subdir/subfile.txt')
+
+            assert os.listdir(local_path) == ['subdir']
+            assert os.listdir(local_path + '/subdir') == ['subfile.txt']
+
+    def test_pull_sftp_native_single(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            single_file = local_path + '/subdir/subsubdir2/subsubsubdir/subsubsubdir2/a file'
+
+            conf = {
+                local_path: {
+                    'backend': 'sftp-native',
+                    'url': 'sftp:test-repo/',
+                    'user': 'foo',
+                    'password': 'pass'
+                }
+            }
+
+            app.repos.read_conf_from_str(str(conf))
+
+            repo = app.repos.get_repo(single_file)
+            assert repo.remote_is_single(single_file)
+
+            repo.pull(single_file)
+            assert os.path.isfile(single_file)
+            assert os.listdir(os.path.dirname(single_file)) == ['a file']
+            assert os.listdir(local_path) == ['subdir']
+
+    def test_pull_sftp_native_repo(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            target = local_path + '/subdir'
+
+            conf = {
+                local_path: {
+                    'backend': 'sftp-native',
+                    'url': 'sftp:test-repo',
+                    'user': 'foo',
+                    'password': 'pass',
+                    'exclude': '*xml'
+                }
+            }
+
+            app.repos.read_conf_from_str(str(conf))
+
+            repo = app.repos.get_repo(target)
+            assert not repo.remote_is_single(target)
+
+            repo.pull(target)
+            assert os.path.isfile(target + '/subfile.txt')
+            assert os.path.isfile(target + '/subsubdir/subsubfile.txt')
+            assert os.path.isfile(target + '/subsubdir2/subsubsubdir/subsubsubdir2/a file')
+            assert not os.path.exists(target + '/subsubdir/poutrelle.xml')
+            assert not os.path.exists(local_path + '/file.txt')
+
+    def test_pull_sftp_native_invalid(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            target = local_path + '/non_existing_subdir/'
+
+            conf = {
+                local_path: {
+                    'backend': 'sftp-native',
+                    'url': 'sftp:test-repo',
+                    'user': 'foo',
+                    'password': 'pass'
+                }
+            }
+
+            app.repos.read_conf_from_str(str(conf))
+
+            repo = app.repos.get_repo(target)
+
+            with pytest.raises(RuntimeError):
+                repo.pull(target)
+
+    def test_remote_list_sftp_native(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            target = local_path + '/subdir/'
+
+            conf = {
+                local_path: {
+                    'backend': 'sftp-native',
+                    'url': 'sftp:test-repo/',
+                    'user': 'foo',
+                    'password': 'pass'
+                }
+            }
+
+            app.repos.read_conf_from_str(str(conf))
+            repo = app.repos.get_repo(target)
+
+            assert set([file['Path'] for file in repo.remote_list(target, max_depth=2)]) == set([
+                'subfile.txt',
+                'subsubdir2/poutrelle.xml',
+                'subsubdir2/subsubfile.txt',
+                'subsubdir/poutrelle.tsv',
+                'subsubdir/poutrelle.xml',
+                'subsubdir/subsubfile.txt',
+            ])
+
+            full_list = repo.remote_list(target, max_depth=0, full=True)
+            assert len(full_list) == 7
+            assert all(file['Size'] >= 0 and not file['IsDir'] for file in full_list)
+
+    def test_sftp_native_pool(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            conf = {
+                local_path: {
+                    'backend': 'sftp-native',
+                    'url': 'sftp:test-repo/',
+                    'user': 'foo',
+                    'password': 'pass'
+                }
+            }
+
+            app.repos.read_conf_from_str(str(conf))
+            repo = app.repos.get_repo(local_path)
+
+            repo.remote_list(local_path + '/subdir')
+
+            # The session used for listing is kept open and reused
+            sftp = repo.backend.pool.acquire()
+            repo.backend.pool.release(sftp)
+            repo.remote_list(local_path + '/subdir')
+            assert repo.backend.pool.acquire() is sftp
+
+    def test_pull_sftp_native_multi_stream(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            conf = {
+                local_path: {
+                    'backend': 'sftp-native',
+                    'url': 'sftp:test-repo/',
+                    'user': 'foo',
+                    'password': 'pass',
+                    'multi_thread_streams': 3
+                }
+            }
+
+            app.repos.read_conf_from_str(str(conf))
+            repo = app.repos.get_repo(local_path)
+
+            # Split all files in small reads, from multiple streams
+            repo.backend.multi_thread_cutoff = 1
+            repo.backend.read_size = 2
+            repo.backend.block_size = 4
+
+            target = local_path + '/subdir/subsubdir'
+            repo.pull(target)
+
+            remote_files = repo.remote_list(target, full=True)
+            assert len(remote_files) == 3
+            for remote_file in remote_files:
+                assert os.path.getsize(os.path.join(target, remote_file['Path'])) == remote_file['Size']
+
+    def test_pull_local(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            target = local_path + '/subdir'
+
+            conf = {
+                local_path: {
+                    'backend': 'local',
+                    'url': os.path.join(os.path.dirname(__file__), '..', 'test-data', 'test-repo'),
+                    'exclude': '*xml'
+                }
+            }
+
+            app.repos.read_conf_from_str(str(conf))
+            repo = app.repos.get_repo(target)
+
+            assert not repo.remote_is_single(target)
+            assert repo.remote_is_single(target + '/subfile.txt')
+            assert set([file['Path'] for file in repo.remote_list(target, max_depth=2)]) == set([
+                'subfile.txt',
+                'subsubdir2/poutrelle.xml',
+                'subsubdir2/subsubfile.txt',
+                'subsubdir/poutrelle.tsv',
+                'subsubdir/poutrelle.xml',
+                'subsubdir/subsubfile.txt',
+            ])
+
+            os.makedirs(target)
+            existing = target + '/subfile.txt'
+            with open(existing, 'w') as local_file:
+                local_file.write('local copy')
+            self.set_old_atime(existing, recursive=False)
+            old_atime = os.stat(existing).st_atime
+
+            stats = repo.pull(target)
+
+            assert stats['files'] == 4
+            remote_file = os.path.join(repo.backend.url, 'subdir/subsubdir/poutrelle.tsv')
+            with open(target + '/subsubdir/poutrelle.tsv', 'r') as local_file, open(remote_file, 'r') as orig_file:
+                assert local_file.read() == orig_file.read()
+            assert os.stat(target + '/subsubdir/poutrelle.tsv').st_mtime == os.stat(remote_file).st_mtime
+            assert os.path.isfile(target + '/subsubdir2/subsubsubdir/subsubsubdir2/a file')
+
+            # Excluded files
+            assert not os.path.exists(target + '/subsubdir/poutrelle.xml')
+
+            # Existing file is left untouched
+            assert os.stat(existing).st_atime == old_atime
+            with open(existing, 'r') as local_file:
+                assert local_file.read() == 'local copy'
+
+    def test_pull_local_invalid(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            target = local_path + '/non_existing_subdir/'
+
+            conf = {
+                local_path: {
+                    'backend': 'local',
+                    'url': os.path.join(os.path.dirname(__file__), '..', 'test-data', 'test-repo')
+                }
+            }
+
+            app.repos.read_conf_from_str(str(conf))
+            repo = app.repos.get_repo(target)
+
+            with pytest.raises(RuntimeError):
+                repo.pull(target)
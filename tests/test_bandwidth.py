@@ -0,0 +1,106 @@
+import os
+import tempfile
+import time
+
+from baricadr.model.backends import PullPlan
+from baricadr.model.bandwidth import BandwidthBudget, parse_limit
+from baricadr.model.progress import PartProgress, TransferProgress
+
+import pytest
+
+from . import BaricadrTestCase
+
+
+class TestBandwidth(BaricadrTestCase):
+
+    remote_path = os.path.join(os.path.dirname(__file__), '..', 'test-data', 'test-repo')
+
+    def get_budget(self, app, limit):
+        budget = BandwidthBudget(app.config['CELERY_BROKER_URL'], limit)
+        budget.redis.delete(budget.registry_key, budget.bucket_key)
+
+        return budget
+
+    def test_parse_limit(self, app):
+
+        assert parse_limit('1000000') == 1000000
+        assert parse_limit(1000000) == 1000000
+        assert parse_limit('100M') == 100 * 1024 * 1024
+        assert parse_limit('512k') == 512 * 1024
+
+        with pytest.raises(ValueError):
+            parse_limit('fast')
+
+    def test_share(self, app):
+
+        budget = self.get_budget(app, 2000)
+
+        normal = budget.register('normal')
+        high = budget.register('high')
+
+        assert budget.share(normal.transfer_id, normal.weight) == 400
+        assert budget.share(high.transfer_id, high.weight) == 1600
+
+        high.close()
+        assert budget.share(normal.transfer_id, normal.weight) == 2000
+
+        # Transfer of a dead worker
+        budget.redis.hset(budget.registry_key, 'dead', '16:%s' % (time.time() - 60))
+        assert budget.share(normal.transfer_id, normal.weight) == 2000
+        assert not budget.redis.hexists(budget.registry_key, 'dead')
+
+        normal.close()
+
+    def test_part_throttle(self, app):
+
+        budget = self.get_budget(app, 300 * 1024)
+        throttle = budget.register('normal')
+        progress = TransferProgress(PullPlan(None, '/foo/bar', [{'Path': 'file', 'Size': 1000}]), throttle=throttle)
+
+        # Parts transferred in parallel split the share of the transfer
+        part = PartProgress(progress, 3)
+        assert part.throttle.limit() == 100 * 1024
+        assert part.throttle.rclone_rate() == '100K'
+
+        assert PartProgress(progress).throttle is throttle
+
+        throttle.close()
+
+    def test_bucket(self, app):
+
+        budget = self.get_budget(app, 1000)
+
+        # A second of transfer is allowed in advance
+        assert budget.consume(1000) == 0
+        delay = budget.consume(2000)
+        assert delay > 1.5
+        assert delay <= 2
+
+    def test_pull_throttled(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            conf = {
+                local_path: {
+                    'backend': 'local',
+                    'url': self.remote_path
+                }
+            }
+            app.repos.read_conf_from_str(str(conf))
+            repo = app.repos.get_repo(local_path)
+
+            # 25 bytes at 20 bytes/s
+            budget = self.get_budget(app, 20)
+            app.bandwidth = budget
+            try:
+                start = time.time()
+                stats = repo.pull(local_path + '/subdir/subsubdir/poutrelle.tsv')
+                duration = time.time() - start
+            finally:
+                app.bandwidth = None
+
+            assert stats['files'] == 1
+            assert duration >= 1
+            assert os.path.exists(local_path + '/subdir/subsubdir/poutrelle.tsv')
+
+            # The transfer is not registered anymore
+            assert not budget.redis.hgetall(budget.registry_key)
@@ -0,0 +1,122 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+from baricadr.model import checksums
+
+from . import BaricadrTestCase
+
+
+class TestChecksums(BaricadrTestCase):
+
+    remote_path = os.path.join(os.path.dirname(__file__), '..', 'test-data', 'test-repo')
+
+    def test_local_hash_cached(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            test_file = local_path + '/some_file'
+            with open(test_file, 'w') as local_file:
+                local_file.write('some content')
+            self.set_old_atime(test_file, recursive=False)
+            file_stat = os.stat(test_file)
+
+            assert checksums.local_hash(test_file, 'md5') == hashlib.md5(b'some content').hexdigest()
+
+            # Access time is left untouched
+            assert os.stat(test_file).st_atime == file_stat.st_atime
+
+            if not checksums._get_xattr(test_file, 'md5'):
+                # No xattr support in this filesystem
+                return
+
+            # Same size and mtime: the cached hash is used
+            with open(test_file, 'w') as local_file:
+                local_file.write('other conten')
+            os.utime(test_file, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns))
+            assert checksums.local_hash(test_file, 'md5') == hashlib.md5(b'some content').hexdigest()
+
+            # Modified file: computed again
+            os.utime(test_file, None)
+            assert checksums.local_hash(test_file, 'md5') == hashlib.md5(b'other conten').hexdigest()
+
+    def test_verify_files(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            test_file = local_path + '/some_file'
+            with open(test_file, 'w') as local_file:
+                local_file.write('some content')
+
+            assert checksums.verify_files({test_file: {'md5': hashlib.md5(b'some content').hexdigest().upper()}}) == {test_file: True}
+            assert checksums.verify_files({test_file: {'sha1': hashlib.sha1(b'other content').hexdigest()}}) == {test_file: False}
+            assert checksums.verify_files({test_file: {'whirlpool': 'xxxx'}}) == {test_file: None}
+            assert checksums.verify_files({test_file: None}) == {test_file: None}
+
+    def test_pull_integrity(self, app):
+
+        app.config['PULL_RETRY_DELAY'] = 0
+
+        with tempfile.TemporaryDirectory() as local_path:
+            conf = {
+                local_path: {
+                    'backend': 'local',
+                    'url': self.remote_path,
+                    'integrity': True
+                }
+            }
+
+            app.repos.read_conf_from_str(str(conf))
+            target = local_path + '/subdir/subsubdir'
+            repo = app.repos.get_repo(target)
+
+            copy = repo.backend._copy
+            calls = []
+
+            def corrupting_copy(src, dest, *args):
+                calls.append(os.path.basename(src))
+                copy(src, dest, *args)
+                # First copy of this file is corrupted
+                if os.path.basename(src) == 'poutrelle.tsv' and calls.count('poutrelle.tsv') == 1:
+                    with open(dest, 'r+') as dest_file:
+                        dest_file.write('X')
+
+            repo.backend._copy = corrupting_copy
+            try:
+                stats = repo.pull(target)
+            finally:
+                repo.backend._copy = copy
+
+            assert stats['files'] == 3
+            assert calls.count('poutrelle.tsv') == 2
+            with open(target + '/poutrelle.tsv', 'r') as local_file, open(os.path.join(self.remote_path, 'subdir/subsubdir/poutrelle.tsv'), 'r') as orig_file:
+                assert local_file.read() == orig_file.read()
+
+    def test_freeze_integrity(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            conf = {
+                local_path: {
+                    'backend': 'local',
+                    'url': self.remote_path,
+                    'integrity': True,
+                    'freezable': True
+                }
+            }
+
+            app.repos.read_conf_from_str(str(conf))
+            target = local_path + '/subdir/subsubdir'
+            repo = app.repos.get_repo(target)
+
+            shutil.copytree(os.path.join(self.remote_path, 'subdir/subsubdir'), target)
+
+            # Modified locally, without changing mtime
+            modified = target + '/poutrelle.tsv'
+            mtime_ns = os.stat(modified).st_mtime_ns
+            with open(modified, 'r+') as local_file:
+                local_file.write('X')
+            os.utime(modified, ns=(mtime_ns, mtime_ns))
+
+            freezed = self.freeze_files(repo, target, force=True)
+
+            assert sorted(freezed) == [target + '/poutrelle.xml', target + '/subsubfile.txt']
+            assert os.path.exists(modified)
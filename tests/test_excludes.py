@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+
+from baricadr.model.excludes import ExcludeMatcher
+from baricadr.model.walker import walk_files
+
+from . import BaricadrTestCase
+
+
+class TestExcludes(BaricadrTestCase):
+
+    remote_path = os.path.join(os.path.dirname(__file__), '..', 'test-data', 'test-repo')
+
+    def test_matches(self, app):
+
+        excludes = ExcludeMatcher("*xml , tmp/*, subdir/*.tsv")
+
+        assert excludes.patterns == ['*xml', 'tmp/*', 'subdir/*.tsv']
+        assert excludes.matches('poutrelle.xml')
+        assert excludes.matches('subdir/subsubdir/poutrelle.xml')
+        assert excludes.matches('tmp/some/file')
+        assert excludes.matches('subdir/subsubdir/poutrelle.tsv')
+        assert not excludes.matches('poutrelle.tsv')
+        assert not excludes.matches('subdir/file.txt')
+
+        assert not ExcludeMatcher()
+        assert not ExcludeMatcher().matches('poutrelle.xml')
+
+    def test_prunes(self, app):
+
+        excludes = ExcludeMatcher("*xml, tmp/*, *cache*")
+
+        assert excludes.prunes('tmp')
+        assert excludes.prunes('some/cache')
+        assert excludes.prunes('some/cache/subdir')
+        assert not excludes.prunes('tmp2')
+        assert not excludes.prunes('subdir.xml')
+
+    def test_rclone_filters(self, app):
+
+        excludes = ExcludeMatcher("*xml, *.t?v, tmp/*, file[0-9], *{a,b}")
+
+        assert excludes.rclone_filters() == ['**xml', '**.t?v']
+
+    def test_list_excluded(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            conf = {
+                local_path: {
+                    'backend': 'local',
+                    'url': self.remote_path,
+                    'exclude': '*xml, subdir/subsubdir2/*'
+                }
+            }
+            app.repos.read_conf_from_str(str(conf))
+            repo = app.repos.get_repo(local_path)
+
+            listed = [entry['Path'] for entry in repo.remote_list(local_path, max_depth=0)]
+            assert sorted(listed) == ['file.txt', 'file2.txt', 'subdir/subfile.txt', 'subdir/subsubdir/poutrelle.tsv', 'subdir/subsubdir/subsubfile.txt']
+
+            listed = [entry['Path'] for entry in repo.remote_list(local_path + '/subdir/subsubdir', missing=True)]
+            assert sorted(listed) == ['poutrelle.tsv', 'subsubfile.txt']
+
+    def test_walk_pruned(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            shutil.rmtree(local_path)
+            shutil.copytree(self.remote_path, local_path)
+            conf = {
+                local_path: {
+                    'backend': 'local',
+                    'url': self.remote_path,
+                    'exclude': '*xml, subdir/subsubdir2/*'
+                }
+            }
+            app.repos.read_conf_from_str(str(conf))
+            repo = app.repos.get_repo(local_path)
+
+            checked = []
+
+            def skip(path, is_dir):
+                checked.append(path)
+                return repo.is_excluded(path, is_dir)
+
+            walked = sorted(repo.relative_path(file_path) for file_path, _ in walk_files(local_path, skip=skip))
+            assert walked == ['file.txt', 'file2.txt', 'subdir/subfile.txt', 'subdir/subsubdir/poutrelle.tsv', 'subdir/subsubdir/subsubfile.txt']
+
+            # Nothing inside the excluded directory was looked at
+            assert not [path for path in checked if path.startswith(local_path + '/subdir/subsubdir2/')]
@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+from baricadr.db_models import FreezeDirState, FreezeScan
+from baricadr.extensions import db
+from baricadr.model.freeze_scan import FreezeScanner
+
+from . import BaricadrTestCase
+
+
+class TestFreezeScan(BaricadrTestCase):
+
+    template_repo = os.path.join(os.path.dirname(__file__), '..', 'test-data', 'test-repo')
+
+    def setup_method(self):
+        # Recently modified remote files, and recently accessed local files
+        self.remote_path = tempfile.mkdtemp()
+        shutil.rmtree(self.remote_path)
+        shutil.copytree(self.template_repo, self.remote_path, copy_function=shutil.copyfile)
+
+        self.local_path = tempfile.mkdtemp()
+        shutil.rmtree(self.local_path)
+        shutil.copytree(self.remote_path, self.local_path)
+
+        now = time.time()
+        for root, subdirs, files in os.walk(self.local_path):
+            for name in files:
+                file_path = os.path.join(root, name)
+                os.utime(file_path, (now, os.stat(file_path).st_mtime))
+
+    def teardown_method(self):
+        FreezeDirState.query.filter(FreezeDirState.repo == self.local_path).delete()
+        FreezeScan.query.filter(FreezeScan.path == self.local_path).delete()
+        db.session.commit()
+        shutil.rmtree(self.local_path)
+        shutil.rmtree(self.remote_path)
+
+    def get_repo(self, app):
+        conf = {
+            self.local_path: {
+                'backend': 'local',
+                'url': self.remote_path,
+                'freezable': True,
+                'freeze_age': 3
+            }
+        }
+
+        app.repos.read_conf_from_str(str(conf))
+
+        return app.repos.get_repo(self.local_path)
+
+    def scanned_dirs(self, repo):
+        scanner = FreezeScanner(repo, self.local_path)
+        dirs = [rel_dir for files, scanned in scanner.iter_batches() for rel_dir, _, _, _ in scanned]
+        scanner.finish()
+
+        return sorted(dirs), scanner.stats
+
+    def test_incremental_freeze(self, app):
+
+        repo = self.get_repo(app)
+        old_file = os.path.join(self.local_path, 'subdir/subsubdir2/poutrelle.xml')
+        self.set_old_atime(old_file, recursive=False)
+
+        freezed = self.freeze_files(repo, self.local_path, incremental=True)
+        assert freezed == [old_file]
+
+        states = {state.path: state for state in FreezeDirState.query.filter(FreezeDirState.repo == self.local_path)}
+        assert sorted(states) == ['', 'subdir', 'subdir/subsubdir', 'subdir/subsubdir2', 'subdir/subsubdir2/subsubsubdir', 'subdir/subsubdir2/subsubsubdir/subsubsubdir2']
+        assert states['subdir/subsubdir2'].file_count == 1
+        assert states['subdir/subsubdir2/subsubsubdir'].min_atime is None
+
+        # Nothing changed: no directory can contain freezable files
+        dirs, stats = self.scanned_dirs(repo)
+        assert dirs == []
+        assert stats['skipped'] == 6
+
+        # New file
+        shutil.copy2(old_file.replace(self.local_path, self.remote_path), old_file)
+        self.set_old_atime(old_file, recursive=False)
+        dirs, stats = self.scanned_dirs(repo)
+        assert dirs == ['subdir/subsubdir2']
+
+        assert self.freeze_files(repo, self.local_path, incremental=True) == [old_file]
+
+    def test_resume_scan(self, app):
+
+        repo = self.get_repo(app)
+        self.set_old_atime(self.local_path)
+
+        # Interrupted after the first batch
+        scanner = FreezeScanner(repo, self.local_path)
+        scanner.stats = {'scanned': 0, 'skipped': 0}
+        batches = scanner.iter_batches()
+        files, dirs = next(batches)
+        scanner.record(dirs, [])
+        batches.close()
+
+        scan = FreezeScan.query.filter_by(path=self.local_path).one()
+        assert scan.finished is None
+
+        # Directories scanned before the interruption are skipped, even with old files
+        dirs, stats = self.scanned_dirs(repo)
+        assert dirs == []
+        assert stats['skipped'] == 6
+
+        scan = FreezeScan.query.filter_by(path=self.local_path).one()
+        assert scan.finished <= datetime.utcnow()
+
+        # Next scan is complete (except for the directory without files)
+        dirs, stats = self.scanned_dirs(repo)
+        assert len(dirs) == 5
+        assert 'subdir/subsubdir2/subsubsubdir' not in dirs
@@ -0,0 +1,162 @@
+import os
+import tempfile
+
+from baricadr.db_models import RemoteFile, RemoteManifest
+from baricadr.extensions import db
+
+from . import BaricadrTestCase
+
+
+class TestManifest(BaricadrTestCase):
+
+    def setup_method(self):
+        self.repo_paths = []
+
+    def teardown_method(self):
+        for repo_path in self.repo_paths:
+            RemoteFile.query.filter_by(repo=repo_path).delete()
+            RemoteManifest.query.filter_by(repo=repo_path).delete()
+        db.session.commit()
+
+    def get_repo(self, app, local_path):
+        conf = {
+            local_path: {
+                'backend': 'sftp',
+                'url': 'sftp:test-repo/',
+                'user': 'foo',
+                'password': 'pass',
+                'manifest': True
+            }
+        }
+
+        app.repos.read_conf_from_str(str(conf))
+        self.repo_paths.append(local_path)
+
+        return app.repos.get_repo(local_path)
+
+    def test_refresh(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            repo = self.get_repo(app, local_path)
+
+            assert not repo.manifest.is_ready()
+
+            assert repo.manifest.refresh() == 9
+            assert repo.manifest.is_ready()
+
+            remote_files = RemoteFile.query.filter_by(repo=local_path)
+            assert remote_files.count() == 9
+
+            remote_file = remote_files.filter_by(path='subdir/subsubdir/poutrelle.tsv').one()
+            assert remote_file.size > 0
+            assert remote_file.mtime
+
+            # Nothing changed on the remote since last refresh
+            assert repo.manifest.refresh() == 0
+            assert RemoteFile.query.filter_by(repo=local_path).count() == 9
+
+    def test_refresh_full_removes_deleted(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            repo = self.get_repo(app, local_path)
+            repo.manifest.refresh()
+
+            db.session.add(RemoteFile(repo=local_path, path='deleted/file.txt', size=12, mtime='2020-10-26T10:58:53.117758000+01:00'))
+            db.session.commit()
+
+            repo.manifest.refresh()
+            assert RemoteFile.query.filter_by(repo=local_path, path='deleted/file.txt').count() == 1
+
+            repo.manifest.refresh(full=True)
+            assert RemoteFile.query.filter_by(repo=local_path, path='deleted/file.txt').count() == 0
+            assert RemoteFile.query.filter_by(repo=local_path).count() == 9
+
+    def test_freeze_ignores_manifest(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            repo = self.get_repo(app, local_path)
+            repo.manifest.refresh()
+
+            # Deleted on the remote since the last full refresh
+            db.session.add(RemoteFile(repo=local_path, path='deleted/file.txt', size=12, mtime='2020-10-26T10:58:53.117758000+01:00'))
+            db.session.commit()
+
+            local_file = os.path.join(local_path, 'deleted/file.txt')
+            os.makedirs(os.path.dirname(local_file))
+            with open(local_file, 'w') as f:
+                f.write('last copy\n')
+            os.utime(local_file, (1603706333, 1603706333))
+
+            assert repo.freeze(local_path, force=True)['files'] == 0
+            assert os.path.exists(local_file)
+
+    def test_pull_ignores_manifest(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            repo = self.get_repo(app, local_path)
+            repo.manifest.refresh()
+
+            # Added on the remote since the last refresh
+            RemoteFile.query.filter_by(repo=local_path, path='subdir/subsubdir/poutrelle.tsv').delete()
+            # Deleted on the remote since the last full refresh
+            db.session.add(RemoteFile(repo=local_path, path='subdir/subsubdir/deleted.txt', size=12, mtime='2020-10-26T10:58:53.117758000+01:00'))
+            db.session.commit()
+
+            target = local_path + '/subdir/subsubdir'
+            stats = repo.pull(target)
+
+            assert stats['files'] == 3
+            assert sorted(os.listdir(target)) == ['poutrelle.tsv', 'poutrelle.xml', 'subsubfile.txt']
+
+    def test_remote_list(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            repo = self.get_repo(app, local_path)
+            repo.manifest.refresh()
+
+            # Check that the listing comes from the manifest
+            db.session.add(RemoteFile(repo=local_path, path='subdir/only_in_manifest.txt', size=12, mtime='2020-10-26T10:58:53.117758000+01:00'))
+            db.session.commit()
+
+            target = local_path + '/subdir/'
+            assert set([file['Path'] for file in repo.remote_list(target, max_depth=2)]) == set([
+                'subfile.txt',
+                'only_in_manifest.txt',
+                'subsubdir2/poutrelle.xml',
+                'subsubdir2/subsubfile.txt',
+                'subsubdir/poutrelle.tsv',
+                'subsubdir/poutrelle.xml',
+                'subsubdir/subsubfile.txt',
+            ])
+
+            assert [file['Path'] for file in repo.remote_list(target + 'subsubdir/poutrelle.tsv', from_root=True)] == ['subdir/subsubdir/poutrelle.tsv']
+            assert repo.remote_is_single(target + 'subsubdir/poutrelle.tsv')
+            assert not repo.remote_is_single(target)
+
+    def test_remote_list_missing(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            repo = self.get_repo(app, local_path)
+            repo.manifest.refresh()
+
+            os.makedirs(local_path + '/subdir/subsubdir')
+            with open(local_path + '/subdir/subsubdir/poutrelle.tsv', 'w') as local_file:
+                local_file.write('local copy')
+
+            target = local_path + '/subdir/subsubdir'
+            assert [file['Path'] for file in repo.remote_list(target, missing=True, max_depth=0)] == [
+                'poutrelle.xml',
+                'subsubfile.txt',
+            ]
+
+    def test_remote_list_not_in_manifest(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            repo = self.get_repo(app, local_path)
+            repo.manifest.refresh()
+
+            # Simulate a file added on remote since last refresh
+            RemoteFile.query.filter_by(repo=local_path, path='file2.txt').delete()
+            db.session.commit()
+
+            assert [file['Path'] for file in repo.remote_list(local_path + '/file2.txt', from_root=True)] == ['file2.txt']
@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from . import BaricadrTestCase
+
+
+class TestMirrors(BaricadrTestCase):
+
+    remote_path = os.path.join(os.path.dirname(__file__), '..', 'test-data', 'test-repo')
+
+    def get_repo(self, app, local_path, mirror_path):
+        conf = {
+            local_path: {
+                'backend': 'local',
+                'url': self.remote_path,
+                'mirrors': [
+                    {
+                        'backend': 'local',
+                        'url': mirror_path
+                    }
+                ]
+            }
+        }
+
+        app.repos.read_conf_from_str(str(conf))
+
+        return app.repos.get_repo(local_path)
+
+    def test_mirrors_conf_invalid(self, app):
+        conf = {
+            '/foo/bar': {
+                'backend': 'local',
+                'url': self.remote_path,
+                'mirrors': 'somewhere'
+            },
+        }
+
+        with pytest.raises(ValueError):
+            app.repos.do_read_conf(str(conf))
+
+        conf['/foo/bar']['mirrors'] = [{'url': self.remote_path}]
+
+        with pytest.raises(ValueError):
+            app.repos.do_read_conf(str(conf))
+
+    def test_split(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path, tempfile.TemporaryDirectory() as mirror_path:
+            repo = self.get_repo(app, local_path, mirror_path)
+            fast, slow = repo.backend.mirrors
+            fast.latency = slow.latency = 0
+            fast.throughput = 3000
+            slow.throughput = 1000
+
+            files = [{'Path': 'file%s' % i, 'Size': 1000} for i in range(8)]
+
+            # Small pulls use the fastest mirror only
+            parts = repo.backend.split(files, [fast, slow])
+            assert parts == [(fast, files)]
+
+            # Big pulls are spread according to the throughput of mirrors
+            repo.backend.split_min_size = 0
+            parts = dict(repo.backend.split(files, [fast, slow]))
+            assert len(parts[fast]) == 6
+            assert len(parts[slow]) == 2
+
+    def test_pull_mirrors(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path, tempfile.TemporaryDirectory() as mirror_path:
+            shutil.rmtree(mirror_path)
+            shutil.copytree(self.remote_path, mirror_path)
+            repo = self.get_repo(app, local_path, mirror_path)
+            repo.backend.split_min_size = 0
+
+            stats = repo.pull(local_path + '/subdir')
+
+            assert stats['files'] == 7
+            for mirror in repo.backend.mirrors:
+                assert mirror.healthy
+                assert mirror.latency is not None
+                assert mirror.throughput is not None
+
+            for dir_, _, files in os.walk(os.path.join(self.remote_path, 'subdir')):
+                for file_name in files:
+                    rel_path = os.path.relpath(os.path.join(dir_, file_name), self.remote_path)
+                    assert os.path.exists(os.path.join(local_path, rel_path))
+
+    def test_mirror_failover(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path, tempfile.TemporaryDirectory() as mirror_path:
+            shutil.rmtree(mirror_path)
+            shutil.copytree(self.remote_path, mirror_path)
+            repo = self.get_repo(app, local_path, mirror_path)
+            repo.backend.split_min_size = 0
+            main, mirror = repo.backend.mirrors
+
+            def failing_copy(*args):
+                raise OSError("Connection lost")
+
+            mirror.backend._copy = failing_copy
+            try:
+                stats = repo.pull(local_path + '/subdir/subsubdir')
+            finally:
+                del mirror.backend._copy
+
+            assert stats['files'] == 3
+            assert main.healthy
+            assert not mirror.healthy
+            for file_name in ['poutrelle.tsv', 'poutrelle.xml', 'subsubfile.txt']:
+                assert os.path.exists(os.path.join(local_path, 'subdir/subsubdir', file_name))
+
+    def test_unhealthy_mirror(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path, tempfile.TemporaryDirectory() as mirror_path:
+            repo = self.get_repo(app, local_path, mirror_path + '/not_mounted')
+
+            assert sorted([entry['Path'] for entry in repo.remote_list(local_path + '/subdir/subsubdir')]) == ['poutrelle.tsv', 'poutrelle.xml', 'subsubfile.txt']
+
+            main, mirror = repo.backend.mirrors
+            assert main.healthy
+            assert not mirror.healthy
+            assert repo.backend.ranked_mirrors() == [main]
+
+            stats = repo.pull(local_path + '/file.txt')
+            assert stats['files'] == 1
+            assert os.path.exists(local_path + '/file.txt')
@@ -0,0 +1,103 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from baricadr.db_models import BaricadrTask, CoAccess
+from baricadr.extensions import db
+
+import pytest
+
+from . import BaricadrTestCase
+
+
+class TestPrefetch(BaricadrTestCase):
+
+    remote_path = os.path.join(os.path.dirname(__file__), '..', 'test-data', 'test-repo')
+
+    def setup_method(self):
+        self.task_ids = []
+        self.repo_path = None
+
+    def teardown_method(self):
+        if self.task_ids:
+            for task in BaricadrTask.query.filter(BaricadrTask.task_id.in_(self.task_ids)):
+                db.session.delete(task)
+            db.session.commit()
+        if self.repo_path:
+            CoAccess.query.filter(CoAccess.repo == self.repo_path).delete()
+            db.session.commit()
+
+    def get_repo(self, app, local_path, **options):
+        conf = {
+            local_path: dict({
+                'backend': 'local',
+                'url': self.remote_path,
+                'prefetch': True
+            }, **options)
+        }
+
+        app.repos.read_conf_from_str(str(conf))
+
+        return app.repos.get_repo(local_path)
+
+    def test_prefetch_conf(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            repo = self.get_repo(app, local_path, prefetch_patterns='{stem}.*, {prefix}_R*', prefetch_max_files=3)
+            assert repo.prefetcher.patterns == ['{stem}.*', '{prefix}_R*']
+            assert repo.prefetcher.max_files == 3
+            assert repo.prefetcher.learn
+
+            with pytest.raises(ValueError):
+                self.get_repo(app, local_path, prefetch_max_files='many')
+
+            conf = {
+                local_path: {
+                    'backend': 'local',
+                    'url': self.remote_path
+                }
+            }
+            app.repos.read_conf_from_str(str(conf))
+            assert app.repos.get_repo(local_path).prefetcher is None
+
+    def test_candidates_patterns(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            repo = self.get_repo(app, local_path, prefetch_patterns='{stem}.*', prefetch_learn=False)
+            target = local_path + '/subdir/subsubdir'
+
+            repo.pull(target + '/poutrelle.tsv')
+
+            assert repo.prefetcher.candidates(target + '/poutrelle.tsv') == [target + '/poutrelle.xml']
+
+            # Already pulled
+            repo.pull(target + '/poutrelle.xml')
+            assert repo.prefetcher.candidates(target + '/poutrelle.tsv') == []
+
+    def test_candidates_learned(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            self.repo_path = local_path
+            repo = self.get_repo(app, local_path)
+            target = local_path + '/subdir/subsubdir'
+
+            # Users pulled subsubfile.txt, then poutrelle.xml, twice
+            self.task_ids = ['id_first_1', 'id_next_1', 'id_first_2', 'id_next_2', 'id_other_dir']
+            now = datetime.utcnow()
+            db.session.add(BaricadrTask(path=target + '/subsubfile.txt', type='pull', task_id='id_first_1', created=now - timedelta(days=1, minutes=2)))
+            db.session.add(BaricadrTask(path=target + '/poutrelle.xml', type='pull', task_id='id_next_1', created=now - timedelta(days=1)))
+            db.session.add(BaricadrTask(path=target + '/subsubfile.txt', type='pull', task_id='id_first_2', created=now - timedelta(minutes=2)))
+            db.session.add(BaricadrTask(path=local_path + '/subdir/subfile.txt', type='pull', task_id='id_other_dir', created=now - timedelta(minutes=1)))
+            db.session.add(BaricadrTask(path=target + '/poutrelle.xml', type='pull', task_id='id_next_2', created=now))
+            db.session.commit()
+
+            repo.prefetcher.record(target + '/poutrelle.xml', now - timedelta(days=1))
+            assert repo.prefetcher.candidates(target + '/subsubfile.txt') == []
+
+            repo.prefetcher.record(target + '/poutrelle.xml', now)
+            assert repo.prefetcher.candidates(target + '/subsubfile.txt') == [target + '/poutrelle.xml']
+
+            co_accesses = CoAccess.query.filter(CoAccess.repo == local_path).all()
+            assert len(co_accesses) == 1
+            assert co_accesses[0].path == target + '/subsubfile.txt'
+            assert co_accesses[0].count == 2
@@ -0,0 +1,69 @@
+import os
+import tempfile
+
+from baricadr.model.backends import PullPlan
+from baricadr.model.progress import TransferProgress
+
+from . import BaricadrTestCase
+
+
+class TestProgress(BaricadrTestCase):
+
+    def test_rounds(self, app):
+        plan = PullPlan(None, '/foo/bar', [{'Path': 'file%s' % i, 'Size': 1000} for i in range(4)])
+        progress = TransferProgress(plan)
+
+        progress.set_round_stats(2500, 2, speed=500)
+        stats = progress.get_stats()
+        assert stats['files'] == 2
+        assert stats['total_files'] == 4
+        assert stats['bytes'] == 2500
+        assert stats['total_bytes'] == 4000
+        assert stats['eta'] == 3
+
+        # After a retry, rclone stats start from 0
+        progress.start_round()
+        progress.set_round_stats(1000, 1, speed=1000)
+        stats = progress.get_stats()
+        assert stats['files'] == 3
+        assert stats['bytes'] == 3500
+
+    def test_throttle(self, app):
+        plan = PullPlan(None, '/foo/bar', [{'Path': 'file', 'Size': 1000}])
+        reports = []
+        progress = TransferProgress(plan, reports.append, interval=3600)
+
+        progress.report()
+        progress.add_bytes(100)
+        progress.report()
+        assert len(reports) == 1
+
+        progress.report(force=True)
+        assert len(reports) == 2
+        assert reports[1]['bytes'] == 100
+
+    def test_pull_progress(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            conf = {
+                local_path: {
+                    'backend': 'local',
+                    'url': os.path.join(os.path.dirname(__file__), '..', 'test-data', 'test-repo')
+                }
+            }
+
+            app.repos.read_conf_from_str(str(conf))
+            target = local_path + '/subdir'
+            repo = app.repos.get_repo(target)
+
+            reports = []
+            stats = repo.pull(target, progress_callback=reports.append)
+
+            # Totals are known from the start
+            assert reports[0]['files'] == 0
+            assert reports[0]['total_files'] == 7
+            assert reports[0]['total_bytes'] == stats['bytes']
+
+            assert reports[-1]['files'] == 7
+            assert reports[-1]['bytes'] == stats['bytes']
+            assert reports[-1]['eta'] == 0
@@ -0,0 +1,170 @@
+import os
+import tempfile
+
+from baricadr.db_models import BaricadrTask
+from baricadr.extensions import db
+from baricadr.model.backends import PullPlan
+from baricadr.model.checkpoint import Checkpoint
+
+from . import BaricadrTestCase
+
+
+class TestPullCoalesce(BaricadrTestCase):
+
+    remote_path = os.path.join(os.path.dirname(__file__), '..', 'test-data', 'test-repo')
+
+    def setup_method(self):
+        self.task_ids = []
+
+    def teardown_method(self):
+        if self.task_ids:
+            for task in BaricadrTask.query.filter(BaricadrTask.task_id.in_(self.task_ids)):
+                db.session.delete(task)
+                db.session.commit()
+
+    def get_repo(self, app, local_path):
+        conf = {
+            local_path: {
+                'backend': 'local',
+                'url': self.remote_path
+            }
+        }
+
+        app.repos.read_conf_from_str(str(conf))
+
+        return app.repos.get_repo(local_path)
+
+    def test_plan_siblings(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            repo = self.get_repo(app, local_path)
+
+            listed = []
+            list_entries = repo.backend.list_entries
+
+            def counting_list_entries(rel_path, *args, **kwargs):
+                listed.append(rel_path)
+                return list_entries(rel_path, *args, **kwargs)
+
+            repo.backend.list_entries = counting_list_entries
+
+            others = [
+                local_path + '/subdir/subsubdir/poutrelle.xml',
+                local_path + '/subdir/subsubdir/subsubfile.txt',
+                local_path + '/subdir/subsubdir/does_not_exist.txt'
+            ]
+            plan, errors = repo.backend.plan_pull_many(repo, local_path + '/subdir/subsubdir/poutrelle.tsv', others)
+
+            assert sorted([remote_file['Path'] for remote_file in plan.files]) == [
+                'subdir/subsubdir/poutrelle.tsv',
+                'subdir/subsubdir/poutrelle.xml',
+                'subdir/subsubdir/subsubfile.txt'
+            ]
+            assert list(errors.keys()) == [local_path + '/subdir/subsubdir/does_not_exist.txt']
+
+            # The main path, the parent directory of the siblings, and the path which was not found in it
+            assert listed == ['subdir/subsubdir/poutrelle.tsv', 'subdir/subsubdir', 'subdir/subsubdir/does_not_exist.txt']
+
+    def test_pull_many(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            repo = self.get_repo(app, local_path)
+
+            # Already pulled: nothing to transfer for this one
+            os.makedirs(local_path + '/subdir')
+            with open(local_path + '/subdir/subfile.txt', 'w') as local_file:
+                local_file.write('local')
+
+            others = [
+                local_path + '/subdir/subfile.txt',
+                local_path + '/subdir/subsubdir2',
+                local_path + '/file2.txt',
+                local_path + '/does_not_exist'
+            ]
+            stats = repo.pull(local_path + '/file.txt', other_paths=others)
+
+            assert stats['files'] == 5
+            assert list(stats['errors'].keys()) == [local_path + '/does_not_exist']
+
+            assert os.path.exists(local_path + '/file.txt')
+            assert os.path.exists(local_path + '/file2.txt')
+            assert os.path.exists(local_path + '/subdir/subsubdir2/subsubsubdir/subsubsubdir2/a file')
+            assert not os.path.exists(local_path + '/subdir/subsubdir')
+            with open(local_path + '/subdir/subfile.txt', 'r') as local_file:
+                assert local_file.read() == 'local'
+
+    def test_pull_many_checkpoint(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            repo = self.get_repo(app, local_path)
+            target = local_path + '/subdir/subsubdir'
+
+            # Checkpoint of an interrupted pull of the main path only
+            entry = next(repo.iter_remote_list(target + '/subsubfile.txt', max_depth=0, from_root=True, full=True))
+            Checkpoint(repo, target, 'some-task').save(PullPlan(repo, target, [{'Path': entry['Path'], 'Size': entry['Size'], 'ModTime': entry['ModTime']}]))
+
+            others = [
+                local_path + '/file2.txt',
+                local_path + '/does_not_exist'
+            ]
+            stats = repo.pull(target, other_paths=others)
+
+            assert stats['files'] == 2
+            assert list(stats['errors'].keys()) == [local_path + '/does_not_exist']
+            assert os.path.exists(target + '/subsubfile.txt')
+            assert os.path.exists(local_path + '/file2.txt')
+            assert not os.path.exists(target + '/poutrelle.tsv')
+
+            assert Checkpoint(repo, target).load() is None
+
+    def test_claim(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            repo = self.get_repo(app, local_path)
+
+            self.task_ids = ['id_leader', 'id_sibling', 'id_subdir', 'id_locked', 'id_locking', 'id_freeze', 'id_started', 'id_other_repo']
+
+            db.session.add(BaricadrTask(path=local_path + '/file.txt', type="pull", task_id='id_leader', status='started'))
+            db.session.add(BaricadrTask(path=local_path + '/file2.txt', type="pull", task_id='id_sibling', email='someone@example.org'))
+            db.session.add(BaricadrTask(path=local_path + '/subdir/subsubdir2', type="pull", task_id='id_subdir'))
+            # Needs to wait for the freeze of a subdirectory
+            db.session.add(BaricadrTask(path=local_path + '/subdir/subsubdir', type="pull", task_id='id_locked'))
+            db.session.add(BaricadrTask(path=local_path + '/subdir/subsubdir/poutrelle.tsv', type="freeze", task_id='id_locking', status='freezing'))
+            db.session.add(BaricadrTask(path=local_path + '/subdir', type="freeze", task_id='id_freeze'))
+            db.session.add(BaricadrTask(path=local_path + '/subdir/subfile.txt', type="pull", task_id='id_started', status='started'))
+            db.session.add(BaricadrTask(path='/some/other/repo/file.txt', type="pull", task_id='id_other_repo'))
+            db.session.commit()
+
+            claimed = app.repos.claim_coalesced_pulls('id_leader', repo)
+
+            assert sorted([task.task_id for task in claimed]) == ['id_sibling', 'id_subdir']
+            for task in claimed:
+                assert task.status == 'pulling'
+                assert task.coalesced_into == 'id_leader'
+                assert task.started is not None
+
+            # Already claimed
+            assert app.repos.claim_coalesced_pulls('id_started', repo) == []
+
+    def test_claim_waiting(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            repo = self.get_repo(app, local_path)
+
+            self.task_ids = ['id_leader', 'id_queued_freeze', 'id_waiting', 'id_queued_pull', 'id_waiting_pull', 'id_free']
+
+            db.session.add(BaricadrTask(path=local_path + '/file.txt', type="pull", task_id='id_leader', status='started'))
+            # Freeze of a subdirectory not started yet, in the wait_for of the next pull
+            db.session.add(BaricadrTask(path=local_path + '/subdir/subsubdir/poutrelle.tsv', type="freeze", task_id='id_queued_freeze'))
+            db.session.add(BaricadrTask(path=local_path + '/subdir/subsubdir', type="pull", task_id='id_waiting'))
+            # Same with a pull of a subdirectory
+            db.session.add(BaricadrTask(path=local_path + '/subdir/subsubdir2/subsubfile.txt', type="pull", task_id='id_queued_pull'))
+            db.session.add(BaricadrTask(path=local_path + '/subdir/subsubdir2', type="pull", task_id='id_waiting_pull'))
+            db.session.add(BaricadrTask(path=local_path + '/file2.txt', type="pull", task_id='id_free'))
+            db.session.commit()
+
+            claimed = app.repos.claim_coalesced_pulls('id_leader', repo)
+
+            assert sorted([task.task_id for task in claimed]) == ['id_free', 'id_queued_pull']
+            assert BaricadrTask.query.filter_by(task_id='id_waiting').one().status == 'new'
+            assert BaricadrTask.query.filter_by(task_id='id_waiting_pull').one().status == 'new'
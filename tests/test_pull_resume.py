@@ -0,0 +1,166 @@
+import glob
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from baricadr.model.backends import PullPlan
+from baricadr.model.checkpoint import Checkpoint
+from baricadr.model.progress import TransferProgress
+
+import pytest
+
+from . import BaricadrTestCase
+
+
+class TestPullResume(BaricadrTestCase):
+
+    remote_path = os.path.join(os.path.dirname(__file__), '..', 'test-data', 'test-repo')
+
+    def get_repo(self, app, local_path):
+        conf = {
+            local_path: {
+                'backend': 'local',
+                'url': self.remote_path
+            }
+        }
+
+        app.repos.read_conf_from_str(str(conf))
+
+        return app.repos.get_repo(local_path)
+
+    def test_resume_partial(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            repo = self.get_repo(app, local_path)
+            target = local_path + '/subdir/subsubdir'
+            remote_file = os.path.join(self.remote_path, 'subdir/subsubdir/poutrelle.tsv')
+
+            class Killed(BaseException):
+                pass
+
+            calls = []
+
+            def killed_copy_file_range(src_fd, dest_fd, count):
+                # The worker is killed after a chunk of poutrelle.tsv
+                calls.append(count)
+                if len(calls) > 1:
+                    raise Killed()
+                return os.write(dest_fd, os.read(src_fd, count))
+
+            repo.backend.copy_chunk_size = 10
+            with mock.patch('baricadr.model.backends.fcntl.ioctl', side_effect=OSError('No reflink')), mock.patch('os.copy_file_range', killed_copy_file_range, create=True):
+                with pytest.raises(Killed):
+                    repo.pull(target + '/poutrelle.tsv')
+
+            partials = glob.glob(target + '/.poutrelle.tsv.*.baricadr-partial')
+            assert len(partials) == 1
+            assert os.stat(partials[0]).st_size == 10
+
+            # Marker to check the partial file is kept
+            with open(partials[0], 'r+') as partial_file:
+                partial_file.write('XXXX')
+
+            # Partial file from an older version
+            stale_partial = target + '/.subsubfile.txt.baricadr-partial'
+            with open(stale_partial, 'w') as partial_file:
+                partial_file.write('XXXX')
+
+            repo.pull(target)
+
+            with open(target + '/poutrelle.tsv', 'r') as local_file, open(remote_file, 'r') as orig_file:
+                local_content = local_file.read()
+                orig_content = orig_file.read()
+            assert local_content == 'XXXX' + orig_content[4:]
+
+            with open(target + '/subsubfile.txt', 'r') as local_file, open(os.path.join(self.remote_path, 'subdir/subsubdir/subsubfile.txt'), 'r') as orig_file:
+                assert local_file.read() == orig_file.read()
+
+            assert glob.glob(target + '/.*.baricadr-partial') == []
+
+    def test_retry_failed(self, app):
+
+        app.config['PULL_RETRY_DELAY'] = 0
+
+        with tempfile.TemporaryDirectory() as local_path:
+            repo = self.get_repo(app, local_path)
+            target = local_path + '/subdir/subsubdir'
+
+            copy = repo.backend._copy
+            calls = []
+
+            def failing_copy(src, *args):
+                calls.append(os.path.basename(src))
+                # First try fails for this file only
+                if os.path.basename(src) == 'poutrelle.tsv' and calls.count('poutrelle.tsv') == 1:
+                    raise OSError("Connection lost")
+                copy(src, *args)
+
+            repo.backend._copy = failing_copy
+            try:
+                stats = repo.pull(target)
+            finally:
+                repo.backend._copy = copy
+
+            assert stats['files'] == 3
+            assert sorted(calls) == ['poutrelle.tsv', 'poutrelle.tsv', 'poutrelle.xml', 'subsubfile.txt']
+            assert os.path.isfile(target + '/poutrelle.tsv')
+
+    def test_resume_checkpoint(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            repo = self.get_repo(app, local_path)
+            target = local_path + '/subdir'
+
+            # Checkpoint of an interrupted pull: subfile.txt was already transferred
+            files = []
+            for rel_path in ['subdir/subfile.txt', 'subdir/subsubdir/subsubfile.txt']:
+                entry = next(repo.iter_remote_list(local_path + '/' + rel_path, max_depth=0, from_root=True, full=True))
+                files.append({'Path': entry['Path'], 'Size': entry['Size'], 'ModTime': entry['ModTime']})
+            Checkpoint(repo, target, 'some-task').save(PullPlan(repo, target, files))
+
+            os.makedirs(target + '/subsubdir')
+            shutil.copy(os.path.join(self.remote_path, 'subdir/subfile.txt'), target + '/subfile.txt')
+
+            # Truncated file left by the interrupted transfer
+            with open(target + '/subsubdir/subsubfile.txt', 'w') as local_file:
+                local_file.write('trunc')
+
+            stats = repo.pull(target)
+
+            # Only the remaining file of the checkpoint was transferred
+            assert stats['files'] == 1
+            with open(target + '/subsubdir/subsubfile.txt', 'r') as local_file, open(os.path.join(self.remote_path, 'subdir/subsubdir/subsubfile.txt'), 'r') as orig_file:
+                assert local_file.read() == orig_file.read()
+            assert not os.path.exists(target + '/subsubdir/poutrelle.tsv')
+
+            # Checkpoint is removed once finished
+            assert Checkpoint(repo, target).load() is None
+
+    def test_copy_fallback_progress(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            repo = self.get_repo(app, local_path)
+            src = os.path.join(self.remote_path, 'subdir/subsubdir/poutrelle.tsv')
+            dest = os.path.join(local_path, 'poutrelle.tsv')
+            open(dest, 'w').close()
+            size = os.stat(src).st_size
+
+            calls = []
+
+            def failing_copy_file_range(src_fd, dest_fd, count):
+                # Copies a chunk, then fails
+                calls.append(count)
+                if len(calls) > 1:
+                    raise OSError('Cross-device link')
+                return os.write(dest_fd, os.read(src_fd, count))
+
+            repo.backend.copy_chunk_size = 10
+            progress = TransferProgress(PullPlan(repo, local_path, [{'Path': 'poutrelle.tsv', 'Size': size}]))
+            with mock.patch('baricadr.model.backends.fcntl.ioctl', side_effect=OSError('No reflink')), mock.patch('os.copy_file_range', failing_copy_file_range, create=True):
+                repo.backend._copy(src, dest, progress=progress)
+
+            assert len(calls) == 2
+            assert progress.bytes == size
+            with open(src, 'rb') as src_file, open(dest, 'rb') as dest_file:
+                assert src_file.read() == dest_file.read()
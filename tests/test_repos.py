@@ -1,6 +1,8 @@
 import os
 import tempfile
 
+from baricadr.model.backends import PullPlan
+
 import pytest
 
 from . import BaricadrTestCase
@@ -184,3 +186,76 @@ class TestRepos(BaricadrTestCase):
 
         with pytest.raises(ValueError):
             app.repos.do_read_conf(str(conf))
+
+    def test_transfer_options_conf(self, app):
+        conf = {
+            '/foo/bar': {
+                'backend': 's3',
+                'url': 'google',
+                'user': 'someone',
+                'password': 'xxxxx',
+                'transfers': 12,
+                'buffer_size': '32M'
+            },
+        }
+
+        repos = app.repos.do_read_conf(str(conf))
+        repo = repos['/foo/bar']
+
+        plan = PullPlan(repo, '/foo/bar', [{'Path': 'some/file', 'Size': 12}])
+        assert repo.get_transfer_options(plan) == {'transfers': 12, 'buffer_size': '32M'}
+
+    def test_transfer_options_conf_invalid(self, app):
+        conf = {
+            '/foo/bar': {
+                'backend': 's3',
+                'url': 'google',
+                'user': 'someone',
+                'password': 'xxxxx',
+                'transfers': 'xxxx'
+            },
+        }
+
+        with pytest.raises(ValueError):
+            app.repos.do_read_conf(str(conf))
+
+        conf['/foo/bar']['transfers'] = 4
+        conf['/foo/bar']['buffer_size'] = 'big'
+
+        with pytest.raises(ValueError):
+            app.repos.do_read_conf(str(conf))
+
+        conf['/foo/bar']['buffer_size'] = '16M'
+        conf['/foo/bar']['transfer_tuning'] = 'fast'
+
+        with pytest.raises(ValueError):
+            app.repos.do_read_conf(str(conf))
+
+    def test_transfer_options_auto(self, app):
+        conf = {
+            '/foo/bar': {
+                'backend': 's3',
+                'url': 'google',
+                'user': 'someone',
+                'password': 'xxxxx',
+                'transfer_tuning': 'auto',
+                'checkers': 3
+            },
+        }
+
+        repos = app.repos.do_read_conf(str(conf))
+        repo = repos['/foo/bar']
+
+        # Many small files
+        plan = PullPlan(repo, '/foo/bar', [{'Path': 'file%s' % i, 'Size': 1000} for i in range(2000)])
+        options = repo.get_transfer_options(plan)
+        assert options['transfers'] == 32
+        assert options['multi_thread_streams'] == 0
+        # Explicit options have precedence
+        assert options['checkers'] == 3
+
+        # One big file
+        plan = PullPlan(repo, '/foo/bar', [{'Path': 'big.bam', 'Size': 200 * 1024 * 1024 * 1024}])
+        options = repo.get_transfer_options(plan)
+        assert options['transfers'] == 1
+        assert options['multi_thread_streams'] == 8
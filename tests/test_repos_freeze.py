@@ -1,6 +1,18 @@
+import gzip
+import json
 import os
 import shutil
-from datetime import datetime
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from baricadr.app import check_watermarks
+from baricadr.db_models import EvictionState
+from baricadr.extensions import db
+from baricadr.model.freeze import EvictionHeap, freezable_mask, parse_mod_times
+
+import numpy
 
 import pytest
 
@@ -20,6 +32,8 @@ class TestReposFreeze(BaricadrTestCase):
     def teardown_method(self):
         if os.path.exists(self.testing_repo):
             shutil.rmtree(self.testing_repo)
+        EvictionState.query.delete()
+        db.session.commit()
 
     def test_freeze_age_whole_dir(self, app):
 
@@ -41,7 +55,7 @@ class TestReposFreeze(BaricadrTestCase):
 
         self.set_old_atime(self.testing_repo)
 
-        freezed = repo.freeze(self.testing_repo)
+        freezed = self.freeze_files(repo, self.testing_repo)
 
         expected_freezed = [
             os.path.join(self.testing_repo, 'file.txt'),
@@ -80,7 +94,7 @@ class TestReposFreeze(BaricadrTestCase):
 
         self.set_old_atime(self.testing_repo)
 
-        freezed = repo.freeze(os.path.join(self.testing_repo, 'subdir'))
+        freezed = self.freeze_files(repo, os.path.join(self.testing_repo, 'subdir'))
 
         not_expected_freezed = [
             os.path.join(self.testing_repo, 'file.txt'),
@@ -147,7 +161,7 @@ class TestReposFreeze(BaricadrTestCase):
         for nexp_freezed in not_expected_freezed:
             assert os.path.exists(nexp_freezed)
 
-        freezed = repo.freeze(self.testing_repo)
+        freezed = self.freeze_files(repo, self.testing_repo)
 
         assert sorted(freezed) == sorted(expected_freezed)
 
@@ -200,7 +214,7 @@ class TestReposFreeze(BaricadrTestCase):
         for nexp_freezed in not_expected_freezed:
             assert os.path.exists(nexp_freezed)
 
-        freezed = repo.freeze(self.testing_repo)
+        freezed = self.freeze_files(repo, self.testing_repo)
 
         assert sorted(freezed) == sorted(expected_freezed)
 
@@ -231,7 +245,7 @@ class TestReposFreeze(BaricadrTestCase):
 
         self.set_old_atime(self.testing_repo)
 
-        freezed = repo.freeze(self.testing_repo, dry_run=True)
+        freezed = self.freeze_files(repo, self.testing_repo, dry_run=True)
 
         expected_freezed = [
             os.path.join(self.testing_repo, 'file.txt'),
@@ -275,7 +289,7 @@ class TestReposFreeze(BaricadrTestCase):
         self.set_old_atime(self.testing_repo)
         assert os.path.exists(local_file)
 
-        freezed = repo.freeze(self.testing_repo)
+        freezed = self.freeze_files(repo, self.testing_repo)
 
         expected_freezed = [
             os.path.join(self.testing_repo, 'file.txt'),
@@ -359,7 +373,7 @@ class TestReposFreeze(BaricadrTestCase):
         now_time = dt.timestamp()
         os.utime(accessed_file, (now_time, now_time))
 
-        freezed = repo.freeze(self.testing_repo)
+        freezed = self.freeze_files(repo, self.testing_repo)
 
         expected_freezed = [
             os.path.join(self.testing_repo, 'file.txt'),
@@ -420,7 +434,7 @@ class TestReposFreeze(BaricadrTestCase):
         for nexp_freezed in not_expected_freezed:
             assert os.path.exists(nexp_freezed)
 
-        freezed = repo.freeze(self.testing_repo)
+        freezed = self.freeze_files(repo, self.testing_repo)
 
         assert freezed == []
 
@@ -464,7 +478,7 @@ class TestReposFreeze(BaricadrTestCase):
         with open(repo_dir + '/subfile.txt', 'w') as local_file:
             local_file.write('This subfile was touched locally\n')
 
-        freezed = repo.freeze(self.testing_repo, force=True)
+        freezed = self.freeze_files(repo, self.testing_repo, force=True)
 
         expected_freezed = [
             os.path.join(self.testing_repo, 'file2.txt'),
@@ -494,3 +508,206 @@ class TestReposFreeze(BaricadrTestCase):
 
         with open(repo_dir + '/subfile.txt', 'r') as local_file:
             assert local_file.readline() == 'This subfile was touched locally\n'
+
+    def test_freeze_scaling(self, app):
+
+        conf = {
+            self.testing_repo: {
+                'backend': 'local',
+                'url': self.template_repo,
+                'freezable': True
+            }
+        }
+
+        app.repos.read_conf_from_str(str(conf))
+        repo = app.repos.get_repo(self.testing_repo)
+
+        bench_dir = os.path.join(self.testing_repo, 'bench')
+        os.mkdir(bench_dir)
+        mtime = datetime.now(timezone.utc).isoformat()
+        small_index = {}
+        for i in range(500):
+            with open(os.path.join(bench_dir, 'file%s' % i), 'w') as local_file:
+                local_file.write('bench content\n')
+            small_index['bench/file%s' % i] = {'ModTime': mtime}
+
+        # Same local files, with a much bigger remote listing
+        big_index = dict(small_index)
+        for i in range(200000):
+            big_index['other/file%s' % i] = {'ModTime': mtime}
+
+        def bench(remote_index):
+            durations = []
+            for i in range(3):
+                start = time.time()
+                freezables = repo._get_freezable(bench_dir, remote_index, force=True)
+                durations.append(time.time() - start)
+                assert len(freezables) == 500
+
+            return min(durations)
+
+        # Checking a file does not depend on the size of the remote listing
+        assert bench(big_index) < 3 * bench(small_index) + 0.1
+
+    def test_freezable_mask(self, app):
+
+        remote_mtimes = parse_mod_times([
+            '2021-03-04T05:06:07+00:00',
+            '2021-03-04T06:06:07.500000000+01:00',
+            '2021-03-04T05:06:07Z',
+            '2021-03-04T03:06:07-02:00'
+        ])
+        assert list(remote_mtimes) == [1614834367, 1614834367.5, 1614834367, 1614834367]
+
+        now = time.time()
+        local_mtimes = numpy.array([1614834367, 1614834367, 1614834367 + 60, 1614834367])
+        local_atimes = numpy.array([now - 10 * 86400, now, now - 10 * 86400, now - 2 * 86400])
+
+        # Modified locally after pull, or accessed recently
+        assert list(freezable_mask(local_mtimes, local_atimes, remote_mtimes, 3)) == [True, False, False, False]
+        assert list(freezable_mask(local_mtimes, local_atimes, remote_mtimes, 3, force=True)) == [True, True, False, True]
+
+    def test_freeze_report_prune(self, app):
+
+        conf = {
+            self.testing_repo: {
+                'backend': 'local',
+                'url': self.template_repo,
+                'freezable': True,
+                'freeze_prune_empty': True
+            }
+        }
+
+        app.repos.read_conf_from_str(str(conf))
+        repo = app.repos.get_repo(self.testing_repo)
+        subdir = os.path.join(self.testing_repo, 'subdir')
+
+        with tempfile.TemporaryDirectory() as report_dir:
+            report_path = os.path.join(report_dir, 'report.jsonl.gz')
+            stats = repo.freeze(subdir, force=True, dry_run=True, report_path=report_path)
+
+            with gzip.open(report_path, 'rt') as report:
+                records = [json.loads(line) for line in report]
+
+            assert stats['files'] == 7
+            assert stats['bytes'] == sum(record['size'] for record in records)
+            assert len(records) == 7
+            assert set(record['action'] for record in records) == set(['would_freeze'])
+            assert os.path.exists(subdir + '/subsubdir/poutrelle.tsv')
+
+            stats = repo.freeze(subdir, force=True, report_path=report_path)
+
+            with gzip.open(report_path, 'rt') as report:
+                records = [json.loads(line) for line in report]
+
+        assert stats['files'] == 7
+        assert stats['dirs'] == len([record for record in records if record['action'] == 'removed_dir'])
+        assert len([record for record in records if record['action'] == 'freezed']) == 7
+        assert {'path': 'subdir/subsubdir/poutrelle.tsv', 'action': 'freezed', 'size': 25} in records
+        assert {'path': 'subdir', 'action': 'removed_dir'} in records
+
+        # Only empty directories were removed
+        assert not os.path.exists(subdir)
+        assert os.path.exists(os.path.join(self.testing_repo, 'file.txt'))
+
+    def test_eviction_heap(self, app):
+
+        heap = EvictionHeap(30, now=100000)
+        heap.push('recent_big', 25, 99990)
+        heap.push('medium', 10, 99900)
+        heap.push('old', 20, 99000)
+        heap.push('oldest_small', 5, 90000)
+
+        # Best scores (age * size) first, until there are enough bytes
+        assert heap.files() == [('oldest_small', 5), ('old', 20), ('medium', 10)]
+        assert heap.size == 35
+
+    def test_evict_watermarks(self, app):
+
+        conf = {
+            self.testing_repo: {
+                'backend': 'sftp',
+                'url': 'sftp:test-repo/',
+                'user': 'foo',
+                'password': 'pass',
+                'freezable': True,
+                'freeze_high_watermark': 90,
+                'freeze_low_watermark': 89
+            }
+        }
+
+        app.repos.read_conf_from_str(str(conf))
+        repo = app.repos.get_repo(self.testing_repo)
+        assert repo.freeze_low_watermark == 89
+
+        # Accessed recently enough to be kept by freeze_age, but the oldest accessed and biggest file
+        self.set_old_atime(self.testing_repo, age=24 * 3600)
+        oldest = os.path.join(self.testing_repo, 'subdir/subsubdir/poutrelle.tsv')
+        self.set_old_atime(oldest, age=48 * 3600, recursive=False)
+
+        with mock.patch('baricadr.model.repos.disk_usage', return_value=(899, 1000)):
+            assert repo.evict()['files'] == 0
+
+        # 10 bytes to free
+        with mock.patch('baricadr.model.repos.disk_usage', return_value=(900, 1000)):
+            assert self.freeze_files(repo, evict=True) == [oldest]
+
+        assert not os.path.exists(oldest)
+        assert os.path.exists(os.path.join(self.testing_repo, 'subdir/subsubdir/poutrelle.xml'))
+
+        conf[self.testing_repo]['freeze_low_watermark'] = 90
+        with pytest.raises(ValueError):
+            app.repos.read_conf_from_str(str(conf))
+
+        # Would never evict
+        del conf[self.testing_repo]['freeze_high_watermark']
+        with pytest.raises(ValueError):
+            app.repos.read_conf_from_str(str(conf))
+
+    def test_evict_backoff(self, app):
+
+        conf = {
+            self.testing_repo: {
+                'backend': 'sftp',
+                'url': 'sftp:test-repo/',
+                'user': 'foo',
+                'password': 'pass',
+                'freezable': True,
+                'freeze_high_watermark': 90
+            }
+        }
+
+        app.repos.read_conf_from_str(str(conf))
+        repo = app.repos.get_repo(self.testing_repo)
+        self.set_old_atime(self.testing_repo, age=24 * 3600)
+        interval = app.config['WATERMARK_CHECK_INTERVAL']
+
+        # Full of data outside of the repo: the low watermark cannot be reached
+        with mock.patch('baricadr.model.repos.disk_usage', return_value=(10 ** 9, 10 ** 9)):
+            assert repo.evict()['files'] == 9
+
+            state = EvictionState.query.filter_by(repo=repo.local_path).one()
+            assert state.failures == 1
+            assert state.next_try > datetime.utcnow() + timedelta(seconds=2 * interval - 60)
+
+            # No listing nor walk until the delay expires
+            with mock.patch.object(repo, '_get_remote_index') as get_remote_index:
+                assert repo.evict()['files'] == 0
+                assert not get_remote_index.called
+
+            with mock.patch('baricadr.app.disk_usage', return_value=(10 ** 9, 10 ** 9)), mock.patch('baricadr.app.freeze_repo') as freeze_repo:
+                check_watermarks(app)
+                assert not freeze_repo.called
+
+            # Delay doubled after another failure
+            state.next_try = datetime.utcnow()
+            db.session.commit()
+            assert repo.evict()['files'] == 0
+            state = EvictionState.query.filter_by(repo=repo.local_path).one()
+            assert state.failures == 2
+            assert state.next_try > datetime.utcnow() + timedelta(seconds=4 * interval - 60)
+
+        # Evictions can run again once the disk usage went down
+        with mock.patch('baricadr.app.disk_usage', return_value=(0, 10 ** 9)):
+            check_watermarks(app)
+        assert EvictionState.query.filter_by(repo=repo.local_path).count() == 0
@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+
+from baricadr.db_models import BaricadrTask
+from baricadr.extensions import db
+from baricadr.model.simulator import DAY, EventLog, load_events, simulate, sweep, sweep_configs
+
+import pytest
+
+from . import BaricadrTestCase
+
+
+class TestSimulator(BaricadrTestCase):
+
+    def setup_method(self):
+        self.task_ids = []
+
+    def teardown_method(self):
+        if self.task_ids:
+            BaricadrTask.query.filter(BaricadrTask.task_id.in_(self.task_ids)).delete(synchronize_session=False)
+            db.session.commit()
+
+    def test_age_policy(self, app):
+
+        events = EventLog([0, 5 * DAY, 6 * DAY, 30 * DAY, 30 * DAY + 1], ['a', 'a', 'b', 'a', 'b'], {'a': 100, 'b': 10})
+
+        # Both freezed on day 21
+        result = simulate(events, 'age', freeze_age=10, freeze_interval=7)
+        assert result['hits'] == 1
+        assert result['bytes_pulled'] == 110
+        assert result['bytes_repulled'] == 110
+        assert result['peak_usage'] == 110
+
+        # Not freezed before day 35
+        result = simulate(events, 'age', freeze_age=25, freeze_interval=7)
+        assert result['hits'] == 3
+        assert result['bytes_repulled'] == 0
+        assert result['hit_ratio'] == 0.6
+
+    def test_capacity_policies(self, app):
+
+        events = EventLog(range(6), ['a', 'a', 'a', 'b', 'c', 'a'], {'a': 50, 'b': 50, 'c': 50})
+
+        result = simulate(events, 'lru', capacity=100)
+        assert (result['hits'], result['bytes_repulled'], result['peak_usage']) == (2, 50, 100)
+
+        # a is used more often than b
+        result = simulate(events, 'lfu', capacity=100)
+        assert (result['hits'], result['bytes_repulled'], result['peak_usage']) == (3, 0, 100)
+
+        # Big files are evicted first
+        events = EventLog(range(4), ['small', 'big', 'small2', 'small'], {'small': 5, 'big': 90, 'small2': 5})
+        assert simulate(events, 'lru', capacity=99)['hits'] == 0
+        result = simulate(events, 'gdsf', capacity=99)
+        assert (result['hits'], result['bytes_repulled']) == (1, 0)
+
+        with pytest.raises(ValueError):
+            simulate(events, 'lru')
+
+    def test_sweep(self, app):
+
+        events = EventLog([day * DAY for day in range(20)], ['a', 'b', 'c', 'a'] * 5, {'a': 10, 'b': 20, 'c': 30})
+        configs = sweep_configs(['age', 'lru', 'gdsf'], [30, 60], [2, 5])
+        assert len(configs) == 6
+
+        results = sweep(events, configs)
+        assert [(result['policy'], result['capacity'], result['freeze_age']) for result in results] == [('age', None, 2), ('age', None, 5), ('lru', 30, None), ('lru', 60, None), ('gdsf', 30, None), ('gdsf', 60, None)]
+
+        # In parallel processes, with chunks of different sizes
+        assert sweep(events, configs, workers=2) == results
+        assert sweep(events, configs, workers=4) == results
+        assert sweep(events, configs, workers=10) == results
+
+    def test_load_events(self, app):
+
+        now = datetime.utcnow()
+        self.task_ids = ['sim_1', 'sim_2', 'sim_3', 'sim_4', 'sim_5', 'sim_6']
+        db.session.add(BaricadrTask(path='/repos/sim/file1', type='pull', task_id='sim_1', status='finished', created=now - timedelta(days=3), transferred_bytes=100))
+        db.session.add(BaricadrTask(path='/repos/sim/file1', type='pull', task_id='sim_2', status='finished', created=now - timedelta(days=2), transferred_bytes=0))
+        # Unknown size
+        db.session.add(BaricadrTask(path='/repos/sim/file2', type='pull', task_id='sim_3', status='finished', created=now - timedelta(days=1), transferred_bytes=0))
+        db.session.add(BaricadrTask(path='/repos/sim/file3', type='pull', task_id='sim_4', status='failed', created=now))
+        db.session.add(BaricadrTask(path='/repos/sim', type='freeze', task_id='sim_5', status='finished', created=now))
+        db.session.add(BaricadrTask(path='/repos/simulated/file1', type='pull', task_id='sim_6', status='finished', created=now, transferred_bytes=10))
+        db.session.commit()
+
+        events, ignored = load_events('/repos/sim')
+        assert list(events.paths) == ['/repos/sim/file1']
+        assert list(events.sizes) == [100, 100]
+        assert ignored == 1
+
+        events, ignored = load_events('/repos/sim', now - timedelta(days=2, hours=12))
+        assert len(events) == 1
+
+        assert simulate(events, 'age')['hits'] == 0
@@ -0,0 +1,47 @@
+import os
+import tempfile
+
+from baricadr.model.walker import walk_files
+
+from . import BaricadrTestCase
+
+
+class TestWalker(BaricadrTestCase):
+
+    template_repo = os.path.join(os.path.dirname(__file__), '..', 'test-data', 'test-repo')
+
+    def walked(self, path, **kwargs):
+        return sorted(os.path.relpath(file_path, path) for file_path, _ in walk_files(path, **kwargs))
+
+    def test_walk_files(self, app):
+
+        expected = []
+        for root, subdirs, files in os.walk(self.template_repo):
+            for name in files:
+                expected.append(os.path.relpath(os.path.join(root, name), self.template_repo))
+
+        assert self.walked(self.template_repo, workers=4) == sorted(expected)
+
+        for file_path, file_stat in walk_files(self.template_repo):
+            assert file_stat.st_size == os.stat(file_path).st_size
+
+    def test_walk_max_depth(self, app):
+
+        assert self.walked(self.template_repo, max_depth=1) == ['file.txt', 'file2.txt']
+        assert self.walked(self.template_repo, max_depth=2) == ['file.txt', 'file2.txt', 'subdir/subfile.txt']
+
+    def test_walk_single_file(self, app):
+
+        file_path = os.path.join(self.template_repo, 'file.txt')
+        assert [walked for walked, _ in walk_files(file_path)] == [file_path]
+        assert list(walk_files(os.path.join(self.template_repo, 'does_not_exist'))) == []
+
+    def test_walk_symlinks(self, app):
+
+        with tempfile.TemporaryDirectory() as local_path:
+            os.symlink(os.path.abspath(os.path.join(self.template_repo, 'subdir')), os.path.join(local_path, 'link'))
+            with open(os.path.join(local_path, 'file.txt'), 'w') as local_file:
+                local_file.write('content\n')
+
+            assert self.walked(local_path) == ['file.txt']
+            assert 'link/subfile.txt' in self.walked(local_path, follow_links=True)